@@ -0,0 +1,51 @@
+"""
+Measures addon discovery: scanning and resolving a tree of generated addons, cold and from the manifest cache.
+Usage: python -m benchmarks.addons
+"""
+from tempfile import TemporaryDirectory
+import os
+import time
+from master.core import addons
+
+ADDONS = 2000
+PATHS = 4
+DEPENDENCIES = 3
+WORKERS = (1, 8)
+
+
+def generate(root: str) -> list:
+    paths = [os.path.join(root, f'path{index}') for index in range(PATHS)]
+    for index in range(ADDONS):
+        directory = os.path.join(paths[index % PATHS], f'addon_{index}')
+        os.makedirs(directory)
+        depends = [f'addon_{dependency}' for dependency in range(max(index - DEPENDENCIES, 0), index)]
+        with open(os.path.join(directory, addons.MANIFEST), 'w') as manifest:
+            manifest.write(repr({'name': f'Addon {index}', 'version': '1.0', 'depends': depends,
+                                 'summary': 'Generated addon ' * 20, 'data': [f'views/view_{n}.xml' for n in range(20)]}))
+    return paths
+
+
+def load(paths: list, cache_file: str, workers: int) -> tuple:
+    started = time.perf_counter()
+    cache = addons.ManifestCache(cache_file)
+    found = addons.scan(paths, cache, workers)
+    order = addons.resolve([f'addon_{index}' for index in range(ADDONS - 1, -1, -50)], found)
+    cache.set_order('benchmark', order)
+    cache.save()
+    return time.perf_counter() - started, cache.parsed, len(order)
+
+
+def main():
+    with TemporaryDirectory() as root:
+        paths = generate(root)
+        print(f"{ADDONS} addons on {PATHS} paths")
+        for workers in WORKERS:
+            cache_file = os.path.join(root, f'cache-{workers}.json')
+            elapsed, parsed, resolved = load(paths, cache_file, workers)
+            print(f"{workers} threads, cold: {elapsed * 1000:8.1f} ms, {parsed} manifests parsed, {resolved} addons resolved")
+            elapsed, parsed, resolved = load(paths, cache_file, workers)
+            print(f"{workers} threads, warm: {elapsed * 1000:8.1f} ms, {parsed} manifests parsed, {resolved} addons resolved")
+
+
+if __name__ == '__main__':
+    main()
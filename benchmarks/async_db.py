@@ -0,0 +1,56 @@
+"""
+Compares the blocking PostgresManager with AsyncPostgresManager under concurrent role lookups.
+Requires a local PostgreSQL configured as in the ERP configuration, with a ``user_roles`` table.
+Usage: python -m benchmarks.async_db [-c configuration.json]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+from master.config import parser
+from master.core.db import PostgresManager
+from master.core.async_db import AsyncPostgresManager
+
+CONCURRENCY = 200
+REQUESTS = 20000
+USER_ID = 1
+
+
+def bench_sync() -> float:
+    manager = PostgresManager()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(CONCURRENCY) as executor:
+            for _ in executor.map(lambda _: manager.get_role(USER_ID), range(REQUESTS)):
+                pass
+        return REQUESTS / (time.perf_counter() - started)
+    finally:
+        manager.close()
+
+
+async def bench_async() -> float:
+    manager = AsyncPostgresManager()
+    remaining = iter(range(REQUESTS))
+
+    async def worker():
+        for _ in remaining:
+            await manager.get_role(USER_ID)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        return REQUESTS / (time.perf_counter() - started)
+    finally:
+        await manager.close()
+
+
+def main():
+    # Measure the database round trips, not the role cache
+    parser.arguments.configuration['role_cache_size'] = 0
+    print(f"{REQUESTS} role lookups, {CONCURRENCY} concurrent callers, "
+          f"pool of {parser.arguments.configuration['db_pool_max_size']} connections")
+    print(f"PostgresManager (threads):      {bench_sync():10.0f} lookups/s")
+    print(f"AsyncPostgresManager (asyncio): {asyncio.run(bench_async()):10.0f} lookups/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compares the indexed OrderedSet of master.tools.collection with the previous OrderedDict based implementation.
+Usage: python -m benchmarks.collection
+"""
+from collections import OrderedDict
+import timeit
+from master.tools.collection import OrderedSet, LastIndexOrderedSet
+
+SIZE = 2000
+
+
+class LegacyOrderedSet:
+    """The OrderedDict based implementation OrderedSet replaced, kept for comparison."""
+    __slots__ = '_data'
+
+    def __init__(self, iterable=None):
+        self._data = OrderedDict()
+        for value in iterable or ():
+            self.add(value)
+
+    def add(self, value):
+        self._data[value] = None
+
+    def remove(self, item):
+        del self._data[item]
+
+    def index(self, item):
+        for index, current in enumerate(self._data.keys()):
+            if current == item:
+                return index
+        return -1
+
+    def __getitem__(self, index):
+        return list(self._data.keys())[index]
+
+    def __sub__(self, other):
+        return self.__class__([value for value in self if value not in other])
+
+    def __add__(self, other):
+        return self.__class__(list(self._data.keys()) + list(other._data.keys()))
+
+    def __contains__(self, value):
+        return value in self._data
+
+    def __iter__(self):
+        return iter(self._data.keys())
+
+    def __eq__(self, other):
+        return list(self._data.keys()) == list(other._data.keys())
+
+
+class LegacyLastIndexOrderedSet(LegacyOrderedSet):
+
+    def add(self, value):
+        if value in self._data:
+            self.remove(value)
+        super().add(value)
+
+
+def scenarios(ordered_set, last_index_ordered_set):
+    values = list(range(SIZE))
+    full = ordered_set(values)
+    other = ordered_set(values[SIZE // 2:] + [SIZE + value for value in values[:SIZE // 2]])
+    return {
+        'build': lambda: ordered_set(values),
+        'iterate by index': lambda: [full[index] for index in range(SIZE)],
+        'index': lambda: [full.index(value) for value in values[::10]],
+        'contains': lambda: [value in full for value in values],
+        're-add (move to end)': lambda: [last_index_ordered_set.add(value) for value in values[::7]],
+        # Each move leaves a hole, the positional accesses after it must not compact the whole set
+        're-add then index': lambda: [(last_index_ordered_set.add(value), last_index_ordered_set.index(value),
+                                       last_index_ordered_set[SIZE // 2]) for value in values[::7]],
+        'add': lambda: full + other,
+        'subtract': lambda: full - other,
+        'equal': lambda: full == ordered_set(values),
+    }
+
+
+def main():
+    current = scenarios(OrderedSet, LastIndexOrderedSet(range(SIZE)))
+    legacy = scenarios(LegacyOrderedSet, LegacyLastIndexOrderedSet(range(SIZE)))
+    print(f"{'operation (' + str(SIZE) + ' elements)':<32}{'legacy ms':>12}{'indexed ms':>12}{'speedup':>10}")
+    for name, operation in current.items():
+        number = 5
+        legacy_ms = min(timeit.repeat(legacy[name], number=number, repeat=3)) / number * 1000
+        current_ms = min(timeit.repeat(operation, number=number, repeat=3)) / number * 1000
+        print(f"{name:<32}{legacy_ms:>12.3f}{current_ms:>12.3f}{legacy_ms / current_ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the cached hook dispatch of master.tools.misc with the previous reflective lookups.
+Usage: python -m benchmarks.dispatch
+"""
+import inspect
+import timeit
+from master.tools.misc import call_classmethod, call_method, call_hooks
+
+CLASSES = 200
+
+
+def legacy_get_mangled_method_name(klass, method_name):
+    if method_name.startswith('__') and not method_name.endswith('__'):
+        class_name = klass.__class__.__name__ if isinstance(klass, object) else klass.__name__
+        return f"_{class_name}{method_name}"
+    return method_name
+
+
+def legacy_has_method(klass, method_name):
+    method_name = legacy_get_mangled_method_name(klass, method_name)
+    return hasattr(klass, method_name) and callable(getattr(klass, method_name))
+
+
+def legacy_call_method(klass, method_name, *args, **kwargs):
+    """The previous call_method: mangling twice, hasattr, getattr and callable on every call."""
+    method_name = legacy_get_mangled_method_name(klass, method_name)
+    if legacy_has_method(klass, method_name):
+        return getattr(klass, method_name)(*args, **kwargs)
+    return None
+
+
+def legacy_is_classmethod(klass, method_name):
+    method = inspect.getattr_static(klass, legacy_get_mangled_method_name(klass, method_name), None)
+    return isinstance(method, classmethod)
+
+
+def legacy_call_classmethod(klass, method_name, *args, **kwargs):
+    """The previous call_classmethod: mangling, getattr_static and getattr on every call."""
+    method_name = legacy_get_mangled_method_name(klass, method_name)
+    if legacy_is_classmethod(klass, method_name):
+        return getattr(klass, method_name)(*args, **kwargs)
+    return None
+
+
+def make_classes():
+    class Base:
+        @classmethod
+        def _attach_klass(cls):
+            return cls
+
+        def compute(self):
+            return 1
+
+    hooked = [type(f'Hooked{index}', (Base,), {}) for index in range(CLASSES // 2)]
+    plain = [type(f'Plain{index}', (), {}) for index in range(CLASSES // 2)]
+    return hooked + plain, Base()
+
+
+def main():
+    klasses, instance = make_classes()
+    scenarios = {
+        'call_classmethod': (
+            lambda: [legacy_call_classmethod(klass, '_attach_klass') for klass in klasses],
+            lambda: [call_classmethod(klass, '_attach_klass') for klass in klasses]),
+        'call_hooks': (
+            lambda: [legacy_call_classmethod(klass, '_attach_klass') for klass in klasses],
+            lambda: call_hooks(klasses, '_attach_klass')),
+        'call_method (instance)': (
+            lambda: [legacy_call_method(instance, 'compute') for _ in klasses],
+            lambda: [call_method(instance, 'compute') for _ in klasses]),
+    }
+    print(f"{'dispatch over ' + str(CLASSES) + ' classes':<32}{'legacy us':>12}{'cached us':>12}{'speedup':>10}")
+    for name, (legacy, cached) in scenarios.items():
+        number = 200
+        legacy_us = min(timeit.repeat(legacy, number=number, repeat=5)) / number * 1e6
+        cached_us = min(timeit.repeat(cached, number=number, repeat=5)) / number * 1e6
+        print(f"{name:<32}{legacy_us:>12.1f}{cached_us:>12.1f}{legacy_us / cached_us:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
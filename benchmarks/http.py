@@ -0,0 +1,86 @@
+"""
+Load generator for the HTTP API: keep-alive clients sending role lookups, with and without pipelining.
+The server is started in a child process with ``http_workers`` workers, on ``hostname`` and ``port``.
+Requires a local PostgreSQL configured as in the ERP configuration, with a ``user_roles`` table.
+Usage: python -m benchmarks.http [-c configuration.json]
+"""
+from typing import List, Tuple
+import asyncio
+import os
+import signal
+import socket
+import time
+from master.config import parser
+from master.service import supervisor
+
+CONNECTIONS = 64
+REQUESTS = 50000
+PIPELINE_DEPTHS = (1, 8)
+USER_ID = 1
+
+
+async def client(hostname: str, port: int, count: int, depth: int, latencies: List[float]) -> None:
+    """Sends ``count`` requests on one connection, keeping up to ``depth`` of them in flight."""
+    reader, writer = await asyncio.open_connection(hostname, port)
+    request = f'GET /roles/{USER_ID} HTTP/1.1\r\nHost: {hostname}\r\n\r\n'.encode()
+    sent_at = []
+    sent = received = 0
+    try:
+        while received < count:
+            batch = min(depth - (sent - received), count - sent)
+            if batch > 0:
+                writer.write(request * batch)
+                now = time.perf_counter()
+                sent_at.extend([now] * batch)
+                sent += batch
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = int(head.split(b'Content-Length: ', 1)[1].split(b'\r\n', 1)[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - sent_at[received])
+            received += 1
+    finally:
+        writer.close()
+
+
+async def load(hostname: str, port: int, depth: int) -> Tuple[float, List[float]]:
+    latencies: List[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(client(hostname, port, REQUESTS // CONNECTIONS, depth, latencies) for _ in range(CONNECTIONS)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def wait_until_listening(hostname: str, port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((hostname, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    configuration = parser.arguments.configuration
+    hostname, port = configuration['hostname'], configuration['port']
+    pid = os.fork()
+    if pid == 0:
+        os._exit(supervisor.start())
+    try:
+        wait_until_listening(hostname, port)
+        print(f"{REQUESTS} GET /roles/{USER_ID} over {CONNECTIONS} keep-alive connections, "
+              f"{configuration['http_workers'] or os.cpu_count()} worker processes")
+        for depth in PIPELINE_DEPTHS:
+            elapsed, latencies = asyncio.run(load(hostname, port, depth))
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            print(f"pipeline depth {depth:2}: {len(latencies) / elapsed:10.0f} requests/s   "
+                  f"p50 {p50:6.2f} ms   p99 {p99:6.2f} ms")
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Import-time budget check, based on ``python -X importtime``.
+Each target is imported ``RUNS`` times, each time in a fresh interpreter; the script reports the median cumulative
+import time, the slowest modules it pulls in, and fails if the median exceeds its budget or the target imports a
+module it must not depend on. The median is stable on a loaded machine where a single run is not.
+Usage: python -m benchmarks.import_time
+"""
+from typing import Dict, List, Tuple
+import subprocess
+import sys
+
+# Target module: (budget in milliseconds, modules that must not be imported)
+# Budgets leave about half the measured median as headroom, they catch a heavy dependency, not a few milliseconds
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    'master': (20.0, ('psycopg2', 'master.config', 'master.core')),
+    'master.tools.collection': (30.0, ('psycopg2', 'master.core', 'master.tools.cache', 'master.tools.misc')),
+    'master.config': (90.0, ('psycopg2', 'master.core')),
+    'master.core.orm.model': (120.0, ('psycopg2', 'master.core.db')),
+    'master.core.db': (250.0, ()),
+}
+RUNS = 9
+TOP = 5
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """Imports a module in a fresh interpreter and returns (module, self us, cumulative us) for each import."""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True)
+    times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def main():
+    failures = []
+    for module, (budget, forbidden) in BUDGETS.items():
+        runs = sorted((import_times(module) for _ in range(RUNS)), key=lambda run: run[-1][2])
+        times = runs[len(runs) // 2]
+        total = times[-1][2] / 1000
+        imported = {name for run in runs for name, _, _ in run}
+        status = 'ok' if total <= budget else 'OVER BUDGET'
+        print(f"{module:<28}{total:>9.1f} ms / {budget:.0f} ms  {status}")
+        for name, _, cumulative in sorted(times[:-1], key=lambda item: -item[2])[:TOP]:
+            print(f"    {name:<40}{cumulative / 1000:>9.1f} ms")
+        if total > budget:
+            failures.append(f"{module} took {total:.1f} ms, budget is {budget:.0f} ms")
+        for name in forbidden:
+            if name in imported:
+                failures.append(f"{module} imports {name}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures the throughput of the pipeline service: an ``export_roles`` job split into chunks of several sizes.
+The service runs in a child process on ``hostname`` and ``pipeline_port`` with ``pipeline_workers`` processes.
+Requires a local PostgreSQL configured as in the ERP configuration, with a ``user_roles`` table.
+Usage: python -m benchmarks.pipeline [-c configuration.json]
+"""
+import asyncio
+import json
+import os
+import signal
+import time
+from master.config import parser
+from master.service import pipeline
+from benchmarks.http import wait_until_listening
+
+ITEMS = 200000
+CHUNK_SIZES = (100, 1000, 10000)
+
+
+async def run_job(hostname: str, port: int, chunk_size: int) -> dict:
+    reader, writer = await asyncio.open_connection(hostname, port, limit=64 * 1024 * 1024)
+    try:
+        job = {'id': chunk_size, 'job': 'export_roles', 'items': list(range(ITEMS)), 'chunk_size': chunk_size}
+        writer.write(json.dumps(job).encode() + b'\n')
+        while True:
+            message = json.loads(await reader.readline())
+            if message.get('done'):
+                return message
+    finally:
+        writer.close()
+
+
+def main():
+    configuration = parser.arguments.configuration
+    hostname, port = configuration['hostname'], configuration['pipeline_port']
+    if not port:
+        print("Set pipeline_port in the configuration to run this benchmark")
+        return
+    pid = os.fork()
+    if pid == 0:
+        asyncio.run(pipeline.serve(pipeline.create_socket(hostname, port), configuration))
+        os._exit(0)
+    try:
+        wait_until_listening(hostname, port)
+        print(f"export_roles of {ITEMS} users, {configuration['pipeline_workers'] or os.cpu_count()} worker processes")
+        for chunk_size in CHUNK_SIZES:
+            started = time.perf_counter()
+            done = asyncio.run(run_job(hostname, port, chunk_size))
+            elapsed = time.perf_counter() - started
+            print(f"chunk size {chunk_size:6}: {done['chunks']:5} chunks, {done['failed']} failed, "
+                  f"{elapsed:.2f} s, {ITEMS / elapsed:10.0f} items/s")
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
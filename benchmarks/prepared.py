@@ -0,0 +1,62 @@
+"""
+Measures role checks with and without server-side prepared statements.
+Requires a local PostgreSQL configured as in the ERP configuration, with a ``user_roles`` table.
+Usage: python -m benchmarks.prepared [-c configuration.json]
+"""
+import time
+from psycopg2 import sql
+from master.config import parser
+from master.core.db import PostgresManager, ROLE_TABLE_NAME, SELECT_ROLE
+
+REQUESTS = 20000
+USER_ID = 1
+
+
+def bench_cursor(manager: PostgresManager, composed: bool) -> float:
+    """Runs the role query in a loop on one connection, composing it on every call as the manager used to."""
+    with manager.pool.connection() as connection:
+        cursor = connection.cursor()
+        started = time.perf_counter()
+        for _ in range(REQUESTS):
+            if composed:
+                query = sql.SQL("SELECT role FROM {table} WHERE user_id = %s").format(table=sql.Identifier(ROLE_TABLE_NAME))
+                cursor.execute(query, (USER_ID,))
+            else:
+                SELECT_ROLE.execute(cursor, (USER_ID,))
+            cursor.fetchone()
+        elapsed = time.perf_counter() - started
+        cursor.close()
+        connection.rollback()
+    return REQUESTS / elapsed
+
+
+def bench_role_checks(manager: PostgresManager) -> float:
+    """Runs ``is_admin`` end to end, pool checkout included."""
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        manager.is_admin(USER_ID)
+    return REQUESTS / (time.perf_counter() - started)
+
+
+def main():
+    configuration = parser.arguments.configuration
+    # Measure the database round trips, not the role cache
+    configuration['role_cache_size'] = 0
+    configuration['db_metrics'] = False
+    configuration['db_pool_max_size'] = 1
+    manager = PostgresManager()
+    try:
+        print(f"{REQUESTS} role queries on a single pooled connection")
+        configuration['db_prepared_statements'] = 0
+        print(f"query composed on each call:   {bench_cursor(manager, True):10.0f} queries/s")
+        print(f"memoized query:                {bench_cursor(manager, False):10.0f} queries/s")
+        print(f"is_admin:                      {bench_role_checks(manager):10.0f} checks/s")
+        configuration['db_prepared_statements'] = 100
+        print(f"memoized prepared statement:   {bench_cursor(manager, False):10.0f} queries/s")
+        print(f"is_admin, prepared:            {bench_role_checks(manager):10.0f} checks/s")
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
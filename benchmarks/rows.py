@@ -0,0 +1,69 @@
+"""
+Compares the memory and time of reading a large result as tuples, as dicts built from them, as slotted records
+and column by column.
+Requires a local PostgreSQL configured as in the ERP configuration, where user ``USER_ID`` is an admin.
+Usage: python -m benchmarks.rows [-c configuration.json]
+"""
+import gc
+import time
+import tracemalloc
+from master.config import parser
+from master.core.db import PostgresManager
+from master.core import rows
+
+ROWS = 200000
+USER_ID = 1
+QUERY = (f"SELECT g AS id, g % 1000 AS partner_id, (g * 1.25)::float8 AS amount, g % 2 = 0 AS paid, 'invoice ' || g AS name "
+         f"FROM generate_series(1, {ROWS}) g")
+
+
+def read_tuples(cursor):
+    return cursor.fetchall()
+
+
+def read_dicts(cursor):
+    names = [column.name for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def read_records(cursor):
+    return cursor.fetchall()
+
+
+def measure(manager: PostgresManager, read, records: bool = False, stream: bool = False):
+    """Reads the result twice, timed then traced, tracing allocations slows them down several times."""
+    gc.collect()
+    with manager.transaction(USER_ID, stream=stream, records=records) as cursor:
+        cursor.execute(QUERY)
+        started = time.perf_counter()
+        read(cursor)
+        elapsed = time.perf_counter() - started
+    gc.collect()
+    with manager.transaction(USER_ID, stream=stream, records=records) as cursor:
+        cursor.execute(QUERY)
+        tracemalloc.start()
+        result = read(cursor)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    del result
+    return elapsed, size, peak
+
+
+def main():
+    parser.arguments.configuration['db_metrics'] = False
+    manager = PostgresManager()
+    manager.create_connection(USER_ID)
+    try:
+        print(f"{ROWS} rows of 5 columns, memory held by the result once read, peak while reading")
+        for label, read, records, stream in (('tuples', read_tuples, False, False),
+                                             ('dicts', read_dicts, False, False),
+                                             ('records', read_records, True, False),
+                                             ('columns, streamed', rows.fetch_columns, False, True)):
+            elapsed, size, peak = measure(manager, read, records, stream)
+            print(f"{label:18} {elapsed * 1000:8.1f} ms   {size / ROWS:6.1f} bytes/row   peak {peak / 2 ** 20:7.1f} MiB")
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
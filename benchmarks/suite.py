@@ -0,0 +1,373 @@
+"""
+Benchmark suite of the hot paths: ordered sets, enums, the Meta registry, hook dispatch, logging, caches and the
+role calls of PostgresManager. Each benchmark is timed ``REPEAT`` times, in rounds that time every benchmark once,
+so that a slow period of the machine spreads over all of them instead of skewing one. Results keep the fastest, the
+quartiles, the median and the slowest repetition, and are saved as JSON and compared with a baseline: the run fails
+when the median of a benchmark is slower than the median of the baseline by more than the threshold, plus the
+interquartile range of the baseline relative to its median up to ``NOISE_ALLOWANCE``. Only runs of the same machine
+are comparable, and shared or virtual machines vary by several percent between runs, hence the default threshold
+of 20%.
+The database benchmarks require a local PostgreSQL configured as in the ERP configuration, where user ``USER_ID``
+is an admin; they are skipped when it cannot be reached.
+Usage:
+    python -m benchmarks.suite [-c configuration.json] [--output results.json] [--baseline baseline.json]
+                               [--threshold 0.2] [--filter name] [--no-db]
+Example, before an upgrade:
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --baseline before.json
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import argparse
+import datetime
+import gc
+import io
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from master.config import parser
+from benchmarks import collection, dispatch
+
+USER_ID = 1
+REPEAT = 25
+TARGET_SECONDS = 0.02  # Duration of one timed repetition, the number of calls is calibrated to reach it
+NOISE_ALLOWANCE = 0.1  # Largest share of the threshold added for a benchmark whose baseline was noisy
+SEED = 1234
+
+
+class Benchmark(NamedTuple):
+    """A named operation to time, ``setup`` returns the callable timed and is run once before the timing."""
+    name: str
+    setup: Callable[[], Callable[[], Any]]
+    database: bool = False
+
+
+benchmarks: List[Benchmark] = []
+
+
+def benchmark(name: str, database: bool = False):
+    """Registers a setup function as the benchmark of the given name."""
+    def decorator(setup: Callable[[], Callable[[], Any]]) -> Callable[[], Callable[[], Any]]:
+        benchmarks.append(Benchmark(name, setup, database))
+        return setup
+    return decorator
+
+
+def _add_collection_benchmarks():
+    from master.tools.collection import LastIndexOrderedSet, OrderedSet
+    for operation in collection.scenarios(OrderedSet, LastIndexOrderedSet(range(collection.SIZE))):
+        name = f"collection.{operation.replace(' ', '_').replace('(', '').replace(')', '')}"
+        # Late binding of the operation name, every scenario is rebuilt so that none sees another's mutations
+        benchmarks.append(Benchmark(name, lambda operation=operation: collection.scenarios(
+            OrderedSet, LastIndexOrderedSet(range(collection.SIZE)))[operation]))
+
+
+_add_collection_benchmarks()
+
+
+def _color_enum():
+    from master.tools.enums import Enum
+    return Enum('Color', {f'COLOR_{index}': f'color_{index}' for index in range(20)})
+
+
+@benchmark('enum.from_value_first')
+def enum_from_value_first():
+    color = _color_enum()
+    return lambda: color.from_value('color_0')
+
+
+@benchmark('enum.from_value_last')
+def enum_from_value_last():
+    color = _color_enum()
+    return lambda: color.from_value('color_19')
+
+
+@benchmark('meta.class_creation')
+def meta_class_creation():
+    from master.core.api import Meta, classes
+
+    def create():
+        Meta('Benchmarked', (object,), {'__meta_path__': 'benchmarks.suite'})
+        # The registry would otherwise grow with every call
+        classes['benchmarks.suite'].clear()
+    return create
+
+
+@benchmark('meta.create_merged_class')
+def meta_create_merged_class():
+    from master.core.api import Meta, merged_classes
+
+    class Base:
+        pass
+    bases = [type(f'Addon{index}', (Base,), {}) for index in range(5)]
+    key = ('Merged', tuple(bases))
+
+    def create():
+        merged_classes.pop(key, None)
+        Meta.create_merged_class('Merged', bases)
+    return create
+
+
+@benchmark('meta.create_merged_class_cached')
+def meta_create_merged_class_cached():
+    from master.core.api import Meta
+
+    class Base:
+        pass
+    bases = [type(f'Addon{index}', (Base,), {}) for index in range(5)]
+    return lambda: Meta.create_merged_class('Merged', bases)
+
+
+@benchmark('meta.compose_cached')
+def meta_compose_cached():
+    from master.core.api import Meta
+
+    class Composed(metaclass=Meta):
+        __meta_path__ = 'benchmarks.suite.composed'
+
+    class Extension(Composed):
+        __meta_path__ = 'benchmarks.suite.composed'
+    return lambda: Meta.compose('benchmarks.suite.composed')
+
+
+@benchmark('dispatch.call_classmethod')
+def dispatch_call_classmethod():
+    from master.tools.misc import call_classmethod
+    klasses, _ = dispatch.make_classes()
+    return lambda: [call_classmethod(klass, '_attach_klass') for klass in klasses]
+
+
+@benchmark('dispatch.call_hooks')
+def dispatch_call_hooks():
+    from master.tools.misc import call_hooks
+    klasses, _ = dispatch.make_classes()
+    return lambda: call_hooks(klasses, '_attach_klass')
+
+
+@benchmark('logging.get_logger_cached')
+def logging_get_logger_cached():
+    from master.config.logging import get_logger
+    get_logger('benchmarks.suite')
+    return lambda: get_logger('benchmarks.suite')
+
+
+@benchmark('logging.info')
+def logging_info():
+    from master.config.logging import get_logger
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger = get_logger('benchmarks.suite.info', handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    def log():
+        logger.info("Role %s assigned to user %s", 'admin', 42)
+        if stream.tell() > 1 << 20:
+            stream.seek(0)
+            stream.truncate()
+    return log
+
+
+@benchmark('logging.debug_filtered')
+def logging_debug_filtered():
+    from master.config.logging import get_logger
+    logger = get_logger('benchmarks.suite.filtered', logging.NullHandler())
+    logger.setLevel(logging.INFO)
+    return lambda: logger.debug("Role %s assigned to user %s", 'admin', 42)
+
+
+@benchmark('cache.lru_hit')
+def cache_lru_hit():
+    from master.tools.cache import LRUCache
+    cache = LRUCache(1000)
+    for key in range(1000):
+        cache.set(key, key)
+    keys = random.Random(SEED).choices(range(1000), k=100)
+    return lambda: [cache.get(key) for key in keys]
+
+
+@benchmark('cache.memoize_hit')
+def cache_memoize_hit():
+    from master.tools.cache import memoize
+
+    @memoize(max_size=1000)
+    def square(value):
+        return value * value
+    keys = random.Random(SEED).choices(range(1000), k=100)
+    return lambda: [square(key) for key in keys]
+
+
+def _manager():
+    from master.core.db import PostgresManager
+    manager = PostgresManager()
+    managers.append(manager)
+    manager.get_role(USER_ID)
+    return manager
+
+
+managers: List[Any] = []
+
+
+@benchmark('db.get_role_cached', database=True)
+def db_get_role_cached():
+    manager = _manager()
+    return lambda: manager.get_role(USER_ID)
+
+
+@benchmark('db.get_role', database=True)
+def db_get_role():
+    manager = _manager()
+
+    def get_role():
+        manager.role_cache.invalidate(USER_ID)
+        manager.get_role(USER_ID)
+    return get_role
+
+
+@benchmark('db.get_roles_100', database=True)
+def db_get_roles():
+    manager = _manager()
+    user_ids = list(range(USER_ID, USER_ID + 100))
+
+    def get_roles():
+        manager.role_cache.invalidate()
+        manager.get_roles(user_ids)
+    return get_roles
+
+
+@benchmark('db.is_admin_cached', database=True)
+def db_is_admin_cached():
+    manager = _manager()
+    return lambda: manager.is_admin(USER_ID)
+
+
+def calibrate(timer: timeit.Timer) -> int:
+    """Returns the number of calls of a timed repetition, so that it lasts about ``TARGET_SECONDS``."""
+    number, elapsed = timer.autorange()
+    return max(1, int(number * TARGET_SECONDS / max(elapsed, 1e-9)))
+
+
+def summarize(times: List[float], number: int) -> Dict[str, Any]:
+    """Returns the fastest, the quartiles, the median and the slowest time per call of the repetitions of a benchmark."""
+    q1, median, q3 = statistics.quantiles(times, n=4)
+    return {'seconds': min(times), 'q1': q1, 'median': median, 'q3': q3, 'max': max(times), 'number': number,
+            'repeat': len(times)}
+
+
+def database_available() -> bool:
+    try:
+        from master.core.db import PostgresManager
+        manager = PostgresManager()
+        try:
+            return manager.get_role(USER_ID) is not None
+        finally:
+            manager.close()
+    except Exception as e:
+        print(f"Database benchmarks skipped: {e}")
+        return False
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(selected: List[Benchmark]) -> Dict[str, Dict[str, Any]]:
+    timers = {}
+    for entry in selected:
+        random.seed(SEED)
+        operation = entry.setup()
+        operation()  # Warms caches up, the first call may also resolve lazily imported modules
+        timer = timeit.Timer(operation)
+        timers[entry.name] = (timer, calibrate(timer))
+    times: Dict[str, List[float]] = {name: [] for name in timers}
+    for _ in range(REPEAT):
+        gc.collect()
+        for name, (timer, number) in timers.items():
+            times[name].append(timer.timeit(number) / number)
+    results = {}
+    for name, (_, number) in timers.items():
+        results[name] = summarize(times[name], number)
+        result = results[name]
+        print(f"{name:<40}{result['seconds'] * 1e6:>12.3f} us{result['median'] * 1e6:>12.3f} us{result['max'] * 1e6:>12.3f} us")
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """
+    Prints each benchmark against the baseline and returns the names of those whose median is slower than the
+    median of the baseline by more than ``threshold``, plus the noise allowance of the baseline.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<40}{'baseline us':>14}{'current us':>14}{'change':>10}{'allowed':>10}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40}{'-':>14}{result['median'] * 1e6:>14.3f}{'new':>10}")
+            continue
+        # Baselines saved before the quartiles were recorded get no allowance
+        noise = (before['q3'] - before['q1']) / before['median'] if 'q1' in before else 0.0
+        allowed = threshold + min(noise, NOISE_ALLOWANCE)
+        change = result['median'] / before['median'] - 1
+        flag = ''
+        if change > allowed:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<40}{before['median'] * 1e6:>14.3f}{result['median'] * 1e6:>14.3f}{change:>+10.1%}{allowed:>+10.1%}{flag}")
+    return regressions
+
+
+def main():
+    arguments_parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n')[1])
+    arguments_parser.add_argument('--output', help='Path of the JSON file the results are saved to')
+    arguments_parser.add_argument('--baseline', help='Path of a JSON file saved by a previous run to compare with')
+    arguments_parser.add_argument('--threshold', type=float, default=0.2,
+                                  help='Relative slowdown flagged as a regression, 0.2 by default')
+    arguments_parser.add_argument('--filter', default='', help='Only runs the benchmarks whose name contains this text')
+    arguments_parser.add_argument('--no-db', action='store_true', help='Skips the database benchmarks')
+    options, remaining = arguments_parser.parse_known_args()
+    # The remaining arguments, such as -c, are the ERP ones
+    parser.load(remaining)
+    parser.arguments.configuration['role_cache_listen'] = False
+
+    selected = [entry for entry in benchmarks if options.filter in entry.name]
+    if any(entry.database for entry in selected) and (options.no_db or not database_available()):
+        selected = [entry for entry in selected if not entry.database]
+    print(f"{'benchmark':<40}{'fastest':>15}{'median':>15}{'slowest':>15}")
+    try:
+        results = run(selected)
+    finally:
+        for manager in managers:
+            manager.close()
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"Results saved to {options.output}")
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"Baseline: revision {baseline.get('revision')}, {baseline.get('created')}, Python {baseline.get('python')}")
+        regressions = compare(results, baseline['results'], options.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {options.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo regression above {options.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Measures the fan-out of role change events from the WebSocket service to many local subscribers.
+The service runs in a child process on ``hostname`` and ``websocket_port``, the events are sent with ``pg_notify``.
+Requires a local PostgreSQL configured as in the ERP configuration.
+Usage: python -m benchmarks.websocket [-c configuration.json]
+"""
+from base64 import b64encode
+import asyncio
+import os
+import resource
+import signal
+import struct
+import time
+import psycopg2
+from master.config import parser
+from master.core.db import ROLE_CHANNEL_NAME
+from master.service import websocket
+from benchmarks.http import wait_until_listening
+
+CLIENTS = 10000
+MESSAGES = 100
+CONNECT_BATCH = 500
+
+
+class Subscriber(asyncio.Protocol):
+    """Counts the frames it receives, the handshake response is skipped."""
+
+    def __init__(self, counter: dict, subscribed: asyncio.Future):
+        self.counter = counter
+        self.subscribed = subscribed
+        self.buffer = bytearray()
+        self.handshaken = False
+
+    def connection_made(self, transport):
+        key = b64encode(os.urandom(16)).decode()
+        transport.write((f'GET /?topics=roles HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+
+    def data_received(self, data):
+        self.buffer += data
+        if not self.handshaken:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end < 0:
+                return
+            del self.buffer[:end + 4]
+            self.handshaken = True
+            self.subscribed.set_result(None)
+        while len(self.buffer) >= 2:
+            length, offset = self.buffer[1] & 0x7F, 2
+            if length == 126:
+                if len(self.buffer) < 4:
+                    return
+                length, = struct.unpack_from('!H', self.buffer, 2)
+                offset = 4
+            if len(self.buffer) < offset + length:
+                return
+            del self.buffer[:offset + length]
+            self.counter['frames'] += 1
+            if self.counter['frames'] == self.counter['expected']:
+                self.counter['done'].set_result(time.perf_counter())
+
+
+async def fan_out(hostname: str, port: int) -> None:
+    loop = asyncio.get_running_loop()
+    counter = {'frames': 0, 'expected': CLIENTS * MESSAGES, 'done': loop.create_future()}
+    transports = []
+    started = time.perf_counter()
+    for offset in range(0, CLIENTS, CONNECT_BATCH):
+        subscribed = [loop.create_future() for _ in range(min(CONNECT_BATCH, CLIENTS - offset))]
+        connected = await asyncio.gather(*(loop.create_connection(lambda future=future: Subscriber(counter, future), hostname, port)
+                                           for future in subscribed))
+        transports.extend(transport for transport, _ in connected)
+        await asyncio.gather(*subscribed)
+    print(f"{CLIENTS} subscribers connected in {time.perf_counter() - started:.1f} s")
+
+    configuration = parser.arguments.configuration
+    connection = psycopg2.connect(host=configuration['db_hostname'], port=configuration['db_port'], dbname=configuration['db_name'],
+                                  user=configuration['db_user'], password=configuration['db_password'])
+    with connection.cursor() as cursor:
+        # Distinct payloads, identical notifications of a transaction are folded into one
+        cursor.execute("SELECT pg_notify(%s, g::text) FROM generate_series(1, %s) g", (ROLE_CHANNEL_NAME, MESSAGES))
+    started = time.perf_counter()
+    connection.commit()
+    connection.close()
+    finished = await asyncio.wait_for(counter['done'], 120)
+    elapsed = finished - started
+    print(f"{MESSAGES} events to {CLIENTS} subscribers: {counter['frames']} frames in {elapsed:.2f} s, "
+          f"{counter['frames'] / elapsed:,.0f} frames/s")
+    for transport in transports:
+        transport.close()
+
+
+def main():
+    configuration = parser.arguments.configuration
+    hostname, port = configuration['hostname'], configuration['websocket_port']
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < CLIENTS + 100:
+        print(f"The open files limit ({hard}) is too low for {CLIENTS} connections")
+        return
+    pid = os.fork()
+    if pid == 0:
+        sock = websocket.create_socket(hostname, port, backlog=CONNECT_BATCH * 2)
+        asyncio.run(websocket.serve(sock, configuration))
+        os._exit(0)
+    try:
+        wait_until_listening(hostname, port)
+        asyncio.run(fan_out(hostname, port))
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
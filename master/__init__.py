@@ -1,13 +1,23 @@
-import traceback
-from typing import Optional
-from . import exceptions
-from . import tools
-from . import config
-from . import core
+import importlib
 
-connectors: Optional[core.db.PostgresManager] = None
+_submodules = ('exceptions', 'tools', 'config', 'core', 'service', 'addons')
+connectors: 'Optional[core.db.PostgresManager]' = None
+
+
+def __getattr__(name: str):
+    # Subpackages are imported on first access, importing a helper does not load the database layer
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
 def main():
-    if config.parser.arguments.show_arguments_description():
+    from . import config
+    config.load()
+    if config.parser.ArgumentParser.show_arguments_description():
         exit(1)
+    config.init_logging()
+    from .core import addons
+    addons.load()
+    from .service import supervisor
+    exit(supervisor.start())
@@ -0,0 +1 @@
+# Addons are imported as subpackages of this package, see master.core.addons.import_addon
@@ -2,3 +2,13 @@ from . import parser
 from . import logging
 
 logger = logging.get_logger(__name__)
+
+
+def load(argv=None) -> parser.ArgumentParser:
+    """Parses the ERP arguments and configuration, see ``parser.load``."""
+    return parser.load(argv)
+
+
+def init_logging(configuration=None):
+    """Configures logging from the ERP configuration, see ``logging.init_logging``."""
+    logging.init_logging(configuration)
@@ -1,7 +1,14 @@
 from ..tools.enums import Enum
 import logging
-from typing import List, Dict, Optional, Union
-from .parser import arguments
+import logging.handlers
+from typing import List, Dict, Optional, Set, Tuple, Union
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from . import parser
 
 
 class LoggerType(Enum):
@@ -15,32 +22,278 @@ class LoggerType(Enum):
     NOTSET = logging.NOTSET
 
 
+class QueuePolicy(Enum):
+    """What a full logging queue does with a new record."""
+    DROP = 'drop'
+    BLOCK = 'block'
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as compact JSON lines."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, separators=(',', ':'), default=str)
+
+
+class RotatingBatchFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    File handler rotating when the file reaches ``max_bytes`` and/or every ``interval`` seconds.
+    While ``deferred`` is set, writes are not flushed record by record, ``BatchingQueueListener``
+    flushes once per batch instead.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, interval: float = 0, backup_count: int = 5):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+        self.deferred = False
+        # Special files such as /dev/null are never rotated, checked once rather than on every record
+        self.rotatable = not os.path.exists(self.baseFilename) or os.path.isfile(self.baseFilename)
+        self._formatted: Tuple[Optional[logging.LogRecord], str] = (None, '')
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if not self.rotatable:
+            return False
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.maxBytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        self.stream.seek(0, 2)  # Other processes may append to the file too
+        return self.stream.tell() + len(self.format(record)) + 1 >= self.maxBytes
+
+    def format(self, record: logging.LogRecord) -> str:
+        # shouldRollover measures the record and emit writes it, it is formatted once for both
+        if self._formatted[0] is not record:
+            self._formatted = (record, super().format(record))
+        return self._formatted[1]
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+    def flush(self) -> None:
+        if not self.deferred:
+            super().flush()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Handler that only enqueues records, the I/O is done by a ``BatchingQueueListener`` thread.
+    Records are not formatted in the calling thread, their message is merely rendered so later changes
+    of the arguments do not alter it. When the queue is full the record is dropped, or the caller waits,
+    depending on the policy.
+    Attributes:
+        policy (QueuePolicy): Behavior on a full queue.
+        dropped (int): Number of records dropped because the queue was full.
+    """
+
+    def __init__(self, records: queue.Queue, policy: QueuePolicy = QueuePolicy.DROP):
+        super().__init__(records)
+        self.policy = policy
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks reference live frames, render them while they still describe the error
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.policy is QueuePolicy.BLOCK:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class BatchingQueueListener(threading.Thread):
+    """
+    Background thread writing queued records to the target handlers in batches.
+    Each batch is written then flushed once, and the records dropped by ``source`` since the previous
+    batch are reported with a warning record.
+    """
+    _STOP = None
+
+    def __init__(self, records: queue.Queue, targets: List[logging.Handler], source: Optional[BoundedQueueHandler] = None,
+                 batch_size: int = 512, flush_interval: float = 0.5):
+        super().__init__(name='logging-queue-listener', daemon=True)
+        self.records = records
+        self.targets = targets
+        self.source = source
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._reported_drops = 0
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.records.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if self._STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not self._STOP]
+            self._report_drops(batch)
+            self._write(batch)
+
+    def _report_drops(self, batch: List[logging.LogRecord]) -> None:
+        if self.source is None or self.source.dropped == self._reported_drops:
+            return
+        dropped = self.source.dropped - self._reported_drops
+        self._reported_drops = self.source.dropped
+        batch.append(logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                       f'{dropped} log records dropped, the logging queue was full', None, None))
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        for target in self.targets:
+            deferring = hasattr(target, 'deferred')
+            if deferring:
+                target.deferred = True
+            try:
+                for record in batch:
+                    if record.levelno >= target.level:
+                        target.handle(record)
+            finally:
+                if deferring:
+                    target.deferred = False
+                target.flush()
+
+    def stop(self) -> None:
+        """Writes the records still queued and stops the thread."""
+        self.records.put(self._STOP)
+        self.join()
+
+
 def add_handler(handler: logging.Handler, add_default: bool = True):
     assert handler, 'Parameter "handler" is required'
     if add_default:
         handler.setLevel(level)
         handler.setFormatter(logging.Formatter(log_format))
     handlers.append(handler)
+    for name, logger in loggers.items():
+        if name not in custom_loggers:
+            logger.addHandler(handler)
 
 
-_argument_level: Optional[str] = arguments.configuration.get('log_level', None)
 level: int = LoggerType.INFO.value
-if not _argument_level or _argument_level.isspace():
-    logging.getLogger(__name__).warning(f'"log_level" parameter not defined, switch to "INFO"')
-else:
-    if _argument_level.upper().strip() in LoggerType.names():
-        level = eval(f'LoggerType.{_argument_level.upper().strip()}').value
-    else:
-        logging.getLogger(__name__).warning(f'Incorrect "log_level" parameter, switch to "INFO"')
 log_format: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(level=level, format=log_format)
 handlers: List[logging.Handler] = []
-_argument_file: Optional[str] = arguments.configuration.get('log_file', None)
-if _argument_file:
-    add_handler(logging.FileHandler(_argument_file))
-else:
-    add_handler(logging.StreamHandler())
 loggers: Dict[str, logging.Logger] = {}
+custom_loggers: Set[str] = set()  # Loggers created with their own handlers, left alone by init_logging
+initialized: bool = False
+queue_handler: Optional[BoundedQueueHandler] = None
+listener: Optional[BatchingQueueListener] = None
+_dropped_before: int = 0  # Records dropped by the queue handlers of previous configurations
+
+
+def init_logging(configuration: Optional[dict] = None):
+    """
+    Configures logging from the ERP configuration: level, format and the default handler,
+    which is attached to every logger returned by ``get_logger`` so far and from now on.
+    Nothing is configured at import time, until this is called records propagate to the root logger.
+    With ``log_async``, loggers only enqueue records: a ``BoundedQueueHandler`` on the root logger feeds
+    a ``BatchingQueueListener`` thread which writes them in batches to the log file or the console.
+    Args:
+        configuration (dict): ERP configuration, defaults to the loaded ``arguments`` configuration.
+    """
+    global level, initialized, queue_handler, listener, _dropped_before
+    if configuration is None:
+        configuration = parser.arguments.configuration
+    argument_level: Optional[str] = configuration.get('log_level', None)
+    level = LoggerType.INFO.value
+    if not argument_level or argument_level.isspace():
+        logging.getLogger(__name__).warning(f'"log_level" parameter not defined, switch to "INFO"')
+    else:
+        if argument_level.upper().strip() in LoggerType.names():
+            level = eval(f'LoggerType.{argument_level.upper().strip()}').value
+        else:
+            logging.getLogger(__name__).warning(f'Incorrect "log_level" parameter, switch to "INFO"')
+    previous = list(handlers)
+    for name, logger in loggers.items():
+        for handler in handlers:
+            logger.removeHandler(handler)
+    handlers.clear()
+    if listener is not None:
+        # Writes what is still queued before its targets are closed
+        listener.stop()
+        previous.extend(listener.targets)
+        _dropped_before += queue_handler.dropped
+        listener = queue_handler = None
+    for handler in previous:
+        handler.close()
+
+    argument_file: Optional[str] = configuration.get('log_file', None)
+    if argument_file:
+        target = RotatingBatchFileHandler(
+            argument_file,
+            max_bytes=configuration.get('log_max_bytes', 0),
+            interval=configuration.get('log_rotate_interval', 0),
+            backup_count=configuration.get('log_backup_count', 5))
+    else:
+        target = logging.StreamHandler()
+    target.setLevel(level)
+    target.setFormatter(JsonFormatter() if configuration.get('log_json', False) else logging.Formatter(log_format))
+
+    if configuration.get('log_async', False):
+        records = queue.Queue(configuration.get('log_queue_size', 10000))
+        queue_handler = BoundedQueueHandler(records, QueuePolicy.from_value(configuration.get('log_queue_policy', 'drop')))
+        queue_handler.setLevel(level)
+        listener = BatchingQueueListener(records, [target], source=queue_handler)
+        listener.start()
+        # Every logger propagates to the root logger, which only enqueues
+        logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+    else:
+        # Replaces the queue handler of a previous asynchronous configuration, which would feed a stopped listener
+        logging.basicConfig(level=level, format=log_format, force=True)
+        add_handler(target, add_default=False)
+    initialized = True
+
+
+def dropped_records() -> int:
+    """Returns the number of records dropped because the logging queue was full, since the process started."""
+    return _dropped_before + (queue_handler.dropped if queue_handler is not None else 0)
+
+
+def shutdown():
+    """
+    Writes the records still queued and flushes every handler.
+    Registered with ``atexit``, processes leaving through ``os._exit``, such as forked workers, call it themselves.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+    for handler in handlers:
+        handler.flush()
+
+
+atexit.register(shutdown)
 
 
 def get_logger(name: str, custom_handlers: Optional[Union[List[logging.Handler], logging.Handler]] = None) -> logging.Logger:
@@ -56,6 +309,7 @@ def get_logger(name: str, custom_handlers: Optional[Union[List[logging.Handler],
         if not isinstance(custom_handlers, list):
             custom_handlers = [custom_handlers]
         logger_handlers = custom_handlers
+        custom_loggers.add(name)
     for handler in logger_handlers:
         loggers[name].addHandler(handler)
     return loggers[name]
@@ -1,5 +1,5 @@
 from ..tools.enums import Enum
-from typing import Optional, Union, Any, Type
+from typing import Optional, Union, Any, Type, Tuple, List
 from pathlib import Path
 from tempfile import gettempdir
 from master.tools.collection import LastIndexOrderedSet, OrderedSet
@@ -55,23 +55,69 @@ class ArgumentParser:
         self.configuration = configuration
         self.setdefault('log_file', str(Path(gettempdir()).joinpath('MASTER.log')), str)
         self.setdefault('log_level', LoggerType.DEBUG.value, str)
+        self.setdefault('log_async', False, bool)
+        self.setdefault('log_queue_size', 10000, int)
+        self.setdefault('log_queue_policy', 'drop', str)
+        self.setdefault('log_max_bytes', 0, int)
+        self.setdefault('log_rotate_interval', 0, (int, float))
+        self.setdefault('log_backup_count', 5, int)
+        self.setdefault('log_json', False, bool)
         self.setdefault('db_hostname', 'localhost', str)
         self.setdefault('db_port', 5432, int)
         self.setdefault('db_password', 'postgres', str)
         self.setdefault('db_user', 'postgres', str)
         self.setdefault('db_name', 'master', str)
+        self.setdefault('db_pool_min_size', 1, int)
+        self.setdefault('db_pool_max_size', 10, int)
+        self.setdefault('db_pool_idle_timeout', 300, (int, float))
+        self.setdefault('db_pool_timeout', 30, (int, float))
+        self.setdefault('db_replicas', [], list)
+        self.setdefault('db_replica_strategy', 'round_robin', str)
+        self.setdefault('db_replica_retry_interval', 30, (int, float))
+        self.setdefault('db_read_your_writes_window', 1, (int, float))
+        self.setdefault('db_batch_size', 1000, int)
+        self.setdefault('db_stream_batch_size', 2000, int)
+        self.setdefault('db_prepared_statements', 100, int)
+        self.setdefault('db_tenants', [], list)
+        self.setdefault('db_tenant_max_connections', 100, int)
+        self.setdefault('db_tenant_max_pools', 50, int)
+        self.setdefault('db_tenant_pool_max_size', 5, int)
+        self.setdefault('db_metrics', True, bool)
+        self.setdefault('db_slow_query_ms', 500, (int, float))
+        self.setdefault('role_cache_size', 10000, int)
+        self.setdefault('role_cache_ttl', 60, (int, float))
+        self.setdefault('role_cache_listen', True, bool)
+        self.setdefault('orm_debug', False, bool)
+        self.setdefault('auth_secret', '', str)
+        self.setdefault('auth_token_ttl', 3600, (int, float))
         self.setdefault('hostname', 'localhost', str)
         self.setdefault('port', 9000, int)
+        self.setdefault('http_workers', 1, int)
+        self.setdefault('http_backlog', 1024, int)
+        self.setdefault('http_keep_alive_timeout', 5, (int, float))
+        self.setdefault('http_max_body_size', 1048576, int)
         self.setdefault('websocket_port', 9001, int)
+        self.setdefault('websocket_max_buffer', 1048576, int)
+        self.setdefault('websocket_max_message_size', 65536, int)
         self.setdefault('pipeline_port', 9002, int)
+        self.setdefault('pipeline_workers', 0, int)
+        self.setdefault('pipeline_queue_size', 0, int)
+        self.setdefault('pipeline_chunk_size', 1000, int)
+        self.setdefault('pipeline_max_line_size', 16777216, int)
+        self.setdefault('scheduler_workers', 4, int)
+        self.setdefault('metrics_port', 0, int)
         self.setdefault('git', [], list)
+        self.setdefault('git_path', str(Path(gettempdir()).joinpath('MASTER-git')), str)
         self.setdefault('addons', [], list)
+        self.setdefault('addons_path', [], list)
+        self.setdefault('addons_workers', 8, int)
+        self.setdefault('addons_cache_file', str(Path(gettempdir()).joinpath('MASTER-addons.json')), str)
 
         # Ensure unique sets for 'addons' and 'git' settings
         self.configuration['addons'] = LastIndexOrderedSet(self.configuration['addons'])
         self.configuration['git'] = OrderedSet(self.configuration['git'])
 
-    def setdefault(self, key: str, default_value: Any, value_type: Optional[Type[Any]] = None):
+    def setdefault(self, key: str, default_value: Any, value_type: Optional[Union[Type[Any], Tuple[Type[Any], ...]]] = None):
         self.configuration.setdefault(key, default_value)
         value = self.configuration[key]
         if value and value_type and not isinstance(value, value_type):
@@ -82,8 +128,8 @@ class ArgumentParser:
         return any(arg in ['-h', '--help'] for arg in sys.argv)
 
 
-def parse_arguments() -> 'ArgumentParser':
-    """Parse system arguments and initiate ERP arguments."""
+def parse_arguments(argv: Optional[List[str]] = None) -> 'ArgumentParser':
+    """Parse system arguments, or the given ones, and initiate ERP arguments."""
     # Define argument parser
     parser = argparse.ArgumentParser(prog='MONSTER', description='All in one ERP')
     parser.add_argument(
@@ -95,7 +141,7 @@ def parse_arguments() -> 'ArgumentParser':
         help='Path to ERP configuration file in JSON format'
     )
     # Parse arguments and handle help request
-    parsed_arguments = parser.parse_args(sys.argv[1:])
+    parsed_arguments = parser.parse_args(sys.argv[1:] if argv is None else argv)
     if ArgumentParser.show_arguments_description():
         parser.print_help()
         return ArgumentParser(Mode.STAGING, {})
@@ -111,5 +157,21 @@ def parse_arguments() -> 'ArgumentParser':
         return ArgumentParser(parsed_arguments.mode, configuration)
 
 
-# Global variable to store parsed arguments
-arguments = parse_arguments()
+def load(argv: Optional[List[str]] = None) -> 'ArgumentParser':
+    """
+    Parses the arguments and stores them as the module-level ``arguments``.
+    Nothing is parsed at import time: entry points call ``load`` explicitly, and the first access to
+    ``arguments`` loads them from ``sys.argv`` otherwise.
+    Args:
+        argv (List[str]): Arguments to parse instead of ``sys.argv[1:]``.
+    """
+    global arguments
+    arguments = parse_arguments(argv)
+    return arguments
+
+
+def __getattr__(name: str) -> Any:
+    # Only reached until ``load`` defines ``arguments`` as a regular module attribute
+    if name == 'arguments':
+        return load()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -1,3 +1,10 @@
-from . import api
-from . import db
-from . import orm
+import importlib
+
+_submodules = ('addons', 'api', 'db', 'async_db', 'metrics', 'orm', 'rows')
+
+
+def __getattr__(name: str):
+    # Submodules are imported on first access, the ORM or the API do not pull psycopg2 and the pools in
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
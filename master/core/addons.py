@@ -0,0 +1,320 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import ast
+import importlib.util
+import json
+import keyword
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from master.config.logging import get_logger
+from master.config import parser
+from master.core.api import ADDONS_NAMESPACE, Meta
+from master.exceptions.addons import AddonDependencyError, AddonError, AddonNotFoundError, AddonSourceError
+from master.tools.collection import LastIndexOrderedSet
+
+_logger = get_logger(__name__)
+
+MANIFEST = '__manifest__.py'
+CACHE_VERSION = 1
+
+
+class Addon(NamedTuple):
+    """An addon found on an addons path, as described by its manifest."""
+    name: str
+    path: str
+    version: str
+    depends: Tuple[str, ...]
+    installable: bool
+
+
+class ManifestCache:
+    """
+    Parsed manifests and the last resolved load order, persisted as JSON between restarts.
+    A manifest is parsed again only when its modification time or size changed and its content hash did too,
+    so touching files, as a checkout does, costs a read but no parsing.
+    Attributes:
+        path (Optional[str]): File the cache is stored in, None keeps it in memory only.
+        parsed (int): Number of manifests parsed since the cache was loaded.
+    """
+    __slots__ = ('path', 'parsed', '_manifests', '_order', '_changed')
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.parsed = 0
+        self._manifests: Dict[str, list] = {}  # manifest path -> [mtime ns, size, sha1, manifest]
+        self._order: Dict[str, Any] = {}
+        self._changed = False
+        if path:
+            try:
+                with open(path, 'r') as cache_file:
+                    data = json.load(cache_file)
+                if data.get('version') == CACHE_VERSION:
+                    self._manifests = data['manifests']
+                    self._order = data['order']
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                _logger.warning("Ignoring unreadable addons cache %s: %s", path, e)
+
+    def manifest(self, manifest_path: str) -> Optional[dict]:
+        """
+        Returns the manifest of a file, from the cache when the file did not change.
+        Returns:
+            Optional[dict]: The manifest, None if the file does not exist.
+        Raises:
+            AddonError: If the manifest is not a Python dictionary literal.
+        """
+        try:
+            stat = os.stat(manifest_path)
+        except FileNotFoundError:
+            return None
+        entry = self._manifests.get(manifest_path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[3]
+        with open(manifest_path, 'rb') as manifest_file:
+            content = manifest_file.read()
+        digest = sha1(content).hexdigest()
+        if entry is None or entry[2] != digest:
+            try:
+                manifest = ast.literal_eval(content.decode())
+            except (ValueError, SyntaxError) as e:
+                raise AddonError(f'Invalid manifest {manifest_path}: {e}') from None
+            if not isinstance(manifest, dict):
+                raise AddonError(f'Manifest {manifest_path} must be a dictionary')
+            self.parsed += 1
+            entry = [0, 0, digest, {
+                'version': str(manifest.get('version', '')),
+                'depends': list(manifest.get('depends', [])),
+                'installable': bool(manifest.get('installable', True)),
+            }]
+        # Assigning a new list keeps concurrent readers of the previous one consistent
+        self._manifests[manifest_path] = [stat.st_mtime_ns, stat.st_size, entry[2], entry[3]]
+        self._changed = True
+        return entry[3]
+
+    def order(self, key: str) -> Optional[List[str]]:
+        """Returns the load order resolved for the given inputs, None if they changed since."""
+        return self._order.get('names') if self._order.get('key') == key else None
+
+    def set_order(self, key: str, names: List[str]) -> None:
+        if self._order.get('key') != key or self._order.get('names') != names:
+            self._order = {'key': key, 'names': names}
+            self._changed = True
+
+    def save(self) -> None:
+        """Writes the cache if it changed, atomically so that concurrent starts never read half a file."""
+        if not self.path or not self._changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(descriptor, 'w') as cache_file:
+                json.dump({'version': CACHE_VERSION, 'manifests': self._manifests, 'order': self._order}, cache_file)
+            os.replace(temporary, self.path)
+            self._changed = False
+        except OSError as e:
+            _logger.warning("Failed to write the addons cache %s: %s", self.path, e)
+
+
+def _addon_directories(path: str) -> List[str]:
+    try:
+        return sorted(entry.path for entry in os.scandir(path) if entry.is_dir() and not entry.name.startswith(('.', '_')))
+    except FileNotFoundError:
+        _logger.warning("Addons path %s does not exist", path)
+        return []
+
+
+def scan(paths: Iterable[str], cache: ManifestCache, workers: int = 8) -> Dict[str, Addon]:
+    """
+    Finds the addons of the given paths, listing the paths and reading the manifests on a thread pool.
+    An addon found on several paths is taken from the first one.
+    Args:
+        paths (Iterable[str]): Directories whose subdirectories holding a ``__manifest__.py`` are addons.
+        cache (ManifestCache): Cache of the parsed manifests.
+        workers (int): Threads listing and reading, most of the time is spent waiting on the filesystem.
+    Returns:
+        Dict[str, Addon]: Addons by name.
+    """
+    with ThreadPoolExecutor(max(workers, 1), thread_name_prefix='addons') as executor:
+        directories = [directory for listing in executor.map(_addon_directories, paths) for directory in listing]
+        manifests = executor.map(lambda directory: cache.manifest(os.path.join(directory, MANIFEST)), directories)
+        addons: Dict[str, Addon] = {}
+        for directory, manifest in zip(directories, manifests):
+            name = os.path.basename(directory)
+            if manifest is None or name in addons:
+                continue
+            addons[name] = Addon(name, directory, manifest['version'], tuple(manifest['depends']), manifest['installable'])
+    return addons
+
+
+def resolve(configured: Iterable[str], addons: Dict[str, Addon]) -> List[str]:
+    """
+    Returns the load order of the configured addons and of their dependencies.
+    Dependencies come before the addons depending on them, otherwise the configured order is kept, so an
+    addon listed later still overrides the classes of the ones listed before it.
+    Raises:
+        AddonNotFoundError: If an addon or one of its dependencies is missing.
+        AddonDependencyError: If dependencies form a cycle.
+        AddonError: If an addon is not installable.
+    """
+    order: List[str] = []
+    done = set()
+    for root in configured:
+        if root in done:
+            continue
+        # Depth-first walk with an explicit stack, dependency chains may be longer than the recursion limit
+        visiting: List[str] = []
+        stack: List[Tuple[str, int]] = [(root, 0)]  # (addon, index of the next dependency to visit)
+        while stack:
+            name, position = stack.pop()
+            if position == 0:
+                if name in done:
+                    continue
+                if name in visiting:
+                    cycle = visiting[visiting.index(name):] + [name]
+                    raise AddonDependencyError(f'Circular dependency between addons: {" -> ".join(cycle)}')
+                addon = addons.get(name)
+                if addon is None:
+                    required = f', required by "{visiting[-1]}"' if visiting else ''
+                    raise AddonNotFoundError(f'Addon "{name}" not found{required}')
+                if not addon.installable:
+                    raise AddonError(f'Addon "{name}" is not installable')
+                visiting.append(name)
+            depends = addons[name].depends
+            if position < len(depends):
+                stack.append((name, position + 1))
+                stack.append((depends[position], 0))
+                continue
+            visiting.pop()
+            done.add(name)
+            order.append(name)
+    return order
+
+
+def _git(*args: str, cwd: Optional[str] = None) -> str:
+    environment = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    result = subprocess.run(('git',) + args, cwd=cwd, env=environment, capture_output=True, text=True)
+    if result.returncode:
+        raise AddonSourceError(f'git {" ".join(args)} failed: {result.stderr.strip()}')
+    return result.stdout.strip()
+
+
+def source_directory(source: str, root: str) -> str:
+    """Returns the directory a git source is checked out in, named after the repository."""
+    url = source.partition('#')[0].rstrip('/')
+    name = os.path.basename(url)[:-4] if url.endswith('.git') else os.path.basename(url)
+    return os.path.join(root, f'{name}-{sha1(source.encode()).hexdigest()[:8]}')
+
+
+def sync_source(source: str, root: str) -> str:
+    """
+    Clones a git source, or updates its checkout when the remote branch moved.
+    Args:
+        source (str): Repository URL or path, optionally followed by ``#<branch>``.
+        root (str): Directory holding the checkouts of the sources.
+    Returns:
+        str: The checkout directory.
+    Raises:
+        AddonSourceError: If git fails.
+    """
+    url, _, branch = source.partition('#')
+    if os.path.exists(url):
+        # Local repositories are reached from the checkout too, relative paths would not resolve there
+        url = os.path.abspath(url)
+    directory = source_directory(source, root)
+    if not os.path.isdir(os.path.join(directory, '.git')):
+        # Cloned aside then renamed, an interrupted clone is never mistaken for a checkout
+        os.makedirs(root, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=root, prefix='.clone-')
+        _git('clone', '--quiet', '--depth', '1', *(('--branch', branch) if branch else ()), url, temporary)
+        os.replace(temporary, directory)
+        _logger.info("Cloned %s", source)
+        return directory
+    remote = _git('ls-remote', url, f'refs/heads/{branch}' if branch else 'HEAD').split('\t', 1)[0]
+    if not remote:
+        raise AddonSourceError(f'Branch "{branch}" not found in {url}')
+    if remote == _git('rev-parse', 'HEAD', cwd=directory):
+        return directory
+    _git('fetch', '--quiet', '--depth', '1', 'origin', branch or 'HEAD', cwd=directory)
+    _git('reset', '--quiet', '--hard', 'FETCH_HEAD', cwd=directory)
+    _logger.info("Updated %s to %s", source, remote[:12])
+    return directory
+
+
+def sync_sources(sources: Iterable[str], root: str, workers: int = 8) -> List[str]:
+    """Clones or updates the git sources in parallel, see ``sync_source``, and returns their checkouts in order."""
+    sources = list(sources)
+    if not sources:
+        return []
+    with ThreadPoolExecutor(max(min(workers, len(sources)), 1), thread_name_prefix='git') as executor:
+        return list(executor.map(lambda source: sync_source(source, root), sources))
+
+
+def import_addon(addon: Addon) -> None:
+    """
+    Imports the package of an addon from its own directory as ``master.addons.<name>``, registering its classes.
+    Addons have their own namespace, an addon named like a module of the standard library does not replace it.
+    Raises:
+        AddonError: If the name of the addon is not an identifier, if another package was imported under its name,
+            or if it is not a Python package.
+    """
+    if not addon.name.isidentifier() or keyword.iskeyword(addon.name):
+        raise AddonError(f'Addon name "{addon.name}" is not a valid Python identifier')
+    name = f'{ADDONS_NAMESPACE}.{addon.name}'
+    path = os.path.join(addon.path, '__init__.py')
+    loaded = sys.modules.get(name)
+    if loaded is not None:
+        if os.path.realpath(getattr(loaded, '__file__', None) or '') == os.path.realpath(path):
+            return
+        raise AddonError(f'Addon "{addon.name}" of {addon.path} clashes with the addon of the same name '
+                         f'already imported from {os.path.dirname(loaded.__file__ or "")}')
+    spec = importlib.util.spec_from_file_location(name, path, submodule_search_locations=[addon.path])
+    if spec is None or spec.loader is None:
+        raise AddonError(f'Addon "{addon.name}" is not a Python package')
+    namespace = importlib.import_module(ADDONS_NAMESPACE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    setattr(namespace, addon.name, module)
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        delattr(namespace, addon.name)
+        raise
+
+
+def load(configuration: Optional[dict] = None) -> List[Addon]:
+    """
+    Loads the configured addons: syncs the ``git`` sources, scans ``addons_path`` and the checkouts, resolves the
+    dependencies and imports the addons in order. ``configuration['addons']`` is then replaced by the resolved order,
+    so that ``Meta.compose`` orders the classes of dependencies before those of the addons depending on them.
+    Returns:
+        List[Addon]: The loaded addons, in load order.
+    """
+    if configuration is None:
+        configuration = parser.arguments.configuration
+    started = time.monotonic()
+    workers = configuration['addons_workers']
+    paths = list(configuration['addons_path']) + sync_sources(configuration['git'], configuration['git_path'], workers)
+    cache = ManifestCache(configuration['addons_cache_file'] or None)
+    addons = scan(paths, cache, workers)
+    configured = list(configuration['addons'])
+    key = sha1(json.dumps([configured, sorted(addons.values())]).encode()).hexdigest()
+    order = cache.order(key)
+    if order is None:
+        order = resolve(configured, addons)
+        cache.set_order(key, order)
+    cache.save()
+
+    loaded = [addons[name] for name in order]
+    for addon in loaded:
+        import_addon(addon)
+    configuration['addons'] = LastIndexOrderedSet(order)
+    Meta.reset_compositions()
+    _logger.info("Loaded %s addons in %.3f s, %s manifests parsed", len(loaded), time.monotonic() - started, cache.parsed)
+    return loaded
@@ -1,11 +1,17 @@
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from typing import Optional, Any, Type, List
+from typing import Optional, Any, Type, List, Dict, Tuple
+import threading
 from master.config.logging import get_logger
-from master.tools.misc import call_classmethod
+from master.config import parser
+from master.tools.misc import call_classmethod, clear_method_cache
 
 _logger = get_logger(__name__)
+ADDONS_NAMESPACE = 'master.addons'  # Package the addons are imported in, see ``master.core.addons.import_addon``
 classes = defaultdict(list)
+merged_classes: Dict[Tuple[str, Tuple[Type[Any], ...]], Type[Any]] = {}  # (name, bases) -> merged class
+compositions: Dict[str, Type[Any]] = {}  # meta path -> composed class, dropped when the path gets a new class
+_lock = threading.RLock()
 
 
 class AbstractMeta(ABC):
@@ -24,30 +30,106 @@ class Meta(AbstractMeta, type):
 
     @classmethod
     def attach_element(cls, klass: Type[Any]):
+        if klass.__dict__.get('__merged__'):
+            # Merged classes are built from registered classes, registering them too would merge them again
+            return
         meta_path: Optional[str] = getattr(klass, '__meta_path__', None)
-        if not meta_path:
-            classes['_'].append(klass)
-        else:
-            classes[meta_path].append(klass)
+        with _lock:
+            if not meta_path:
+                classes['_'].append(klass)
+            else:
+                classes[meta_path].append(klass)
+                compositions.pop(meta_path, None)
+        # Addons register classes as they patch the ones of their dependencies, resolved methods may be stale
+        clear_method_cache()
+
+    @classmethod
+    def attach_subclass(cls, klass: Type[Any]):
+        """
+        Registers a subclass of a class built by ``Meta``, to be called from ``__init_subclass__``.
+        ``Meta.__new__`` builds classes with ``type``, so it never runs for their subclasses; this registers them
+        and calls their ``_attach_klass`` hook as it does. Classes built by ``create_merged_class`` are skipped.
+        """
+        if klass.__dict__.get('__merged__'):
+            return
+        cls.attach_element(klass)
+        call_classmethod(klass, '_attach_klass')
+
+    @staticmethod
+    def addon_name(klass: Type[Any]) -> str:
+        """
+        Returns the addon a class comes from: its ``__addon__`` attribute if it defines one, otherwise the
+        package of its module under ``ADDONS_NAMESPACE``, or its top-level package outside of that namespace.
+        """
+        addon = klass.__dict__.get('__addon__')
+        if addon:
+            return addon
+        module = klass.__module__
+        if module.startswith(f'{ADDONS_NAMESPACE}.'):
+            return module[len(ADDONS_NAMESPACE) + 1:].split('.', 1)[0]
+        return module.split('.', 1)[0]
+
+    @classmethod
+    def compose(cls, meta_path: str, new_class_name: Optional[str] = None) -> Type[Any]:
+        """
+        Returns the final class of a meta path, merging every class registered under it.
+        Classes are ordered by the position of their addon in ``configuration['addons']``, classes of
+        unlisted addons (the core) first, so that later addons override earlier ones through the MRO.
+        The result is cached until a new class is registered under the meta path, and merged classes are
+        cached on their bases, so recomposing an unchanged set of classes never builds a new type.
+        :param meta_path: The meta path whose classes are composed.
+        :param new_class_name: Name of the merged class, defaults to the name of the first class.
+        :return: The only registered class, or a class merging all of them.
+        """
+        composed = compositions.get(meta_path)
+        if composed is not None:
+            return composed
+        with _lock:
+            registered = classes.get(meta_path)
+            if not registered:
+                raise LookupError(f'No class registered for meta path "{meta_path}"')
+            addons = parser.arguments.configuration['addons']
+            # sorted() is stable, classes of the same addon keep their registration order
+            ordered = sorted(dict.fromkeys(registered), key=lambda klass: addons.index(cls.addon_name(klass)))
+            if len(ordered) == 1:
+                composed = ordered[0]
+            else:
+                composed = cls.create_merged_class(new_class_name or ordered[0].__name__, ordered[::-1])
+            compositions[meta_path] = composed
+            return composed
+
+    @classmethod
+    def reset_compositions(cls):
+        """Drops composed classes and resolved methods, to be called when the addon order changes."""
+        with _lock:
+            compositions.clear()
+        clear_method_cache()
 
     @classmethod
     def create_merged_class(cls, new_class_name: str, classes_list: List[Type[Any]]) -> Type[Any]:
         """
         Dynamically creates a new class that merges multiple classes.
         The new class respects the Method Resolution Order (MRO) for super() calls.
+        Merged classes are memoized on their name and bases, merging the same classes again returns the same class.
+        They define ``__merged__``, so that the ``__init_subclass__`` hooks of their bases do not register them.
         :param new_class_name: New merged class name.
         :param classes_list: List of classes to merge.
         :return: A new class with combined functionality.
         """
         if not classes_list:
             raise ValueError("classes_list must contain at least one class to merge.")
+        key = (new_class_name, tuple(classes_list))
+        merged = merged_classes.get(key)
+        if merged is not None:
+            return merged
 
         # Check for a common base class
         root_base = classes_list[0].__bases__[0]
         if not all(root_base in cls.__mro__ for cls in classes_list):
             raise TypeError("All classes must share the same root base class.")
 
-        new_class = type(new_class_name, tuple(classes_list), {})
+        with _lock:
+            new_class = merged_classes.setdefault(key, type(new_class_name, tuple(classes_list), {'__merged__': True}))
 
-        _logger.debug(f"Created merged class '{new_class_name}' with bases: {[cls.__name__ for cls in classes_list]}")
+        _logger.debug("Created merged class '%s' with bases: %s", new_class_name, [cls.__name__ for cls in classes_list])
         return new_class
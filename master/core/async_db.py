@@ -0,0 +1,539 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Optional, Tuple
+import asyncio
+import time
+import uuid
+import psycopg2
+from psycopg2 import extensions, sql
+from master.config.logging import get_logger
+from master.config import parser
+from master.exceptions.db import DatabaseAccessError, DatabaseSessionError, DatabasePoolTimeoutError
+from master.core.api import Meta
+from master.core.db import ROLE_TABLE_NAME, ROLE_CHANNEL_NAME, MISSING, RoleCache, RoleChangeListener, record_statement, _pools, _managers
+from master.core import metrics
+
+_logger = get_logger(__name__)
+
+
+async def wait(connection: Any) -> None:
+    """
+    Waits without blocking the event loop until the pending operation of an asynchronous connection completes.
+    If the waiting task is cancelled, the running query is cancelled server-side and drained so the
+    connection can be reused, then the cancellation is propagated.
+    Raises:
+        psycopg2.Error: If the operation failed.
+    """
+    try:
+        await _poll(connection)
+    except asyncio.CancelledError:
+        if connection.closed or not connection.isexecuting():
+            raise
+        try:
+            connection.cancel()
+            await asyncio.shield(_poll(connection))
+        except (psycopg2.Error, asyncio.CancelledError):
+            pass
+        raise
+
+
+async def _poll(connection: Any) -> None:
+    """Polls a connection until its pending operation completes, sleeping on its socket in between."""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        future = loop.create_future()
+        fileno = connection.fileno()
+
+        def wake_up():
+            if not future.done():
+                future.set_result(None)
+
+        if state == extensions.POLL_READ:
+            loop.add_reader(fileno, wake_up)
+            try:
+                await future
+            finally:
+                loop.remove_reader(fileno)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fileno, wake_up)
+            try:
+                await future
+            finally:
+                loop.remove_writer(fileno)
+        else:
+            raise psycopg2.OperationalError(f"Unexpected connection poll state: {state}")
+
+
+async def connect() -> Any:
+    """
+    Opens an asynchronous connection to the configured primary and waits until it is ready.
+    Raises:
+        DatabaseSessionError: If the connection could not be established.
+    """
+    try:
+        connection = psycopg2.connect(
+            host=parser.arguments.configuration['db_hostname'],
+            port=parser.arguments.configuration['db_port'],
+            dbname=parser.arguments.configuration['db_name'],
+            password=parser.arguments.configuration['db_password'],
+            user=parser.arguments.configuration['db_user'],
+            async_=True)
+        await wait(connection)
+        return connection
+    except psycopg2.Error as e:
+        _logger.error("Error connecting to PostgreSQL: %s", e)
+        raise DatabaseSessionError("Could not establish a database connection.")
+
+
+class AsyncCursor:
+    """Awaitable wrapper of a cursor opened on an asynchronous connection, results are fetched client-side."""
+    __slots__ = ('connection', 'cursor')
+
+    def __init__(self, connection: Any):
+        self.connection = connection
+        self.cursor = connection.cursor()
+
+    async def execute(self, query: Any, params: Any = None) -> None:
+        """Sends a query and waits for its result."""
+        started = time.perf_counter()
+        try:
+            self.cursor.execute(query, params)
+            await wait(self.connection)
+        except BaseException:
+            if parser.arguments.configuration['db_metrics']:
+                record_statement(query, self.cursor, started, error=True)
+            raise
+        if parser.arguments.configuration['db_metrics']:
+            record_statement(query, self.cursor, started, self.cursor.rowcount)
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size: Optional[int] = None) -> list:
+        return self.cursor.fetchmany(size) if size else self.cursor.fetchmany()
+
+    def fetchall(self) -> list:
+        return self.cursor.fetchall()
+
+    def mogrify(self, query: Any, params: Any = None) -> bytes:
+        return self.cursor.mogrify(query, params)
+
+    @property
+    def rowcount(self) -> int:
+        return self.cursor.rowcount
+
+    @property
+    def description(self) -> Any:
+        return self.cursor.description
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def close(self) -> None:
+        self.cursor.close()
+
+
+class AsyncConnectionPool:
+    """
+    A bounded pool of asynchronous PostgreSQL connections for a single event loop.
+    It mirrors ``master.core.db.ConnectionPool``: connections are opened lazily up to ``max_size``,
+    ``min_size`` of them survive ``idle_timeout``, and checkouts wait up to ``timeout`` seconds.
+    """
+    __slots__ = ('_factory', 'min_size', 'max_size', 'idle_timeout', 'timeout', 'ping_interval',
+                 '_idle', '_size', '_condition', '_closed', '__weakref__')
+
+    def __init__(self, factory: Any, min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 300.0, timeout: float = 30.0, ping_interval: float = 30.0):
+        """
+        Initializes the pool, no connection is opened until the first checkout.
+        Args:
+            factory: Coroutine function returning a new, ready, asynchronous connection.
+            min_size (int): Number of idle connections kept open.
+            max_size (int): Maximum number of open connections.
+            idle_timeout (float): Seconds before an idle connection above ``min_size`` is closed.
+            timeout (float): Seconds to wait for a free connection.
+            ping_interval (float): Idle seconds after which a connection is pinged on checkout.
+        Raises:
+            ValueError: If the sizes are inconsistent.
+        """
+        assert factory, 'Parameter "factory" is required'
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f'Invalid pool size, expected 0 <= min_size ({min_size}) <= max_size ({max_size}) and max_size >= 1')
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._size = 0
+        self._condition: Optional[asyncio.Condition] = None  # Bound to the running loop on first use
+        self._closed = False
+        _pools.add(self)
+
+    @property
+    def size(self) -> int:
+        """Returns the number of open connections, idle and borrowed."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """Returns the number of idle connections."""
+        return len(self._idle)
+
+    @property
+    def in_use(self) -> int:
+        """Returns the number of borrowed connections."""
+        return self._size - len(self._idle)
+
+    async def acquire(self) -> Any:
+        """
+        Borrows a healthy connection from the pool, opening a new one if none is idle.
+        Raises:
+            DatabasePoolTimeoutError: If no connection became available within ``timeout`` seconds.
+            DatabaseSessionError: If the pool is closed or a new connection could not be opened.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection, released_at = await self._checkout(deadline)
+            if connection is None:
+                connection = await self._open()
+                break
+            if await self._is_healthy(connection, time.monotonic() - released_at):
+                break
+            await self._discard(connection)
+        metrics.histogram('db_pool_checkout').observe(time.monotonic() - started)
+        return connection
+
+    async def release(self, connection: Any) -> None:
+        """Gives a borrowed connection back to the pool, connections left busy or closed are discarded."""
+        if connection.closed or connection.isexecuting() or self._closed:
+            await self._discard(connection)
+            return
+        async with self._get_condition():
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Any]:
+        """Borrows a connection for the duration of the block."""
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            await asyncio.shield(self.release(connection))
+
+    async def close(self) -> None:
+        """Closes idle connections and refuses new checkouts, borrowed connections are closed on release."""
+        async with self._get_condition():
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._close(connection)
+            self._condition.notify_all()
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def _checkout(self, deadline: float) -> Tuple[Any, float]:
+        """Pops an idle connection, or reserves a slot for a new one and returns ``(None, 0)``."""
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                if self._closed:
+                    raise DatabaseSessionError("Connection pool is closed.")
+                self._prune()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, 0.0
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    await asyncio.wait_for(condition.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise DatabasePoolTimeoutError(f"No database connection available after {self.timeout} seconds.")
+
+    async def _open(self) -> Any:
+        """Opens a new connection in a slot reserved by ``_checkout``."""
+        try:
+            return await self._factory()
+        except BaseException:
+            async with self._get_condition():
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def _prune(self) -> None:
+        """Closes connections idle for longer than ``idle_timeout`` while more than ``min_size`` are open."""
+        expired_before = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.min_size and self._idle[0][1] < expired_before:
+            connection, _ = self._idle.popleft()
+            self._close(connection)
+
+    async def _is_healthy(self, connection: Any, idle_for: float) -> bool:
+        """Checks a connection on checkout, pinging the server if it has been idle for a while."""
+        if connection.closed or connection.isexecuting():
+            return False
+        if idle_for < self.ping_interval:
+            return True
+        try:
+            cursor = AsyncCursor(connection)
+            await cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except psycopg2.Error as e:
+            _logger.warning("Discarding unhealthy connection: %s", e)
+            return False
+
+    async def _discard(self, connection: Any) -> None:
+        """Closes a connection that will not be reused and frees its slot."""
+        async with self._get_condition():
+            self._close(connection)
+            self._condition.notify()
+
+    def _close(self, connection: Any) -> None:
+        """Closes a connection and frees its slot, the condition lock must be held."""
+        self._size -= 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+class AsyncPostgresManager(metaclass=Meta):
+    """
+    Asyncio counterpart of ``master.core.db.PostgresManager`` built on psycopg2's asynchronous connections.
+    It exposes the same role and transaction API as coroutines; an instance must be used from a single event loop.
+    """
+    __meta_path__ = 'core.db.async_manager'
+
+    def __init__(self):
+        self.connections = {}
+        _managers.add(self)
+        self.pool = AsyncConnectionPool(
+            self.admin_connection,
+            min_size=parser.arguments.configuration['db_pool_min_size'],
+            max_size=parser.arguments.configuration['db_pool_max_size'],
+            idle_timeout=parser.arguments.configuration['db_pool_idle_timeout'],
+            timeout=parser.arguments.configuration['db_pool_timeout'])
+        self.role_cache = RoleCache(
+            max_size=parser.arguments.configuration['role_cache_size'],
+            ttl=parser.arguments.configuration['role_cache_ttl'])
+        self.role_listener = None
+        if self.role_cache.max_size > 0 and parser.arguments.configuration['role_cache_listen']:
+            self.role_listener = RoleChangeListener(self.role_cache, self._listener_connection)
+            self.role_listener.start()
+
+    async def admin_connection(self):
+        """Internal method to open a new asynchronous connection for role management, used as the pool factory."""
+        return await connect()
+
+    @staticmethod
+    def _listener_connection():
+        """Opens the blocking connection used by the role change listener thread."""
+        return psycopg2.connect(
+            host=parser.arguments.configuration['db_hostname'],
+            port=parser.arguments.configuration['db_port'],
+            dbname=parser.arguments.configuration['db_name'],
+            password=parser.arguments.configuration['db_password'],
+            user=parser.arguments.configuration['db_user'])
+
+    @asynccontextmanager
+    async def _begin(self, connection: Any) -> AsyncIterator[AsyncCursor]:
+        """
+        Runs a block in an explicit transaction, asynchronous connections being in autocommit mode.
+        The transaction is committed if the block succeeds and rolled back otherwise, including when the
+        task is cancelled; a connection that cannot be rolled back is closed so the pool discards it.
+        """
+        cursor = AsyncCursor(connection)
+        await cursor.execute("BEGIN")
+        try:
+            yield cursor
+            await cursor.execute("COMMIT")
+        except BaseException:
+            await asyncio.shield(self._rollback(cursor))
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    async def _rollback(cursor: AsyncCursor) -> None:
+        try:
+            await cursor.execute("ROLLBACK")
+        except psycopg2.Error as e:
+            _logger.warning("Closing connection that could not be rolled back: %s", e)
+            cursor.connection.close()
+
+    async def create_role(self, admin_user_id, target_user_id, role):
+        """Allows an admin to assign a role to a user."""
+        if not await self.is_admin(admin_user_id):
+            raise DatabaseAccessError("Only admins can create roles.")
+
+        async with self.pool.connection() as connection:
+            try:
+                async with self._begin(connection) as cursor:
+                    query = sql.SQL("INSERT INTO {table} (user_id, role) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET role = %s").format(
+                        table=sql.Identifier(ROLE_TABLE_NAME))
+                    await cursor.execute(query, (target_user_id, role, role))
+                    await cursor.execute("SELECT pg_notify(%s, %s)", (ROLE_CHANNEL_NAME, RoleCache.key(target_user_id)))
+            except Exception as e:
+                _logger.error("Failed to assign role: %s", e)
+                raise e
+        self.role_cache.invalidate(target_user_id)
+        _logger.info("Role '%s' assigned to user %s by admin %s", role, target_user_id, admin_user_id)
+
+    async def create_roles(self, admin_user_id, assignments):
+        """
+        Allows an admin to assign roles to many users in a single transaction.
+        Rows are upserted in chunks of ``db_batch_size`` multi-row INSERTs, the last role of a user wins.
+        """
+        if not await self.is_admin(admin_user_id):
+            raise DatabaseAccessError("Only admins can create roles.")
+
+        rows = list(dict(assignments).items())
+        if not rows:
+            return
+        batch_size = parser.arguments.configuration['db_batch_size']
+        async with self.pool.connection() as connection:
+            try:
+                async with self._begin(connection) as cursor:
+                    query = sql.SQL("INSERT INTO {table} (user_id, role) VALUES {values} ON CONFLICT (user_id) DO UPDATE SET role = EXCLUDED.role")
+                    for start in range(0, len(rows), batch_size):
+                        values = b','.join(cursor.mogrify("(%s, %s)", row) for row in rows[start:start + batch_size])
+                        await cursor.execute(query.format(table=sql.Identifier(ROLE_TABLE_NAME), values=sql.SQL(values.decode())))
+                    await cursor.execute("SELECT pg_notify(%s, '')", (ROLE_CHANNEL_NAME,))
+            except Exception as e:
+                _logger.error("Failed to assign roles: %s", e)
+                raise e
+        for user_id, _ in rows:
+            self.role_cache.invalidate(user_id)
+        _logger.info("Roles assigned to %s users by admin %s", len(rows), admin_user_id)
+
+    async def get_role(self, user_id):
+        """Fetches the role of a user, from the role cache when possible."""
+        role = self.role_cache.get(user_id)
+        if role is not MISSING:
+            return role
+        generation = self.role_cache.generation
+        async with self.pool.connection() as connection:
+            cursor = AsyncCursor(connection)
+            try:
+                query = sql.SQL("SELECT role FROM {table} WHERE user_id = %s").format(
+                    table=sql.Identifier(ROLE_TABLE_NAME))
+                await cursor.execute(query, (user_id,))
+                result = cursor.fetchone()
+                role = result[0] if result else None
+            except Exception as e:
+                _logger.error("Failed to get role: %s", e)
+                raise e
+            finally:
+                cursor.close()
+        self.role_cache.set(user_id, role, generation)
+        return role
+
+    async def get_roles(self, user_ids):
+        """Fetches the roles of many users, querying the database once for those missing from the role cache."""
+        roles = {}
+        missing = {}
+        for user_id in user_ids:
+            role = self.role_cache.get(user_id)
+            if role is MISSING:
+                missing[RoleCache.key(user_id)] = user_id
+            else:
+                roles[user_id] = role
+        if not missing:
+            return roles
+
+        generation = self.role_cache.generation
+        async with self.pool.connection() as connection:
+            cursor = AsyncCursor(connection)
+            try:
+                query = sql.SQL("SELECT user_id, role FROM {table} WHERE user_id = ANY(%s)").format(
+                    table=sql.Identifier(ROLE_TABLE_NAME))
+                await cursor.execute(query, (list(missing.values()),))
+                fetched = {RoleCache.key(user_id): role for user_id, role in cursor}
+            except Exception as e:
+                _logger.error("Failed to get roles: %s", e)
+                raise e
+            finally:
+                cursor.close()
+        for key, user_id in missing.items():
+            roles[user_id] = fetched.get(key)
+            self.role_cache.set(user_id, roles[user_id], generation)
+        return roles
+
+    async def is_admin(self, user_id):
+        """Checks if a user has an admin role."""
+        return await self.get_role(user_id) == "admin"
+
+    async def create_connection(self, user_id):
+        """Borrows a pooled PostgreSQL connection for the user if the user is an admin."""
+        if not await self.is_admin(user_id):
+            raise DatabaseAccessError("Only admins can create connections.")
+
+        if user_id not in self.connections:
+            self.connections[user_id] = await self.pool.acquire()
+            _logger.info("Connection created for admin user %s", user_id)
+        else:
+            _logger.info("Connection for user %s already exists", user_id)
+
+    async def close_connection(self, user_id):
+        """Returns a user's connection to the pool."""
+        if user_id in self.connections:
+            await self.pool.release(self.connections.pop(user_id))
+            _logger.info("Connection closed for user %s", user_id)
+        else:
+            _logger.info("No connection found for user %s", user_id)
+
+    async def close(self):
+        """Stops the role change listener, returns every user connection and closes the pool."""
+        if self.role_listener is not None:
+            self.role_listener.stop()
+        for user_id in list(self.connections):
+            await self.close_connection(user_id)
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def transaction(self, user_id):
+        """Executes a transaction block on the pooled connection borrowed by the user, cancellation rolls it back."""
+        if user_id not in self.connections:
+            raise DatabaseSessionError(f"No connection found for user {user_id}")
+
+        started = time.monotonic()
+        try:
+            async with self._begin(self.connections[user_id]) as cursor:
+                yield cursor
+        except Exception as e:
+            _logger.error("Transaction for user %s failed: %s", user_id, e)
+            raise e
+        finally:
+            metrics.histogram('db_transaction').observe(time.monotonic() - started)
+
+    async def stream_query(self, user_id, query, params=None, batch_size=None):
+        """
+        Runs a query in its own transaction and yields its rows one by one.
+        Asynchronous connections do not support named cursors, so the query is DECLAREd as a server-side
+        cursor and FETCHed ``batch_size`` rows at a time, ``db_stream_batch_size`` by default.
+        """
+        batch_size = batch_size or parser.arguments.configuration['db_stream_batch_size']
+        name = sql.Identifier(f"master_stream_{uuid.uuid4().hex}")
+        async with self.transaction(user_id) as cursor:
+            declared = cursor.mogrify(query, params).decode()
+            await cursor.execute(sql.SQL("DECLARE {name} NO SCROLL CURSOR FOR {query}").format(name=name, query=sql.SQL(declared)))
+            fetch = sql.SQL("FETCH FORWARD {size} FROM {name}").format(size=sql.Literal(batch_size), name=name)
+            while True:
+                await cursor.execute(fetch)
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
@@ -1,115 +1,1067 @@
+from collections import deque, OrderedDict
 from contextlib import contextmanager
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+from itertools import starmap
+import functools
+import re
+import select
+import threading
+import time
+import uuid
+import weakref
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import extensions, extras, sql
 from master.config.logging import get_logger
-from master.config.parser import arguments
-from master.exceptions.db import DatabaseAccessError, DatabaseSessionError
+from master.config import parser
+from master.exceptions.db import DatabaseAccessError, DatabaseSessionError, DatabasePoolTimeoutError
 from master.core.api import Meta
+from master.core import metrics, rows
+from master.tools.cache import MISSING, TTLCache
 
 ROLE_TABLE_NAME = "user_roles"  # Table for storing user roles in PostgreSQL
+ROLE_CHANNEL_NAME = "user_roles"  # LISTEN/NOTIFY channel announcing role changes
 _logger = get_logger(__name__)
+_pools = weakref.WeakSet()  # Open pools, sync and async, summed by the connection gauges
+_managers = weakref.WeakSet()
+
+
+def statement_text(query: Any, context: Any) -> str:
+    """Returns the SQL of a query given to ``execute``, composed queries are rendered with the given connection or cursor."""
+    if isinstance(query, str):
+        return query
+    if isinstance(query, bytes):
+        return query.decode(errors='replace')
+    return query.as_string(context)
+
+
+def record_statement(query: Any, context: Any, started: float, rows: int = 0, error: bool = False) -> None:
+    """
+    Records a statement in ``master.core.metrics`` and logs it when slower than ``db_slow_query_ms``.
+    Args:
+        query: The query given to ``execute``.
+        context: Connection or cursor used to render composed queries.
+        started (float): ``time.perf_counter()`` before the statement was sent.
+        rows (int): Rows returned or affected.
+        error (bool): Whether the statement failed.
+    """
+    duration = time.perf_counter() - started
+    try:
+        text = statement_text(query, context)
+    except Exception:
+        text = repr(query)
+    metrics.record_statement(text, duration, rows, error)
+    threshold = parser.arguments.configuration['db_slow_query_ms']
+    if threshold and duration * 1000 >= threshold:
+        _logger.warning("Slow query (%.1f ms, %s rows%s): %s", duration * 1000, max(rows, 0),
+                        ', failed' if error else '', metrics.normalize(text))
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Cursor recording the latency, row count and failure of each statement, see ``record_statement``."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except BaseException:
+            record_statement(query, self, started, error=True)
+            raise
+        record_statement(query, self, started, self.rowcount)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except BaseException:
+            record_statement(query, self, started, error=True)
+            raise
+        record_statement(query, self, started, self.rowcount)
+        return result
+
+
+class RecordCursor(extensions.cursor):
+    """Cursor returning rows as slotted records, one class per column set, see ``master.core.rows.record_class``."""
+
+    def _record_class(self):
+        description = self.description
+        # The description is the same object until the next statement
+        if getattr(self, '_described', None) is not description:
+            self._described = description
+            self._record = rows.record_class(tuple(column.name for column in description))
+        return self._record
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._record_class()(*row)
+
+    def fetchmany(self, size=None):
+        fetched = super().fetchmany(self.arraysize if size is None else size)
+        return list(starmap(self._record_class(), fetched)) if fetched else fetched
+
+    def fetchall(self):
+        fetched = super().fetchall()
+        return list(starmap(self._record_class(), fetched)) if fetched else fetched
+
+    def __iter__(self):
+        iterator = super().__iter__()
+        try:
+            # Named cursors only have a description once the first batch was fetched
+            first = next(iterator)
+        except StopIteration:
+            return
+        record = self._record_class()
+        yield record(*first)
+        for row in iterator:
+            yield record(*row)
+
+
+class InstrumentedRecordCursor(InstrumentedCursor, RecordCursor):
+    """``RecordCursor`` recording its statements, see ``InstrumentedCursor``."""
+
+
+class PreparingConnection(extensions.connection):
+    """
+    Connection keeping track of the statements it prepared on the server, see ``Statement``.
+    Attributes:
+        prepared (OrderedDict): Statement name by SQL, the least recently executed first.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: OrderedDict = OrderedDict()
+        self._prepared_count = 0
+
+    def prepared_name(self) -> str:
+        """Returns a statement name never used on this connection."""
+        self._prepared_count += 1
+        return f"master_prepared_{self._prepared_count}"
+
+
+class Statement:
+    """
+    A query composed once at module level and executed as a server-side prepared statement.
+    Each connection prepares it on first use and keeps the ``db_prepared_statements`` most recently executed
+    statements, the least recently executed one is deallocated beyond that. Connections which are not
+    ``PreparingConnection``, or a limit of 0, execute the query as a plain statement.
+    Attributes:
+        query (sql.Composable): The query, with ``%s`` placeholders only.
+    """
+    __slots__ = ('query', '_text', '_prepared_text', '_parameters')
+    _PLACEHOLDERS = re.compile(r"%%|%s|%\(")
+
+    def __init__(self, query: Any):
+        self.query = query
+        self._text = None  # Rendered on first execution, identifiers do not depend on the connection
+        self._prepared_text = None
+        self._parameters = 0
+
+    def text(self, context: Any) -> str:
+        """Returns the SQL of the query, rendered once with the given connection or cursor."""
+        if self._text is None:
+            text = statement_text(self.query, context)
+            self._prepared_text, self._parameters = self._numbered(text)
+            self._text = text
+        return self._text
+
+    @classmethod
+    def _numbered(cls, text: str) -> Tuple[str, int]:
+        """Returns the SQL with ``$n`` placeholders as expected by PREPARE, and the number of parameters."""
+        parameters = 0
+
+        def replace(match):
+            nonlocal parameters
+            if match.group() == '%%':
+                return '%'
+            if match.group() == '%(':
+                raise ValueError('Prepared statements only support positional "%s" placeholders')
+            parameters += 1
+            return f"${parameters}"
+        return cls._PLACEHOLDERS.sub(replace, text), parameters
+
+    def execute(self, cursor: Any, params: Any = ()) -> None:
+        """Executes the statement on a cursor, preparing it on the connection of the cursor if needed."""
+        text = self.text(cursor)
+        connection = cursor.connection
+        limit = parser.arguments.configuration['db_prepared_statements']
+        if limit <= 0 or not isinstance(connection, PreparingConnection):
+            cursor.execute(text, params)
+            return
+        name = connection.prepared.get(text)
+        if name is None:
+            name = self._prepare(cursor, connection, limit)
+        else:
+            connection.prepared.move_to_end(text)
+        query = f"EXECUTE {name} ({', '.join(['%s'] * self._parameters)})" if self._parameters else f"EXECUTE {name}"
+        if not isinstance(cursor, InstrumentedCursor):
+            cursor.execute(query, params)
+            return
+        # Recorded under the SQL of the statement rather than the generated name
+        started = time.perf_counter()
+        try:
+            extensions.cursor.execute(cursor, query, params)
+        except BaseException:
+            record_statement(text, cursor, started, error=True)
+            raise
+        record_statement(text, cursor, started, cursor.rowcount)
+
+    def _prepare(self, cursor: Any, connection: PreparingConnection, limit: int) -> str:
+        """Prepares the statement and deallocates the least recently executed ones beyond ``limit``."""
+        while len(connection.prepared) >= limit:
+            _, evicted = connection.prepared.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted}")
+        name = connection.prepared_name()
+        # Prepared statements are not transactional, a later rollback does not drop them
+        cursor.execute(f"PREPARE {name} AS {self._prepared_text}")
+        connection.prepared[self._text] = name
+        return name
+
+
+SELECT_ROLE = Statement(sql.SQL("SELECT role FROM {table} WHERE user_id = %s").format(
+    table=sql.Identifier(ROLE_TABLE_NAME)))
+SELECT_ROLES = Statement(sql.SQL("SELECT user_id, role FROM {table} WHERE user_id = ANY(%s)").format(
+    table=sql.Identifier(ROLE_TABLE_NAME)))
+UPSERT_ROLE = Statement(sql.SQL("INSERT INTO {table} (user_id, role) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET role = EXCLUDED.role").format(
+    table=sql.Identifier(ROLE_TABLE_NAME)))
+NOTIFY_ROLE = Statement(sql.SQL("SELECT pg_notify(%s, %s)"))
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of PostgreSQL connections.
+    Connections are opened lazily up to ``max_size``; once opened, ``min_size`` of them are kept
+    alive even when idle, the others are closed after ``idle_timeout`` seconds without use.
+    Attributes:
+        min_size (int): Number of idle connections that are never closed for inactivity.
+        max_size (int): Maximum number of open connections, idle and borrowed.
+        idle_timeout (float): Seconds after which an idle connection above ``min_size`` is closed.
+        timeout (float): Seconds to wait for a free connection before giving up.
+        ping_interval (float): Idle seconds after which a connection is pinged on checkout.
+    """
+    __slots__ = ('_factory', 'min_size', 'max_size', 'idle_timeout', 'timeout', 'ping_interval',
+                 '_idle', '_size', '_condition', '_closed', '__weakref__')
+
+    def __init__(self, factory: Callable[[], Any], min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 300.0, timeout: float = 30.0, ping_interval: float = 30.0):
+        """
+        Initializes the pool, no connection is opened until the first checkout.
+        Args:
+            factory (Callable): Callable returning a new psycopg2 connection.
+            min_size (int): Number of idle connections kept open.
+            max_size (int): Maximum number of open connections.
+            idle_timeout (float): Seconds before an idle connection above ``min_size`` is closed.
+            timeout (float): Seconds to wait for a free connection.
+            ping_interval (float): Idle seconds after which a connection is pinged on checkout.
+        Raises:
+            ValueError: If the sizes are inconsistent.
+        """
+        assert factory, 'Parameter "factory" is required'
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f'Invalid pool size, expected 0 <= min_size ({min_size}) <= max_size ({max_size}) and max_size >= 1')
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle: Deque[Tuple[Any, float]] = deque()  # (connection, released at), most recent on the right
+        self._size = 0  # Open connections, idle and borrowed
+        self._condition = threading.Condition()
+        self._closed = False
+        _pools.add(self)
+
+    @property
+    def size(self) -> int:
+        """Returns the number of open connections, idle and borrowed."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """Returns the number of idle connections."""
+        return len(self._idle)
+
+    @property
+    def in_use(self) -> int:
+        """Returns the number of borrowed connections."""
+        return self._size - len(self._idle)
+
+    @property
+    def closed(self) -> bool:
+        """Returns whether the pool was closed."""
+        return self._closed
+
+    def acquire(self) -> Any:
+        """
+        Borrows a healthy connection from the pool, opening a new one if none is idle.
+        Returns:
+            A psycopg2 connection that must be given back with ``release``.
+        Raises:
+            DatabasePoolTimeoutError: If no connection became available within ``timeout`` seconds.
+            DatabaseSessionError: If the pool is closed or a new connection could not be opened.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection, released_at = self._checkout(deadline)
+            if connection is None:
+                connection = self._open()
+                break
+            if self._is_healthy(connection, time.monotonic() - released_at):
+                break
+            self._discard(connection)
+        metrics.histogram('db_pool_checkout').observe(time.monotonic() - started)
+        return connection
+
+    def release(self, connection: Any) -> None:
+        """
+        Gives a borrowed connection back to the pool, rolling back any pending transaction.
+        Broken connections are closed instead of being reused.
+        """
+        try:
+            if not connection.closed and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error as e:
+            _logger.warning("Discarding connection that could not be reset: %s", e)
+        if connection.closed or self._closed:
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrows a connection for the duration of the block."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Closes idle connections and refuses new checkouts, borrowed connections are closed on release."""
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._close(connection)
+            self._condition.notify_all()
+
+    def close_idle(self, count: int = 1) -> int:
+        """
+        Closes up to ``count`` idle connections, the least recently used first, ignoring ``min_size``.
+        Returns:
+            int: The number of closed connections.
+        """
+        closed = 0
+        with self._condition:
+            while self._idle and closed < count:
+                connection, _ = self._idle.popleft()
+                self._close(connection)
+                closed += 1
+            if closed:
+                self._condition.notify()
+        return closed
+
+    def _checkout(self, deadline: float) -> Tuple[Any, float]:
+        """Pops an idle connection, or reserves a slot for a new one and returns ``(None, 0)``."""
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise DatabaseSessionError("Connection pool is closed.")
+                self._prune()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, 0.0
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise DatabasePoolTimeoutError(f"No database connection available after {self.timeout} seconds.")
+
+    def _open(self) -> Any:
+        """Opens a new connection in a slot reserved by ``_checkout``."""
+        try:
+            return self._factory()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def _prune(self) -> None:
+        """Closes connections idle for longer than ``idle_timeout`` while more than ``min_size`` are open."""
+        expired_before = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.min_size and self._idle[0][1] < expired_before:
+            connection, _ = self._idle.popleft()
+            self._close(connection)
+
+    def _is_healthy(self, connection: Any, idle_for: float) -> bool:
+        """Checks a connection on checkout, pinging the server if it has been idle for a while."""
+        if connection.closed or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_for < self.ping_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error as e:
+            _logger.warning("Discarding unhealthy connection: %s", e)
+            return False
+
+    def _discard(self, connection: Any) -> None:
+        """Closes a connection that will not be reused and frees its slot."""
+        with self._condition:
+            self._close(connection)
+            self._condition.notify()
+
+    def _close(self, connection: Any) -> None:
+        """Closes a connection and frees its slot, the condition lock must be held."""
+        self._size -= 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+class ReplicaRouter:
+    """
+    Picks the read replica serving the next read and keeps unhealthy replicas out of rotation.
+    Attributes:
+        pools (List[ConnectionPool]): One connection pool per replica.
+        strategy (str): ``round_robin`` or ``least_connections``.
+        retry_interval (float): Seconds an unhealthy replica stays out of rotation.
+    """
+    __slots__ = ('pools', 'strategy', 'retry_interval', '_unhealthy_until', '_next', '_lock')
+    STRATEGIES = ('round_robin', 'least_connections')
+
+    def __init__(self, pools: List[ConnectionPool], strategy: str = 'round_robin', retry_interval: float = 30.0):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Unknown replica strategy "{strategy}", choose one of: {" | ".join(self.STRATEGIES)}')
+        self.pools = pools
+        self.strategy = strategy
+        self.retry_interval = retry_interval
+        self._unhealthy_until = [0.0] * len(pools)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def candidates(self) -> List[ConnectionPool]:
+        """Returns the healthy replicas, the preferred one first."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [pool for pool, until in zip(self.pools, self._unhealthy_until) if until <= now]
+            if not healthy:
+                return []
+            if self.strategy == 'least_connections':
+                return sorted(healthy, key=lambda pool: pool.in_use)
+            start = self._next % len(healthy)
+            self._next += 1
+            return healthy[start:] + healthy[:start]
+
+    def mark_unhealthy(self, pool: ConnectionPool) -> None:
+        """Takes a replica out of rotation for ``retry_interval`` seconds."""
+        with self._lock:
+            self._unhealthy_until[self.pools.index(pool)] = time.monotonic() + self.retry_interval
+
+    def close(self) -> None:
+        for pool in self.pools:
+            pool.close()
+
+
+class RoleCache(TTLCache):
+    """
+    Thread-safe LRU cache of user roles with a time to live, see ``master.tools.cache.TTLCache``.
+    Users without a role are cached too, so repeated checks of unknown users stay off the database.
+    Attributes:
+        max_size (int): Maximum number of cached users, the least recently used is evicted first.
+        ttl (float): Seconds after which a cached role is considered stale.
+    """
+    __slots__ = ()
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        """Initializes an empty cache, a ``max_size`` of 0 disables caching."""
+        super().__init__(max_size, ttl)
+
+    @staticmethod
+    def key(user_id: Any) -> str:
+        """Returns the cache key of a user, notification payloads are strings so keys are too."""
+        return str(user_id)
+
+    def invalidate(self, user_id: Any = None) -> None:
+        """Drops the cached role of a user, or every cached role if no user is given."""
+        super().invalidate(MISSING if user_id is None else user_id)
+
+
+class RoleChangeListener(threading.Thread):
+    """
+    Background thread invalidating a ``RoleCache`` when another process changes a role.
+    It LISTENs on ``ROLE_CHANNEL_NAME`` over a dedicated connection; the payload of each notification
+    is the user id whose role changed, an empty payload invalidates every role.
+    """
+
+    def __init__(self, cache: RoleCache, connect: Callable[[], Any], poll_interval: float = 1.0, retry_interval: float = 5.0):
+        super().__init__(name='role-change-listener', daemon=True)
+        self.cache = cache
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                connection.set_session(autocommit=True)
+                with connection.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {channel}").format(channel=sql.Identifier(ROLE_CHANNEL_NAME)))
+                # Notifications may have been missed while disconnected
+                self.cache.invalidate()
+                self._listen(connection)
+            except Exception as e:
+                _logger.warning("Role change listener disconnected, roles are only cached for their TTL: %s", e)
+                self.cache.invalidate()
+                self._stopped.wait(self.retry_interval)
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+    def _listen(self, connection: Any) -> None:
+        while not self._stopped.is_set():
+            if select.select([connection], [], [], self.poll_interval) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                payload = connection.notifies.pop(0).payload
+                self.cache.invalidate(payload or None)
+
+    def stop(self) -> None:
+        """Asks the thread to stop, it exits within ``poll_interval`` seconds."""
+        self._stopped.set()
+
+
+class Tenant:
+    """The connection pool and role cache of one tenant database."""
+    __slots__ = ('name', 'pool', 'role_cache')
+
+    def __init__(self, name: str, pool: ConnectionPool, role_cache: RoleCache):
+        self.name = name
+        self.pool = pool
+        self.role_cache = role_cache
+
+
+class TenantRouter:
+    """
+    Routes tenants to per-database connection pools, created on first use.
+    Every connection, of the tenant pools and of the ``pinned`` ones, counts against ``max_connections``. A pool
+    needing a connection past that cap first evicts the least recently used tenant pool that has none borrowed,
+    then closes idle connections of the other pools, least recently used tenants first, so cold tenants give
+    their connections up to hot ones. Past ``max_pools`` tenants, idle tenant pools are evicted the same way.
+    Roles are cached per tenant, without a change listener: a listener would hold a connection per tenant,
+    so changes made by other processes are seen after ``ttl``.
+    Attributes:
+        allowed (frozenset): Databases that may be used as tenants, any database if empty.
+        max_connections (int): Connections open at once across the tenant and pinned pools.
+        max_pools (int): Tenant pools kept open at once, pools with borrowed connections are never evicted.
+        pinned (List[ConnectionPool]): Pools counted against ``max_connections`` but never evicted.
+        evictions (int): Number of evicted tenant pools.
+    """
+    __slots__ = ('_factory', 'allowed', 'max_connections', 'max_pools', 'pinned', 'evictions', '_pool_options',
+                 '_cache_options', '_tenants', '_lock')
+
+    def __init__(self, factory: Callable[[str], Any], max_connections: int = 100, max_pools: int = 50,
+                 allowed: Iterable[str] = (), pinned: Iterable[ConnectionPool] = (),
+                 pool_options: Optional[dict] = None, cache_options: Optional[dict] = None):
+        """
+        Args:
+            factory (Callable[[str], Any]): Opens a new connection to the given database.
+            max_connections (int): Connections open at once across the tenant and pinned pools.
+            max_pools (int): Tenant pools kept open at once.
+            allowed (Iterable[str]): Databases that may be used as tenants, any database if empty.
+            pinned (Iterable[ConnectionPool]): Pools counted against ``max_connections`` but never evicted.
+            pool_options (dict): Keyword arguments of the ``ConnectionPool`` of each tenant.
+            cache_options (dict): Keyword arguments of the ``RoleCache`` of each tenant.
+        """
+        self._factory = factory
+        self.allowed = frozenset(allowed)
+        self.max_connections = max_connections
+        self.max_pools = max_pools
+        self.pinned = list(pinned)
+        self.evictions = 0
+        self._pool_options = pool_options or {}
+        self._cache_options = cache_options or {}
+        self._tenants: OrderedDict = OrderedDict()  # name -> Tenant, least recently used first
+        self._lock = threading.RLock()
+
+    @property
+    def size(self) -> int:
+        """Returns the number of open connections across the tenant and pinned pools."""
+        return sum(pool.size for pool in self.pinned) + sum(tenant.pool.size for tenant in list(self._tenants.values()))
+
+    def __len__(self) -> int:
+        """Returns the number of open tenant pools."""
+        return len(self._tenants)
+
+    def get(self, name: str) -> Tenant:
+        """
+        Returns a tenant, creating its pool on first use.
+        Raises:
+            DatabaseAccessError: If the database is not one of the ``allowed`` tenants.
+        """
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is not None:
+                self._tenants.move_to_end(name)
+                return tenant
+            if self.allowed and name not in self.allowed:
+                raise DatabaseAccessError(f'Unknown tenant "{name}"')
+            if len(self._tenants) >= self.max_pools and not self._evict():
+                _logger.warning("Every one of the %s tenant pools is busy, opening one more for %s", len(self._tenants), name)
+            tenant = Tenant(name, ConnectionPool(functools.partial(self._open, name), **self._pool_options),
+                            RoleCache(**self._cache_options))
+            self._tenants[name] = tenant
+            return tenant
+
+    def acquire(self, name: str) -> Tuple[Tenant, Any]:
+        """
+        Borrows a connection of a tenant, see ``ConnectionPool.acquire``.
+        Returns:
+            Tuple[Tenant, Any]: The tenant, whose pool the connection must be released to, and the connection.
+        """
+        while True:
+            tenant = self.get(name)
+            try:
+                return tenant, tenant.pool.acquire()
+            except DatabaseSessionError:
+                if not tenant.pool.closed:
+                    raise
+                # Evicted between the lookup and the checkout, the next lookup opens a new pool
+
+    def reserve(self, name: Optional[str] = None) -> None:
+        """
+        Waits until a pool may open a connection without exceeding ``max_connections``, the size of the pool
+        already counts that connection. Connections of other pools are closed to make room when possible.
+        Args:
+            name (Optional[str]): The tenant opening a connection, None for a pinned pool.
+        Raises:
+            DatabasePoolTimeoutError: If no room was made within the pool timeout.
+        """
+        timeout = self._pool_options.get('timeout', 30.0)
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                while self.size > self.max_connections and (self._evict(exclude=name) or self._close_idle(exclude=name)):
+                    pass
+                if self.size <= self.max_connections:
+                    return
+            if time.monotonic() >= deadline:
+                raise DatabasePoolTimeoutError(f"No database connection available after {timeout} seconds, "
+                                               f"{self.max_connections} connections are open.")
+            # Connections are given back to the pools of their tenants, which do not tell the router
+            time.sleep(0.01)
+
+    def _open(self, name: str) -> Any:
+        self.reserve(name)
+        return self._factory(name)
+
+    def _evict(self, exclude: Optional[str] = None) -> bool:
+        """Closes the least recently used tenant pool without borrowed connections, the lock must be held."""
+        for name, tenant in self._tenants.items():
+            if name != exclude and tenant.pool.in_use == 0:
+                del self._tenants[name]
+                tenant.pool.close()
+                self.evictions += 1
+                _logger.info("Evicted the connection pool of tenant %s", name)
+                return True
+        return False
+
+    def _close_idle(self, exclude: Optional[str] = None) -> bool:
+        """Closes an idle connection of another pool, cold tenants first, the lock must be held."""
+        pools = [tenant.pool for name, tenant in self._tenants.items() if name != exclude] + self.pinned
+        return any(pool.close_idle(1) for pool in pools)
+
+    def close(self) -> None:
+        with self._lock:
+            for tenant in self._tenants.values():
+                tenant.pool.close()
+            self._tenants.clear()
 
 
 class PostgresManager(metaclass=Meta):
+    """
+    Role management and user transactions on the ``db_name`` database, or on tenant databases.
+    Methods taking a ``tenant`` run on the database of that name through a pool of the ``TenantRouter``,
+    None or ``db_name`` itself use the primary pool, its read replicas and its listened role cache.
+    """
     __meta_path__ = 'core.db.manager'
 
     def __init__(self):
-        self.connections = {}
+        self.connections = {}  # user id, or (tenant, user id), -> borrowed connection
+        _managers.add(self)
+        self.tenants = TenantRouter(
+            self._tenant_connection,
+            max_connections=parser.arguments.configuration['db_tenant_max_connections'],
+            max_pools=parser.arguments.configuration['db_tenant_max_pools'],
+            allowed=parser.arguments.configuration['db_tenants'],
+            pool_options={
+                'min_size': 0,
+                'max_size': parser.arguments.configuration['db_tenant_pool_max_size'],
+                'idle_timeout': parser.arguments.configuration['db_pool_idle_timeout'],
+                'timeout': parser.arguments.configuration['db_pool_timeout']},
+            cache_options={
+                'max_size': parser.arguments.configuration['role_cache_size'],
+                'ttl': parser.arguments.configuration['role_cache_ttl']})
+        self.pool = ConnectionPool(
+            self._primary_connection,
+            min_size=parser.arguments.configuration['db_pool_min_size'],
+            max_size=parser.arguments.configuration['db_pool_max_size'],
+            idle_timeout=parser.arguments.configuration['db_pool_idle_timeout'],
+            timeout=parser.arguments.configuration['db_pool_timeout'])
+        self.tenants.pinned.append(self.pool)
+        self.replicas = None
+        if parser.arguments.configuration['db_replicas']:
+            self.replicas = ReplicaRouter(
+                [ConnectionPool(
+                    functools.partial(self.admin_connection, replica.get('hostname'), replica.get('port')),
+                    min_size=parser.arguments.configuration['db_pool_min_size'],
+                    max_size=parser.arguments.configuration['db_pool_max_size'],
+                    idle_timeout=parser.arguments.configuration['db_pool_idle_timeout'],
+                    timeout=parser.arguments.configuration['db_pool_timeout'])
+                 for replica in parser.arguments.configuration['db_replicas']],
+                strategy=parser.arguments.configuration['db_replica_strategy'],
+                retry_interval=parser.arguments.configuration['db_replica_retry_interval'])
+        self.last_write = float('-inf')  # Monotonic time of the last write, reads shortly after go to the primary
+        self.role_cache = RoleCache(
+            max_size=parser.arguments.configuration['role_cache_size'],
+            ttl=parser.arguments.configuration['role_cache_ttl'])
+        self.role_listener = None
+        if self.role_cache.max_size > 0 and parser.arguments.configuration['role_cache_listen']:
+            self.role_listener = RoleChangeListener(self.role_cache, self.admin_connection)
+            self.role_listener.start()
 
-    def admin_connection(self):
-        """Internal method to return a connection for role management."""
+    def admin_connection(self, hostname=None, port=None, dbname=None):
+        """
+        Internal method to open a new connection for role management, used as the pool factory.
+        The primary is used unless the hostname or port of a replica is given, and ``db_name`` unless
+        the database of a tenant is given.
+        """
         try:
-            admin_username = arguments.configuration['db_user']
-            if admin_username in self.connections:
-                return self.connections[admin_username]
-            connection = psycopg2.connect(
-                host=arguments.configuration['db_hostname'],
-                port=arguments.configuration['db_port'],
-                dbname=arguments.configuration['db_name'],
-                password=arguments.configuration['db_password'],
-                user=admin_username)
-            return connection
+            return psycopg2.connect(
+                host=hostname or parser.arguments.configuration['db_hostname'],
+                port=port or parser.arguments.configuration['db_port'],
+                dbname=dbname or parser.arguments.configuration['db_name'],
+                password=parser.arguments.configuration['db_password'],
+                user=parser.arguments.configuration['db_user'],
+                connection_factory=PreparingConnection,
+                cursor_factory=InstrumentedCursor if parser.arguments.configuration['db_metrics'] else extensions.cursor)
         except psycopg2.Error as e:
-            _logger.error(f"Error connecting to PostgreSQL: {e}")
+            _logger.error("Error connecting to PostgreSQL: %s", e)
             raise DatabaseSessionError("Could not establish a database connection.")
 
-    def create_role(self, admin_user_id, target_user_id, role):
-        """Allows an admin to assign a role to a user."""
-        if not self.is_admin(admin_user_id):
+    def _primary_connection(self):
+        # Connections of the primary pool count against the connections of the tenants
+        self.tenants.reserve()
+        return self.admin_connection()
+
+    def _tenant_connection(self, tenant):
+        return self.admin_connection(dbname=tenant)
+
+    @staticmethod
+    def _tenant_name(tenant):
+        """Returns the tenant to route to, None for the ``db_name`` database."""
+        return None if tenant is None or tenant == parser.arguments.configuration['db_name'] else tenant
+
+    def _role_cache(self, tenant):
+        return self.role_cache if tenant is None else self.tenants.get(tenant).role_cache
+
+    @contextmanager
+    def _connection(self, tenant):
+        """Borrows a connection of the primary pool, or of the pool of a tenant, for the duration of the block."""
+        if tenant is None:
+            with self.pool.connection() as connection:
+                yield connection
+            return
+        entry, connection = self.tenants.acquire(tenant)
+        try:
+            yield connection
+        finally:
+            entry.pool.release(connection)
+
+    def create_role(self, admin_user_id, target_user_id, role, tenant=None):
+        """Allows an admin to assign a role to a user, in the database of ``tenant`` if given."""
+        tenant = self._tenant_name(tenant)
+        if not self.is_admin(admin_user_id, tenant):
             raise DatabaseAccessError("Only admins can create roles.")
 
-        connection = self.admin_connection()
+        with self._connection(tenant) as connection:
+            cursor = connection.cursor()
+            try:
+                UPSERT_ROLE.execute(cursor, (target_user_id, role))
+                # Delivered to the other processes on commit only
+                NOTIFY_ROLE.execute(cursor, (ROLE_CHANNEL_NAME, RoleCache.key(target_user_id)))
+                connection.commit()
+                if tenant is None:
+                    self.last_write = time.monotonic()
+                self._role_cache(tenant).invalidate(target_user_id)
+                _logger.info("Role '%s' assigned to user %s by admin %s", role, target_user_id, admin_user_id)
+            except Exception as e:
+                connection.rollback()
+                _logger.error("Failed to assign role: %s", e)
+                raise e
+            finally:
+                cursor.close()
+
+    def create_roles(self, admin_user_id, assignments, tenant=None):
+        """
+        Allows an admin to assign roles to many users in a single transaction.
+        Rows are upserted in chunks of ``db_batch_size`` multi-row INSERTs, when a user appears several
+        times the last role wins, as it would with successive ``create_role`` calls.
+        Args:
+            admin_user_id: The admin assigning the roles.
+            assignments: Mapping or iterable of ``(user_id, role)`` pairs.
+            tenant (str): Database of the tenant, ``db_name`` by default.
+        """
+        tenant = self._tenant_name(tenant)
+        if not self.is_admin(admin_user_id, tenant):
+            raise DatabaseAccessError("Only admins can create roles.")
+
+        rows = list(dict(assignments).items())
+        if not rows:
+            return
+        with self._connection(tenant) as connection:
+            cursor = connection.cursor()
+            try:
+                query = sql.SQL("INSERT INTO {table} (user_id, role) VALUES %s ON CONFLICT (user_id) DO UPDATE SET role = EXCLUDED.role").format(
+                    table=sql.Identifier(ROLE_TABLE_NAME))
+                extras.execute_values(cursor, query, rows, page_size=parser.arguments.configuration['db_batch_size'])
+                # An empty payload makes the other processes drop every cached role
+                cursor.execute("SELECT pg_notify(%s, '')", (ROLE_CHANNEL_NAME,))
+                connection.commit()
+                if tenant is None:
+                    self.last_write = time.monotonic()
+                role_cache = self._role_cache(tenant)
+                for user_id, _ in rows:
+                    role_cache.invalidate(user_id)
+                _logger.info("Roles assigned to %s users by admin %s", len(rows), admin_user_id)
+            except Exception as e:
+                connection.rollback()
+                _logger.error("Failed to assign roles: %s", e)
+                raise e
+            finally:
+                cursor.close()
+
+    def get_role(self, user_id, tenant=None):
+        """
+        Fetches the role of a user, from the role cache when possible.
+        Roles read to be cached come from the primary: a lagging replica may still answer with a role whose
+        change was already notified, and that answer would then be cached for ``role_cache_ttl``. Replicas only
+        serve role reads when the cache is disabled.
+        """
+        tenant = self._tenant_name(tenant)
+        role_cache = self._role_cache(tenant)
+        # Concurrent misses of a user share one query
+        return role_cache.get_or_compute(user_id, self._fetch_role, user_id, tenant, role_cache.max_size > 0)
+
+    def _fetch_role(self, user_id, tenant=None, primary=False):
+        """Fetches the role of a user from the database, from the primary if ``primary`` is set."""
+        return self._read(functools.partial(self._select_role, user_id), tenant, primary)
+
+    @staticmethod
+    def _select_role(user_id, connection):
         cursor = connection.cursor()
         try:
-            query = sql.SQL("INSERT INTO {table} (user_id, role) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET role = %s").format(
-                table=sql.Identifier(ROLE_TABLE_NAME))
-            cursor.execute(query, (target_user_id, role, role))
-            connection.commit()
-            _logger.info(f"Role '{role}' assigned to user {target_user_id} by admin {admin_user_id}")
+            SELECT_ROLE.execute(cursor, (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
         except Exception as e:
-            connection.rollback()
-            _logger.error(f"Failed to assign role: {e}")
+            _logger.error("Failed to get role: %s", e)
             raise e
         finally:
             cursor.close()
-            connection.close()
 
-    def get_role(self, user_id):
-        """Fetches the role of a user."""
-        connection = self.admin_connection()
+    def _read(self, read, tenant=None, primary=False):
+        """
+        Runs ``read(connection)`` on a read replica, or on the primary if ``primary`` is set, no replica is
+        configured, none is healthy, or the manager wrote within the last ``db_read_your_writes_window`` seconds.
+        A replica failing to connect or to run the read is taken out of rotation and the next one is tried.
+        Tenants have no replicas, their reads run on their own pool.
+        """
+        if tenant is not None:
+            with self._connection(tenant) as connection:
+                return read(connection)
+        if (self.replicas is not None and not primary
+                and time.monotonic() - self.last_write >= parser.arguments.configuration['db_read_your_writes_window']):
+            for pool in self.replicas.candidates():
+                try:
+                    with pool.connection() as connection:
+                        return read(connection)
+                except DatabasePoolTimeoutError:
+                    continue  # Busy, not broken
+                except (DatabaseSessionError, psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    _logger.warning("Read replica unavailable, trying the next one: %s", e)
+                    self.replicas.mark_unhealthy(pool)
+        with self.pool.connection() as connection:
+            return read(connection)
+
+    def get_roles(self, user_ids, tenant=None):
+        """
+        Fetches the roles of many users, querying the database once for those missing from the role cache.
+        Returns:
+            dict: The role of each user, None for users without a role.
+        """
+        tenant = self._tenant_name(tenant)
+        role_cache = self._role_cache(tenant)
+        roles = {}
+        missing = {}
+        for user_id in user_ids:
+            role = role_cache.get(user_id)
+            if role is MISSING:
+                missing[RoleCache.key(user_id)] = user_id
+            else:
+                roles[user_id] = role
+        if not missing:
+            return roles
+
+        generation = role_cache.generation
+        # Cached roles come from the primary, see ``get_role``
+        fetched = self._read(functools.partial(self._select_roles, list(missing.values())), tenant, role_cache.max_size > 0)
+        for key, user_id in missing.items():
+            roles[user_id] = fetched.get(key)
+            role_cache.set(user_id, roles[user_id], generation)
+        return roles
+
+    @staticmethod
+    def _select_roles(user_ids, connection):
         cursor = connection.cursor()
         try:
-            query = sql.SQL("SELECT role FROM {table} WHERE user_id = %s").format(
-                table=sql.Identifier(ROLE_TABLE_NAME))
-            cursor.execute(query, (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            SELECT_ROLES.execute(cursor, (user_ids,))
+            return {RoleCache.key(user_id): role for user_id, role in cursor}
         except Exception as e:
-            _logger.error(f"Failed to get role: {e}")
+            _logger.error("Failed to get roles: %s", e)
             raise e
         finally:
             cursor.close()
-            connection.close()
 
-    def is_admin(self, user_id):
-        """Checks if a user has an admin role."""
-        return self.get_role(user_id) == "admin"
+    def is_admin(self, user_id, tenant=None):
+        """Checks if a user has an admin role, authorization never relies on a read replica."""
+        tenant = self._tenant_name(tenant)
+        if self._role_cache(tenant).max_size > 0:
+            return self.get_role(user_id, tenant) == "admin"
+        return self._fetch_role(user_id, tenant, primary=True) == "admin"
+
+    @staticmethod
+    def _session_key(user_id, tenant):
+        return user_id if tenant is None else (tenant, user_id)
 
-    def create_connection(self, user_id):
-        """Creates a new PostgreSQL connection if the user is an admin."""
-        if not self.is_admin(user_id):
+    def create_connection(self, user_id, tenant=None):
+        """Borrows a pooled PostgreSQL connection for the user if the user is an admin, of ``tenant`` if given."""
+        tenant = self._tenant_name(tenant)
+        if not self.is_admin(user_id, tenant):
             raise DatabaseAccessError("Only admins can create connections.")
 
-        if user_id not in self.connections:
-            self.connections[user_id] = self.admin_connection()
-            _logger.info(f"Connection created for admin user {user_id}")
+        key = self._session_key(user_id, tenant)
+        if key not in self.connections:
+            self.connections[key] = self.pool.acquire() if tenant is None else self.tenants.acquire(tenant)[1]
+            _logger.info("Connection created for admin user %s", user_id)
         else:
-            _logger.info(f"Connection for user {user_id} already exists")
-
-    def close_connection(self, user_id):
-        """Closes a user's connection."""
-        if user_id in self.connections:
-            self.connections[user_id].close()
-            del self.connections[user_id]
-            _logger.info(f"Connection closed for user {user_id}")
+            _logger.info("Connection for user %s already exists", user_id)
+
+    def close_connection(self, user_id, tenant=None):
+        """Returns a user's connection to the pool."""
+        tenant = self._tenant_name(tenant)
+        key = self._session_key(user_id, tenant)
+        if key in self.connections:
+            # A tenant pool with a borrowed connection is never evicted, the lookup finds it
+            pool = self.pool if tenant is None else self.tenants.get(tenant).pool
+            pool.release(self.connections.pop(key))
+            _logger.info("Connection closed for user %s", user_id)
         else:
-            _logger.info(f"No connection found for user {user_id}")
+            _logger.info("No connection found for user %s", user_id)
+
+    def close(self):
+        """Stops the role change listener, returns every user connection and closes the pools."""
+        if self.role_listener is not None:
+            self.role_listener.stop()
+        for key in list(self.connections):
+            if isinstance(key, tuple):
+                self.close_connection(key[1], key[0])
+            else:
+                self.close_connection(key)
+        self.pool.close()
+        self.tenants.close()
+        if self.replicas is not None:
+            self.replicas.close()
 
     @contextmanager
-    def transaction(self, user_id):
-        """Executes a transaction block if the user has a connection."""
-        if user_id not in self.connections:
+    def transaction(self, user_id, stream=False, batch_size=None, tenant=None, records=False):
+        """
+        Executes a transaction block on the pooled primary connection borrowed by the user.
+        Args:
+            user_id: The user owning the connection.
+            stream (bool): Yield a named server-side cursor, iterating it fetches rows lazily in batches
+                so memory stays flat whatever the size of the result. Such a cursor runs a single query.
+            batch_size (int): Rows fetched per round trip when streaming, defaults to ``db_stream_batch_size``.
+            tenant (str): Database of the tenant the connection was created for, ``db_name`` by default.
+            records (bool): Yield a cursor returning rows as slotted records rather than tuples, see ``RecordCursor``.
+                ``master.core.rows.fetch_columns`` reads any cursor column by column instead.
+        """
+        tenant = self._tenant_name(tenant)
+        key = self._session_key(user_id, tenant)
+        if key not in self.connections:
             raise DatabaseSessionError(f"No connection found for user {user_id}")
 
-        connection = self.connections[user_id]
-        cursor = connection.cursor()
+        connection = self.connections[key]
+        cursor_factory = None
+        if records:
+            cursor_factory = InstrumentedRecordCursor if isinstance(connection.cursor_factory, type) and issubclass(
+                connection.cursor_factory, InstrumentedCursor) else RecordCursor
+        if stream:
+            cursor = connection.cursor(name=f"master_stream_{uuid.uuid4().hex}", cursor_factory=cursor_factory)
+            cursor.itersize = batch_size or parser.arguments.configuration['db_stream_batch_size']
+        else:
+            cursor = connection.cursor(cursor_factory=cursor_factory)
 
+        started = time.monotonic()
         try:
             yield cursor
+            # A server-side cursor must be closed while its transaction is still open
+            cursor.close()
             connection.commit()
+            if tenant is None:
+                self.last_write = time.monotonic()
         except Exception as e:
             connection.rollback()
-            _logger.error(f"Transaction for user {user_id} failed: {e}")
+            _logger.error("Transaction for user %s failed: %s", user_id, e)
             raise e
+        except BaseException:
+            # Streaming generator closed early or interrupted, nothing to report but nothing to commit either
+            connection.rollback()
+            raise
         finally:
-            cursor.close()
+            # The rollback already dropped a server-side cursor, closing it again would raise
+            if not stream:
+                cursor.close()
+            metrics.histogram('db_transaction').observe(time.monotonic() - started)
+
+    def stream_query(self, user_id, query, params=None, batch_size=None, tenant=None, records=False):
+        """
+        Runs a query in its own streaming transaction and yields its rows one by one.
+        Rows are fetched from a server-side cursor ``batch_size`` at a time, the transaction
+        is committed once the rows are exhausted and rolled back if the generator is closed early.
+        """
+        with self.transaction(user_id, stream=True, batch_size=batch_size, tenant=tenant, records=records) as cursor:
+            cursor.execute(query, params)
+            yield from cursor
+
+
+metrics.register_gauge('db_pool_connections', lambda: sum(pool.size for pool in list(_pools)))
+metrics.register_gauge('db_pool_idle_connections', lambda: sum(pool.idle for pool in list(_pools)))
+metrics.register_gauge('db_pool_borrowed_connections', lambda: sum(pool.in_use for pool in list(_pools)))
+# The async managers have no tenant pools
+metrics.register_gauge('db_tenant_pools', lambda: sum(
+    len(manager.tenants) for manager in list(_managers) if isinstance(manager, PostgresManager)))
+metrics.register_gauge('db_tenant_pool_evictions', lambda: sum(
+    manager.tenants.evictions for manager in list(_managers) if isinstance(manager, PostgresManager)))
+metrics.register_gauge('db_user_connections', lambda: sum(len(manager.connections) for manager in list(_managers)))
@@ -0,0 +1,240 @@
+from bisect import bisect_left
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+import re
+import threading
+from master.config.logging import get_logger
+
+_logger = get_logger(__name__)
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    """
+    Thread-safe latency histogram with fixed buckets, cheap enough to be updated on every statement.
+    Attributes:
+        count (int): Number of observations.
+        total (float): Sum of the observations.
+        maximum (float): Largest observation.
+        buckets (List[int]): Observations per bucket of ``BUCKETS``, not cumulative.
+    """
+    __slots__ = ('count', 'total', 'maximum', 'buckets', '_lock')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(BUCKETS, value)
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.buckets[index] += 1
+            if value > self.maximum:
+                self.maximum = value
+
+    def quantile(self, quantile: float) -> float:
+        """Returns an upper bound of the given quantile, the bound of the bucket it falls in."""
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound, self.maximum)
+        return 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.maximum,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+                'buckets': list(self.buckets),
+            }
+
+
+class StatementStats:
+    """Latency histogram, row count and error count of one normalized SQL statement."""
+    __slots__ = ('duration', 'rows', 'errors')
+
+    def __init__(self):
+        self.duration = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = self.duration.snapshot()
+        snapshot.update(rows=self.rows, errors=self.errors)
+        return snapshot
+
+
+statements: Dict[str, StatementStats] = {}  # Normalized SQL -> statistics
+histograms: Dict[str, Histogram] = {}  # Other latencies, such as pool checkouts and transaction blocks
+gauges: Dict[str, Callable[[], float]] = {}  # Values computed when a snapshot is taken
+_lock = threading.Lock()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|%s|%\(\w+\)s|\b\d+(?:\.\d+)?\b")
+_ARRAYS = re.compile(r"ARRAY\[[^\]]*\]")
+_TUPLE = r"\(\s*\?(?:\s*,\s*\?)*\s*\)"
+_TUPLES = re.compile(rf"{_TUPLE}(?:\s*,\s*{_TUPLE})*")  # Value lists and multi-row VALUES
+_NAMES = re.compile(r"master_(stream|prepared)_[0-9a-f]+")  # Generated cursor and prepared statement names
+_SPACES = re.compile(r"\s+")
+CACHED_QUERY_LENGTH = 2048  # Longer statements, such as pages of inlined rows, are normalized without caching
+
+
+def normalize(query: str) -> str:
+    """Returns a statement with literals and placeholders replaced by ``?``, so executions group by shape."""
+    if len(query) <= CACHED_QUERY_LENGTH:
+        return _normalize(query)
+    return _normalize.__wrapped__(query)
+
+
+@lru_cache(maxsize=4096)
+def _normalize(query: str) -> str:
+    query = _NAMES.sub(r'master_\1_?', query)
+    query = _LITERALS.sub('?', query)
+    query = _ARRAYS.sub('?', query)
+    query = _TUPLES.sub('(?)', query)
+    return _SPACES.sub(' ', query).strip()
+
+
+def _statement(query: str) -> StatementStats:
+    stats = statements.get(query)
+    if stats is None:
+        with _lock:
+            stats = statements.setdefault(query, StatementStats())
+    return stats
+
+
+def record_statement(query: str, duration: float, rows: int = 0, error: bool = False) -> None:
+    """
+    Records an executed statement.
+    Args:
+        query (str): The SQL, normalized by this function.
+        duration (float): Execution time in seconds.
+        rows (int): Rows returned or affected, negative values are ignored.
+        error (bool): Whether the statement failed.
+    """
+    normalized = normalize(query)
+    stats = _statement(normalized)
+    stats.duration.observe(duration)
+    if rows > 0:
+        stats.rows += rows
+    if error:
+        stats.errors += 1
+
+
+def histogram(name: str) -> Histogram:
+    """Returns the histogram of the given name, creating it on first use."""
+    found = histograms.get(name)
+    if found is None:
+        with _lock:
+            found = histograms.setdefault(name, Histogram())
+    return found
+
+
+def register_gauge(name: str, compute: Callable[[], float]) -> None:
+    """Registers a value computed on each snapshot, replacing any gauge of the same name."""
+    gauges[name] = compute
+
+
+def snapshot() -> Dict[str, Any]:
+    """Returns the current statement statistics, latency histograms and gauge values, latencies in seconds."""
+    values = {}
+    for name, compute in list(gauges.items()):
+        try:
+            values[name] = compute()
+        except Exception as e:
+            _logger.warning("Failed to compute gauge %s: %s", name, e)
+    return {
+        'statements': {query: stats.snapshot() for query, stats in list(statements.items())},
+        'histograms': {name: found.snapshot() for name, found in list(histograms.items())},
+        'gauges': values,
+    }
+
+
+def reset() -> None:
+    """Forgets every statement statistic and histogram, gauges stay registered."""
+    with _lock:
+        statements.clear()
+        histograms.clear()
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(lines: List[str], metric: str, labels: str, data: Dict[str, Any]) -> None:
+    cumulative = 0
+    for bound, count in zip(BUCKETS, data['buckets']):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{metric}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{metric}_sum{suffix} {data["total"]}')
+    lines.append(f'{metric}_count{suffix} {data["count"]}')
+
+
+def prometheus_text() -> str:
+    """Renders the snapshot in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = ['# TYPE master_db_statement_duration_seconds histogram']
+    for query, stats in data['statements'].items():
+        _histogram_lines(lines, 'master_db_statement_duration_seconds', f'query="{_label(query)}"', stats)
+    lines.append('# TYPE master_db_statement_rows_total counter')
+    for query, stats in data['statements'].items():
+        lines.append(f'master_db_statement_rows_total{{query="{_label(query)}"}} {stats["rows"]}')
+    lines.append('# TYPE master_db_statement_errors_total counter')
+    for query, stats in data['statements'].items():
+        lines.append(f'master_db_statement_errors_total{{query="{_label(query)}"}} {stats["errors"]}')
+    for name, found in data['histograms'].items():
+        metric = f'master_{name}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        _histogram_lines(lines, metric, '', found)
+    for name, value in data['gauges'].items():
+        lines.append(f'# TYPE master_{name} gauge')
+        lines.append(f'master_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+def start_metrics_server(port: int, hostname: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serves ``prometheus_text`` on ``/metrics`` from a background thread.
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        hostname (str): Address to bind, local only by default.
+    Returns:
+        ThreadingHTTPServer: The running server, ``shutdown()`` stops it.
+    """
+    server = ThreadingHTTPServer((hostname, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    _logger.info("Metrics served on http://%s:%s/metrics", hostname, server.server_address[1])
+    return server
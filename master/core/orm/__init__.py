@@ -0,0 +1,10 @@
+import importlib
+
+_submodules = ('model', 'fields', 'session')
+
+
+def __getattr__(name: str):
+    # Submodules are imported on first access, declaring models does not pull psycopg2 in
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,135 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, List, Optional, Type, Union
+from psycopg2 import sql
+from master.core.api import classes
+from master.core.orm.model import Model
+
+
+def resolve(model: Union[str, Type[Model]]) -> Type[Model]:
+    """Returns the model class of a table name, the last registered class of the table wins."""
+    if isinstance(model, str):
+        registered = classes.get(f'core.orm.{model}')
+        if not registered:
+            raise LookupError(f'No model registered for table "{model}"')
+        return registered[-1]
+    return model
+
+
+class Relation(ABC):
+    """
+    Base class of relation descriptors, declared as class attributes next to ``__slots__``.
+    Related records are loaded lazily on first access, through the session of the record, or for a whole
+    result set at once with ``Session.prefetch``.
+    """
+    __slots__ = ('model', 'name', 'owner')
+
+    def __init__(self, model: Union[str, Type[Model]]):
+        """
+        Args:
+            model (Union[str, Type[Model]]): The related model, or its table name.
+        """
+        self.model = model
+        self.name: Optional[str] = None
+        self.owner: Optional[Type[Model]] = None
+
+    def __set_name__(self, owner: Type[Model], name: str) -> None:
+        self.owner = owner
+        self.name = name
+
+    @property
+    def target(self) -> Type[Model]:
+        return resolve(self.model)
+
+    @staticmethod
+    def _session(record: Model) -> Any:
+        if record._session is None:
+            raise ValueError(f'{record!r} is not attached to a session, its relations cannot be loaded')
+        return record._session
+
+    @abstractmethod
+    def prefetch(self, session: Any, records: List[Model]) -> List[Model]:
+        """Loads the relation of every record in one query and returns the related records."""
+
+
+class Many2one(Relation):
+    """
+    Record referenced by a foreign key column of the model.
+    Example:
+        class Partner(Model):
+            __table__ = 'res_partner'
+            __slots__ = ('id', 'name', 'parent_id')
+            parent = Many2one('res_partner', 'parent_id')
+    """
+    __slots__ = ('field',)
+
+    def __init__(self, model: Union[str, Type[Model]], field: str):
+        """
+        Args:
+            model (Union[str, Type[Model]]): The related model, or its table name.
+            field (str): The foreign key column holding the primary key of the related record.
+        """
+        super().__init__(model)
+        self.field = field
+
+    def __get__(self, record: Optional[Model], owner: Type[Model]) -> Any:
+        if record is None:
+            return self
+        pk = getattr(record, self.field)
+        if pk is None:
+            return None
+        target = self.target
+        related = record._session.identity_map.get((target, pk)) if record._session is not None else None
+        if related is not None:
+            return related
+        session = self._session(record)
+        session.record_lazy_load(owner, self.name)
+        return session.get(target, pk)
+
+    def __set__(self, record: Model, value: Optional[Model]) -> None:
+        setattr(record, self.field, None if value is None else value.pk)
+
+    def prefetch(self, session: Any, records: List[Model]) -> List[Model]:
+        pks = [getattr(record, self.field) for record in records]
+        return session.browse(self.target, [pk for pk in pks if pk is not None])
+
+
+class One2many(Relation):
+    """
+    Records of another model whose foreign key column references the record.
+    Example:
+        class Partner(Model):
+            __table__ = 'res_partner'
+            __slots__ = ('id', 'name', 'parent_id')
+            children = One2many('res_partner', 'parent_id')
+    """
+    __slots__ = ('inverse',)
+
+    def __init__(self, model: Union[str, Type[Model]], inverse: str):
+        """
+        Args:
+            model (Union[str, Type[Model]]): The related model, or its table name.
+            inverse (str): The foreign key column of the related model referencing this model.
+        """
+        super().__init__(model)
+        self.inverse = inverse
+
+    def __get__(self, record: Optional[Model], owner: Type[Model]) -> Any:
+        if record is None:
+            return self
+        session = self._session(record)
+        key = (self.owner, record.pk, self.name)
+        if key not in session.relations:
+            session.record_lazy_load(owner, self.name)
+            self.prefetch(session, [record])
+        return session.relations[key]
+
+    def prefetch(self, session: Any, records: List[Model]) -> List[Model]:
+        pks = list(OrderedDict.fromkeys(record.pk for record in records if record.pk is not None))
+        related = session.search(self.target, sql.SQL("{inverse} = ANY(%s)").format(inverse=sql.Identifier(self.inverse)), (pks,))
+        grouped = {pk: [] for pk in pks}
+        for child in related:
+            grouped.setdefault(getattr(child, self.inverse), []).append(child)
+        for pk in pks:
+            session.relations[(self.owner, pk, self.name)] = grouped[pk]
+        return related
@@ -0,0 +1,95 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+from master.core.api import Meta
+
+
+class Model(metaclass=Meta):
+    """
+    Base class of ORM records, one subclass per table.
+    Subclasses declare their columns as ``__slots__`` and are registered in the ``Meta`` classes registry
+    under ``core.orm.<table>``. Assigning a column marks it dirty so a flush only writes what changed.
+    The primary key of a stored record is read-only.
+    Example:
+        class Partner(Model):
+            __table__ = 'res_partner'
+            __slots__ = ('id', 'name', 'email')
+    Attributes:
+        __table__ (str): Name of the table the records are stored in.
+        __primary_key__ (str): Name of the primary key column, ``id`` by default.
+        __fields__ (Tuple[str, ...]): Column names, derived from the ``__slots__`` of the class and its bases.
+    """
+    __meta_path__ = 'core.orm.model'
+    __slots__ = ('_session', '_dirty', '_stored')
+    __table__: str = ''
+    __primary_key__: str = 'id'
+    __fields__: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__table__:
+            raise TypeError(f'Model "{cls.__name__}" must define "__table__"')
+        fields = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get('__slots__', ())
+            for name in ([slots] if isinstance(slots, str) else slots):
+                if not name.startswith('_') and name not in fields:
+                    fields.append(name)
+        if cls.__primary_key__ not in fields:
+            raise TypeError(f'Model "{cls.__name__}" must declare its primary key "{cls.__primary_key__}" in "__slots__"')
+        cls.__fields__ = tuple(fields)
+        if '__meta_path__' not in cls.__dict__:
+            cls.__meta_path__ = f'core.orm.{cls.__table__}'
+        Meta.attach_subclass(cls)
+
+    def __init__(self, **values):
+        """Initializes a new record from column or relation values, columns not given are left to their database default."""
+        object.__setattr__(self, '_session', None)
+        object.__setattr__(self, '_stored', False)
+        object.__setattr__(self, '_dirty', set())
+        for name in self.__fields__:
+            object.__setattr__(self, name, None)
+        for name, value in values.items():
+            # Columns, or settable descriptors such as many2one relations
+            if name not in self.__fields__ and (name.startswith('_') or not hasattr(getattr(type(self), name, None), '__set__')):
+                raise AttributeError(f'"{self.__class__.__name__}" has no field "{name}"')
+            setattr(self, name, value)
+
+    @classmethod
+    def _load(cls, session: Any, row: Sequence[Any]) -> 'Model':
+        """Builds a clean, stored record from a row holding every field in ``__fields__`` order."""
+        record = cls.__new__(cls)
+        object.__setattr__(record, '_session', session)
+        object.__setattr__(record, '_stored', True)
+        object.__setattr__(record, '_dirty', set())
+        for name, value in zip(cls.__fields__, row):
+            object.__setattr__(record, name, value)
+        return record
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == self.__primary_key__ and self._stored:
+            # Updates find their row by primary key, a new one would silently write another row
+            raise AttributeError(f'Primary key "{name}" of stored {self!r} is read-only')
+        object.__setattr__(self, name, value)
+        if name in self.__fields__:
+            self._dirty.add(name)
+
+    @property
+    def pk(self) -> Any:
+        """Returns the primary key value of the record."""
+        return getattr(self, self.__primary_key__)
+
+    @property
+    def session(self) -> Optional[Any]:
+        """Returns the session the record is attached to."""
+        return self._session
+
+    @property
+    def is_dirty(self) -> bool:
+        """Checks if the record has columns to write on the next flush."""
+        return bool(self._dirty)
+
+    def values(self, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Returns the values of the given fields, or of every field, by column name."""
+        return {name: getattr(self, name) for name in (fields or self.__fields__)}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.__primary_key__}={self.pk!r})"
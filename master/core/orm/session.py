@@ -0,0 +1,297 @@
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type
+import json
+from psycopg2 import sql
+from master.config.logging import get_logger
+from master.config import parser
+from master.core.orm.model import Model
+from master.core.orm.fields import Relation
+
+_logger = get_logger(__name__)
+
+
+class Session:
+    """
+    Unit of work bound to the cursor of one transaction.
+    Records read through the session are kept in an identity map, so a row is only materialized once per
+    transaction and every read of it returns the same object. Changes are written by ``flush``, which issues
+    one multi-row statement per table and set of written columns instead of one statement per record.
+    Attributes:
+        cursor: The cursor of the transaction.
+        identity_map (Dict[Tuple[Type[Model], Any], Model]): Stored records by model and primary key.
+        relations (Dict[Tuple[Type[Model], Any, str], List[Model]]): Loaded one2many relations by model,
+            primary key and relation name.
+        statements (int): Number of statements executed by the session.
+        debug (bool): Log relations lazily loaded record by record, the signature of N+1 queries.
+    """
+    __slots__ = ('cursor', 'identity_map', 'relations', 'statements', 'debug', '_new', '_deleted', '_lazy_loads')
+    N_PLUS_ONE_THRESHOLD = 3  # Lazy loads of the same relation in a session reported as an N+1 pattern
+
+    def __init__(self, cursor: Any, debug: Optional[bool] = None):
+        """
+        Args:
+            cursor: The cursor of the transaction.
+            debug (bool): Detect N+1 patterns, defaults to the ``orm_debug`` configuration.
+        """
+        self.cursor = cursor
+        self.identity_map: Dict[Tuple[Type[Model], Any], Model] = {}
+        self.relations: Dict[Tuple[Type[Model], Any, str], List[Model]] = {}
+        self.statements = 0
+        self.debug = parser.arguments.configuration['orm_debug'] if debug is None else debug
+        self._new: List[Model] = []
+        self._deleted: List[Model] = []
+        self._lazy_loads: Counter = Counter()
+
+    def add(self, record: Model) -> Model:
+        """Attaches a new record to the session, it is inserted on the next flush."""
+        if record._session is not None and record._session is not self:
+            raise ValueError(f'{record!r} is attached to another session')
+        if record._stored or any(record is new for new in self._new):
+            return record
+        object.__setattr__(record, '_session', self)
+        self._new.append(record)
+        return record
+
+    def delete(self, record: Model) -> None:
+        """Marks a record for deletion on the next flush, a record not inserted yet is simply dropped."""
+        if not record._stored:
+            self._new = [new for new in self._new if new is not record]
+            return
+        self._deleted.append(record)
+
+    def get(self, model: Type[Model], pk: Any) -> Optional[Model]:
+        """Returns the record with the given primary key, from the identity map when already loaded."""
+        record = self.identity_map.get((model, pk))
+        if record is not None:
+            return record
+        records = self.browse(model, [pk])
+        return records[0] if records else None
+
+    def browse(self, model: Type[Model], pks: Iterable[Any]) -> List[Model]:
+        """Returns the records with the given primary keys, loading those not in the identity map in one query."""
+        pks = list(OrderedDict.fromkeys(pks))
+        missing = [pk for pk in pks if (model, pk) not in self.identity_map]
+        if missing:
+            self.search(model, sql.SQL("{pk} = ANY(%s)").format(pk=sql.Identifier(model.__primary_key__)), (missing,))
+        return [self.identity_map[(model, pk)] for pk in pks if (model, pk) in self.identity_map]
+
+    def search(self, model: Type[Model], where: Any = None, params: Any = None,
+               order: Any = None, limit: Optional[int] = None, prefetch: Sequence[str] = ()) -> List[Model]:
+        """
+        Returns the records of a model matching a condition, pending changes are flushed first.
+        Records already in the identity map are returned as they are in memory, not refreshed.
+        Args:
+            model (Type[Model]): The model to search.
+            where (Union[str, sql.Composable]): SQL condition, with ``%s`` placeholders for ``params``.
+            params: Parameters of the condition.
+            order (Union[str, sql.Composable]): SQL ORDER BY clause content.
+            limit (int): Maximum number of records.
+            prefetch (Sequence[str]): Relations to load for the whole result, see ``prefetch``.
+        """
+        self.flush()
+        query = [sql.SQL("SELECT {fields} FROM {table}").format(
+            fields=sql.SQL(', ').join(map(sql.Identifier, model.__fields__)),
+            table=sql.Identifier(model.__table__))]
+        if where is not None:
+            query.append(sql.SQL("WHERE ") + _composable(where))
+        if order is not None:
+            query.append(sql.SQL("ORDER BY ") + _composable(order))
+        if limit is not None:
+            query.append(sql.SQL("LIMIT {limit}").format(limit=sql.Literal(limit)))
+        self._execute(sql.SQL(' ').join(query), params)
+        records = [self._identify(model, row) for row in self.cursor.fetchall()]
+        if prefetch:
+            self.prefetch(records, *prefetch)
+        return records
+
+    def prefetch(self, records: List[Model], *paths: str) -> None:
+        """
+        Loads relations for a whole list of records with one ``ANY`` query per relation,
+        instead of one query per record when they are accessed lazily.
+        Args:
+            records (List[Model]): Records of the same model.
+            paths (str): Relation names, dotted paths such as ``children.parent`` load nested relations.
+        """
+        for path in paths:
+            current = records
+            for name in path.split('.'):
+                if not current:
+                    break
+                relation = getattr(type(current[0]), name, None)
+                if not isinstance(relation, Relation):
+                    raise AttributeError(f'"{type(current[0]).__name__}" has no relation "{name}"')
+                current = relation.prefetch(self, current)
+
+    def record_lazy_load(self, model: Type[Model], relation: str) -> None:
+        """Counts a relation loaded for a single record and reports N+1 patterns in debug mode."""
+        if not self.debug:
+            return
+        key = (model, relation)
+        self._lazy_loads[key] += 1
+        if self._lazy_loads[key] == self.N_PLUS_ONE_THRESHOLD:
+            _logger.warning("Possible N+1 queries: relation '%s' of %s loaded record by record "
+                            "%s times in this session, prefetch it for the whole result instead",
+                            relation, model.__name__, self.N_PLUS_ONE_THRESHOLD)
+
+    def flush(self) -> None:
+        """
+        Writes pending changes: one INSERT per table and set of assigned columns, preceded by a query reserving
+        their primary keys when they were not assigned, one UPDATE per table and set of dirty columns, and one
+        DELETE per table. Tables are written in the order their records were first
+        added or changed, deletions come last in reverse order.
+        """
+        inserts: Dict[Tuple[Type[Model], Tuple[str, ...]], List[Model]] = OrderedDict()
+        for record in self._new:
+            inserts.setdefault((type(record), _ordered(record, record._dirty)), []).append(record)
+        updates: Dict[Tuple[Type[Model], Tuple[str, ...]], List[Model]] = OrderedDict()
+        for record in self.identity_map.values():
+            if record._dirty:
+                fields = _ordered(record, record._dirty)
+                if fields:
+                    updates.setdefault((type(record), fields), []).append(record)
+                else:
+                    record._dirty.clear()
+        deletes: Dict[Type[Model], List[Model]] = OrderedDict()
+        for record in reversed(self._deleted):
+            deletes.setdefault(type(record), []).append(record)
+
+        if inserts or updates or deletes:
+            self.relations.clear()
+        for (model, fields), records in inserts.items():
+            self._insert(model, fields, records)
+        self._new = []
+        for (model, fields), records in updates.items():
+            self._update(model, fields, records)
+        for model, records in deletes.items():
+            self._delete(model, records)
+        self._deleted = []
+
+    def _insert(self, model: Type[Model], fields: Tuple[str, ...], records: List[Model]) -> None:
+        """
+        Inserts records sharing the same assigned columns and refreshes them with the stored values.
+        Postgres does not guarantee the order of the returned rows, so each record is sent with its primary key
+        and rows are matched on it. Keys not assigned are drawn from the sequence of the primary key first, the
+        records of a table whose primary key has no sequence are inserted one by one.
+        """
+        pk = model.__primary_key__
+        keys: Optional[List[Any]] = [record.pk for record in records] if pk in fields else None
+        overriding = sql.SQL('')
+        if keys is None and len(records) > 1:
+            keys = self._reserve_keys(model, len(records))
+            if not keys:
+                for record in records:
+                    self._insert(model, fields, [record])
+                return
+            for record, key in zip(records, keys):
+                object.__setattr__(record, pk, key)
+            fields = (pk,) + fields
+            # Identity columns generated always only accept the reserved keys with this clause
+            overriding = sql.SQL(' OVERRIDING SYSTEM VALUE')
+        table = sql.Identifier(model.__table__)
+        returning = sql.SQL(', ').join(map(sql.Identifier, model.__fields__))
+        if fields:
+            query = sql.SQL("INSERT INTO {table} ({columns}){overriding} SELECT {columns} "
+                            "FROM json_populate_recordset(NULL::{table}, %s) RETURNING {returning}").format(
+                table=table, columns=sql.SQL(', ').join(map(sql.Identifier, fields)), overriding=overriding,
+                returning=returning)
+            self._execute(query, (_json(records, fields),))
+        else:
+            self._execute(sql.SQL("INSERT INTO {table} DEFAULT VALUES RETURNING {returning}").format(
+                table=table, returning=returning))
+        rows = self.cursor.fetchall()
+        if keys is None:
+            matched = zip(records, rows)
+        else:
+            by_key = dict(zip(keys, records))
+            index = model.__fields__.index(pk)
+            matched = []
+            for row in rows:
+                record = by_key.pop(row[index], None)
+                if record is None:
+                    raise ValueError(f'Inserted {model.__name__} row with {pk} {row[index]!r} matches no record, '
+                                     f'assigned primary keys must have the type of their column')
+                matched.append((record, row))
+        for record, row in matched:
+            for name, value in zip(model.__fields__, row):
+                object.__setattr__(record, name, value)
+            object.__setattr__(record, '_stored', True)
+            record._dirty.clear()
+            self.identity_map[(model, record.pk)] = record
+
+    def _reserve_keys(self, model: Type[Model], count: int) -> List[Any]:
+        """Draws primary keys from the sequence of the primary key column, returns none if it has no sequence."""
+        self._execute("SELECT nextval(sequence) FROM (SELECT pg_get_serial_sequence(quote_ident(%s), %s) AS sequence) AS serial, "
+                      "generate_series(1, %s) WHERE sequence IS NOT NULL", (model.__table__, model.__primary_key__, count))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def _update(self, model: Type[Model], fields: Tuple[str, ...], records: List[Model]) -> None:
+        """Updates records sharing the same dirty columns in one statement."""
+        pk = sql.Identifier(model.__primary_key__)
+        query = sql.SQL("UPDATE {table} SET {assignments} FROM json_populate_recordset(NULL::{table}, %s) AS {values} "
+                        "WHERE {table}.{pk} = {values}.{pk}").format(
+            table=sql.Identifier(model.__table__),
+            assignments=sql.SQL(', ').join(
+                sql.SQL("{field} = {values}.{field}").format(field=sql.Identifier(field), values=sql.Identifier('_values'))
+                for field in fields),
+            values=sql.Identifier('_values'),
+            pk=pk)
+        self._execute(query, (_json(records, (model.__primary_key__,) + fields),))
+        for record in records:
+            record._dirty.clear()
+
+    def _delete(self, model: Type[Model], records: List[Model]) -> None:
+        """Deletes records of a model in one statement and forgets them."""
+        query = sql.SQL("DELETE FROM {table} WHERE {pk} = ANY(%s)").format(
+            table=sql.Identifier(model.__table__), pk=sql.Identifier(model.__primary_key__))
+        self._execute(query, ([record.pk for record in records],))
+        for record in records:
+            self.identity_map.pop((model, record.pk), None)
+            object.__setattr__(record, '_stored', False)
+            record._dirty.clear()
+
+    def _identify(self, model: Type[Model], row: Tuple[Any, ...]) -> Model:
+        """Returns the record of a row, reusing the instance of the identity map when there is one."""
+        key = (model, row[model.__fields__.index(model.__primary_key__)])
+        record = self.identity_map.get(key)
+        if record is None:
+            record = self.identity_map[key] = model._load(self, row)
+        return record
+
+    def _execute(self, query: Any, params: Any = None) -> None:
+        self.statements += 1
+        self.cursor.execute(query, params)
+
+
+def _composable(value: Any) -> sql.Composable:
+    return value if isinstance(value, sql.Composable) else sql.SQL(value)
+
+
+def _ordered(record: Model, fields: Iterable[str]) -> Tuple[str, ...]:
+    """Returns the given fields in declaration order, leaving the primary key out of updates."""
+    fields = set(fields)
+    if record._stored:
+        fields.discard(record.__primary_key__)
+    return tuple(name for name in record.__fields__ if name in fields)
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # Hex input format of bytea, str() would store the text of the Python literal
+        return '\\x' + bytes(value).hex()
+    return str(value)
+
+
+def _json(records: List[Model], fields: Tuple[str, ...]) -> str:
+    """Serializes records for ``json_populate_recordset``, which casts each value to the type of its column."""
+    return json.dumps([record.values(fields) for record in records], default=_json_value)
+
+
+@contextmanager
+def session(manager: Any, user_id: Any) -> Iterator[Session]:
+    """Opens a session on a transaction of the user, pending changes are flushed before the commit."""
+    with manager.transaction(user_id) as cursor:
+        current = Session(cursor)
+        yield current
+        current.flush()
+        _logger.debug("Session of user %s ran %s statements", user_id, current.statements)
@@ -0,0 +1,151 @@
+from array import array
+from functools import lru_cache
+from keyword import iskeyword
+from operator import attrgetter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Type, Union
+import re
+
+# Array type codes of the PostgreSQL types stored in ``fetch_columns`` buffers, by type OID
+NUMERIC_TYPES: Dict[int, str] = {
+    16: 'b',   # bool
+    20: 'q',   # int8
+    21: 'h',   # int2
+    23: 'i',   # int4
+    26: 'I',   # oid
+    700: 'd',  # float4
+    701: 'd',  # float8
+}
+_NOT_IDENTIFIER = re.compile(r'\W')
+
+
+class Record:
+    """
+    Base class of the slotted row classes made by ``record_class``.
+    A record holds its values in slots named after the columns, so it takes a fraction of the memory of the
+    dict a row is usually copied into, and it is read like a named tuple: ``row.user_id``, ``row[0]``,
+    ``row['user_id']`` or ``tuple(row)``.
+    Attributes:
+        _fields (Tuple[str, ...]): Column names as returned by the query.
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _values = staticmethod(lambda record: ())  # Returns the values of a record as a tuple
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._values(self))
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __getitem__(self, key: Union[int, slice, str]) -> Any:
+        if isinstance(key, str):
+            try:
+                return self._values(self)[self._fields.index(key)]
+            except ValueError:
+                raise KeyError(key) from None
+        return self._values(self)[key]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Record):
+            return self._fields == other._fields and self._values(self) == other._values(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._values(self))
+
+    def __repr__(self) -> str:
+        return f"Record({', '.join(f'{field}={value!r}' for field, value in zip(self._fields, self._values(self)))})"
+
+    def __reduce__(self):
+        return _rebuild, (self._fields, self._values(self))
+
+    def _asdict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self._values(self)))
+
+
+def _rebuild(fields: Tuple[str, ...], values: Tuple[Any, ...]) -> Record:
+    return record_class(fields)(*values)
+
+
+def _unique(names: Iterable[str]) -> Tuple[str, ...]:
+    """Suffixes repeated names, the second ``id`` column of a join becomes ``id_2``."""
+    unique_names: List[str] = []
+    for name in names:
+        unique, suffix = name, 1
+        while unique in unique_names:
+            suffix += 1
+            unique = f'{name}_{suffix}'
+        unique_names.append(unique)
+    return tuple(unique_names)
+
+
+def _attribute_names(fields: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Returns a valid and unique attribute name per column, such as ``count`` for ``count(*)``."""
+    names = []
+    for field in fields:
+        name = _NOT_IDENTIFIER.sub('_', field).strip('_') or 'column'
+        if name[0].isdigit() or iskeyword(name) or hasattr(Record, name):
+            name = f'f_{name}'
+        names.append(name)
+    return _unique(names)
+
+
+@lru_cache(maxsize=256)
+def record_class(fields: Tuple[str, ...]) -> Type[Record]:
+    """
+    Returns the ``Record`` class of a column set, created once per distinct set of column names.
+    Args:
+        fields (Tuple[str, ...]): Column names, in order. Names that are not identifiers are sanitized for the
+            attributes, ``count(*)`` becomes ``count``, but stay reachable as they are through ``row[name]``.
+    """
+    names = _attribute_names(fields)
+    arguments = ', '.join(f'_{index}' for index in range(len(names)))
+    body = ''.join(f'\n    self.{name} = _{index}' for index, name in enumerate(names)) or '\n    pass'
+    namespace: Dict[str, Any] = {}
+    # A generated __init__ assigns the slots as fast as a tuple is unpacked
+    exec(f'def __init__(self, {arguments}):{body}', namespace)
+    if not names:
+        values = staticmethod(lambda record: ())
+    elif len(names) == 1:
+        getter = attrgetter(names[0])
+        values = staticmethod(lambda record: (getter(record),))
+    else:
+        values = staticmethod(attrgetter(*names))
+    return type('Record', (Record,), {'__slots__': names, '__init__': namespace['__init__'],
+                                      '_fields': fields, '_values': values})
+
+
+def fetch_columns(cursor: Any, batch_size: int = 0) -> Dict[str, Union[memoryview, List[Any]]]:
+    """
+    Fetches the remaining rows of a cursor column by column.
+    Integer, float and boolean columns are packed in ``array.array`` buffers and returned as ``memoryview``, 8 bytes
+    per value at most instead of a Python object each; such a column holding NULLs is returned as a list, as are
+    the columns of other types. Rows are fetched ``batch_size`` at a time, so a streaming cursor never holds more
+    than one batch of tuples.
+    Args:
+        cursor: An executed psycopg2 cursor.
+        batch_size (int): Rows per fetch, the ``itersize`` of the cursor by default.
+    Returns:
+        Dict[str, Union[memoryview, List[Any]]]: Values by column name, in column order, a repeated name is suffixed
+            as in ``_unique``.
+    """
+    batch_size = batch_size or cursor.itersize
+    # Named cursors only have a description once the first batch was fetched
+    rows = cursor.fetchmany(batch_size) if cursor.description is not None or cursor.name else []
+    if cursor.description is None:
+        return {}
+    columns: List[Any] = [array(NUMERIC_TYPES[column.type_code]) if column.type_code in NUMERIC_TYPES else []
+                          for column in cursor.description]
+    while rows:
+        for index, values in enumerate(zip(*rows)):
+            column = columns[index]
+            size = len(column)
+            try:
+                column.extend(values)
+            except (TypeError, OverflowError):
+                # A NULL, or a value out of the range of the type code, the values appended so far are kept
+                columns[index] = column = column[:size].tolist()
+                column.extend(values)
+        rows = cursor.fetchmany(batch_size)
+    return {name: memoryview(values) if isinstance(values, array) else values
+            for name, values in zip(_unique(column.name for column in cursor.description), columns)}
@@ -1,2 +1,5 @@
 from . import basic
+from . import addons
+from . import auth
 from . import db
+from . import http
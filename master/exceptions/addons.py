@@ -0,0 +1,17 @@
+from master.exceptions.basic import Error
+
+
+class AddonError(Error):
+    pass
+
+
+class AddonNotFoundError(AddonError):
+    pass
+
+
+class AddonDependencyError(AddonError):
+    pass
+
+
+class AddonSourceError(AddonError):
+    pass
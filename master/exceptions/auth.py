@@ -0,0 +1,6 @@
+from master.exceptions.basic import Error
+
+
+class AuthenticationError(Error):
+    """The identity of a caller could not be established."""
+    pass
@@ -11,3 +11,7 @@ class DatabaseSessionError(DatabaseError):
 
 class DatabaseAccessError(DatabaseError):
     pass
+
+
+class DatabasePoolTimeoutError(DatabaseSessionError):
+    pass
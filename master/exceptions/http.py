@@ -0,0 +1,19 @@
+from master.exceptions.basic import Error
+
+
+class HttpError(Error):
+    """Error answered to an HTTP client with the given status code."""
+
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class WebSocketError(Error):
+    """Protocol error closing a WebSocket connection with the given close code."""
+
+    def __init__(self, code: int, message: str = ''):
+        super().__init__(message)
+        self.code = code
+        self.message = message
@@ -0,0 +1,10 @@
+import importlib
+
+_submodules = ('auth', 'supervisor', 'http', 'websocket', 'pipeline', 'scheduler')
+
+
+def __getattr__(name: str):
+    # Services are imported on first access, each pulls the parts of the core it serves
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,65 @@
+from typing import Optional
+import argparse
+import hashlib
+import hmac
+import time
+from master.config import parser
+from master.exceptions.auth import AuthenticationError
+
+
+def _signature(payload: str, secret: str) -> str:
+    return hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_token(user_id: int, secret: str, ttl: float = 3600, now: Optional[float] = None) -> str:
+    """
+    Returns a token identifying a user for ``ttl`` seconds, ``<user id>.<expiry timestamp>.<signature>`` where the
+    signature is the HMAC-SHA256 of the first two parts with the secret. Services only trust the user id of a
+    token they verified with the ``auth_secret`` of the configuration, never an id sent by the client.
+    Tokens are issued by whoever holds the secret, ``python -m master.service.auth <user_id> [-c configuration.json]``
+    prints one.
+    Raises:
+        AuthenticationError: If no secret is given.
+    """
+    if not secret:
+        raise AuthenticationError('No "auth_secret" is configured')
+    payload = f'{int(user_id)}.{int((time.time() if now is None else now) + ttl)}'
+    return f'{payload}.{_signature(payload, secret)}'
+
+
+def verify_token(token: str, secret: str, now: Optional[float] = None) -> int:
+    """
+    Returns the user id of a token.
+    Raises:
+        AuthenticationError: If no secret is given, or the token is malformed, forged or expired.
+    """
+    if not secret:
+        raise AuthenticationError('No "auth_secret" is configured')
+    user_id, _, rest = token.partition('.')
+    expires, _, signature = rest.partition('.')
+    # isdigit() also accepts digits int() does not parse, such as superscripts
+    if not token.isascii() or not user_id.isdigit() or not expires.isdigit() or not signature:
+        raise AuthenticationError('Malformed token')
+    # Bytes, compare_digest raises TypeError on strings with non-ASCII characters
+    if not hmac.compare_digest(signature.encode(), _signature(f'{user_id}.{expires}', secret).encode()):
+        raise AuthenticationError('Invalid token signature')
+    if int(expires) <= (time.time() if now is None else now):
+        raise AuthenticationError('Token expired')
+    return int(user_id)
+
+
+def main():
+    arguments_parser = argparse.ArgumentParser(prog='python -m master.service.auth', description='Issues a token for a user')
+    arguments_parser.add_argument('user_id', type=int, help='Id of the user the token identifies')
+    arguments_parser.add_argument('--ttl', type=float, help='Seconds the token is valid, "auth_token_ttl" by default')
+    options, remaining = arguments_parser.parse_known_args()
+    # The remaining arguments, such as -c, are the ERP ones
+    configuration = parser.load(remaining).configuration
+    try:
+        print(issue_token(options.user_id, configuration['auth_secret'], options.ttl or configuration['auth_token_ttl']))
+    except AuthenticationError as e:
+        arguments_parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
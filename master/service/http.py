@@ -0,0 +1,347 @@
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple, Union
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+from master.config.logging import get_logger
+from master.config import parser
+from master.exceptions.auth import AuthenticationError
+from master.exceptions.db import DatabaseAccessError, DatabaseSessionError
+from master.exceptions.http import HttpError
+from master.core.api import Meta
+from master.core import async_db  # Registers AsyncPostgresManager
+from master.service import auth
+
+_logger = get_logger(__name__)
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+    501: 'Not Implemented', 503: 'Service Unavailable', 505: 'HTTP Version Not Supported',
+}
+MAX_HEADER_SIZE = 65536  # Bytes of request line and headers
+MAX_PIPELINED = 64  # Requests queued on a connection before it stops reading
+
+
+class Request:
+    """A parsed HTTP/1.x request, header names are lower-cased."""
+    __slots__ = ('method', 'path', 'query', 'version', 'headers', 'body')
+
+    def __init__(self, method: str, target: str, version: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path, _, self.query = target.partition('?')
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        """Whether the connection stays open after the response, the default from HTTP/1.1 on."""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise HttpError(400, 'Request body is not valid JSON')
+
+
+def parse_request(buffer: bytearray, max_body_size: int) -> Optional[Request]:
+    """
+    Removes the first complete request from a buffer and returns it.
+    Returns:
+        Request: The request, None if the buffer does not hold a complete one yet.
+    Raises:
+        HttpError: If the request is malformed or too large, the connection cannot be reused.
+    """
+    while buffer[:2] == b'\r\n':  # Tolerated between pipelined requests
+        del buffer[:2]
+    end = buffer.find(b'\r\n\r\n')
+    if end < 0:
+        if len(buffer) > MAX_HEADER_SIZE:
+            raise HttpError(431, 'Request headers too large')
+        return None
+    lines = bytes(buffer[:end]).decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+    if version not in ('HTTP/1.1', 'HTTP/1.0'):
+        raise HttpError(505, f'Unsupported version {version}')
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise HttpError(400, 'Malformed header')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HttpError(501, 'Transfer encodings are not supported, send a Content-Length')
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise HttpError(400, 'Invalid Content-Length')
+    length = int(length)
+    if length > max_body_size:
+        raise HttpError(413, f'Request body larger than {max_body_size} bytes')
+    total = end + 4 + length
+    if len(buffer) < total:
+        return None
+    body = bytes(buffer[end + 4:total])
+    del buffer[:total]
+    return Request(method, target, version, headers, body)
+
+
+def encode_response(status: int, payload: Any, keep_alive: bool = True, version: str = 'HTTP/1.1') -> bytes:
+    """Returns a complete response with a JSON body."""
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    if not keep_alive:
+        connection = 'Connection: close\r\n'
+    elif version == 'HTTP/1.0':
+        connection = 'Connection: keep-alive\r\n'
+    else:
+        connection = ''
+    head = (f'HTTP/1.1 {status} {REASONS.get(status, "Unknown")}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n{connection}\r\n')
+    return head.encode('latin-1') + body
+
+
+class HttpService(metaclass=Meta):
+    """
+    JSON API over the role management of ``AsyncPostgresManager``:
+        GET /roles/<user_id>          {"user_id": 2, "role": "user"}
+        GET /roles/<user_id>/admin    {"user_id": 2, "is_admin": false}
+        PUT /roles/<user_id>          {"role": "user"}, by the admin identified by an "Authorization: Bearer <token>"
+                                      header, see ``master.service.auth``; refused when no ``auth_secret`` is set
+        GET /health                   {"status": "ok"}
+    Addons extend it on the ``service.http`` meta path, ``ROUTES`` lists (method, path pattern, handler name)
+    and handlers are coroutines receiving the request and the named groups of the pattern.
+    """
+    __meta_path__ = 'service.http'
+    ROUTES: Tuple[Tuple[str, str, str], ...] = (
+        ('GET', r'/roles/(?P<user_id>\d+)', 'get_role'),
+        ('GET', r'/roles/(?P<user_id>\d+)/admin', 'is_admin'),
+        ('PUT', r'/roles/(?P<user_id>\d+)', 'create_role'),
+        ('GET', r'/health', 'health'),
+    )
+
+    def __init__(self, manager: Any, secret: str = ''):
+        """
+        Args:
+            manager: The ``AsyncPostgresManager`` serving the requests.
+            secret (str): Secret verifying the tokens of the callers, requests needing an identity are refused without it.
+        """
+        self.manager = manager
+        self.secret = secret
+        self.routes = [(method, re.compile(pattern), getattr(self, name)) for method, pattern, name in self.ROUTES]
+
+    async def handle(self, request: Request) -> Tuple[int, Any]:
+        """Returns the status and JSON payload answering a request."""
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            try:
+                return 200, await handler(request, **match.groupdict())
+            except HttpError as e:
+                return e.status, {'error': e.message}
+            except DatabaseAccessError as e:
+                return 403, {'error': str(e)}
+            except DatabaseSessionError as e:
+                return 503, {'error': str(e)}
+            except Exception as e:
+                _logger.exception("Failed to handle %s %s: %s", request.method, request.path, e)
+                return 500, {'error': 'Internal server error'}
+        if allowed:
+            return 405, {'error': f'Method {request.method} not allowed'}
+        return 404, {'error': f'No route for {request.path}'}
+
+    async def get_role(self, request: Request, user_id: str) -> Any:
+        return {'user_id': int(user_id), 'role': await self.manager.get_role(int(user_id))}
+
+    async def is_admin(self, request: Request, user_id: str) -> Any:
+        return {'user_id': int(user_id), 'is_admin': await self.manager.is_admin(int(user_id))}
+
+    def authenticate(self, request: Request) -> int:
+        """
+        Returns the id of the user calling, from the bearer token of the request.
+        Raises:
+            HttpError: 401 without a valid token, 403 if no secret is configured to verify one.
+        """
+        if not self.secret:
+            raise HttpError(403, 'Authenticated requests are disabled, no "auth_secret" is configured')
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            raise HttpError(401, 'Expected an "Authorization: Bearer <token>" header')
+        try:
+            return auth.verify_token(token.strip(), self.secret)
+        except AuthenticationError as e:
+            raise HttpError(401, str(e))
+
+    async def create_role(self, request: Request, user_id: str) -> Any:
+        admin_user_id = self.authenticate(request)
+        data = request.json()
+        if not isinstance(data, dict) or not isinstance(data.get('role'), str):
+            raise HttpError(400, 'Expected a JSON object with a "role" string')
+        await self.manager.create_role(admin_user_id, int(user_id), data['role'])
+        return {'user_id': int(user_id), 'role': data['role']}
+
+    async def health(self, request: Request) -> Any:
+        return {'status': 'ok'}
+
+
+class HttpProtocol(asyncio.Protocol):
+    """
+    HTTP/1.1 connection with keep-alive and pipelining: requests are parsed as soon as they arrive
+    and answered in order by a single task per connection, reading pauses while ``MAX_PIPELINED``
+    requests are waiting and while the client does not read its responses.
+    """
+
+    def __init__(self, service: HttpService, connections: Set['HttpProtocol'],
+                 keep_alive_timeout: float = 5.0, max_body_size: int = 1048576):
+        self.service = service
+        self.connections = connections
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_body_size = max_body_size
+        self.transport: Optional[asyncio.Transport] = None
+        self._buffer = bytearray()
+        self._pending: Deque[Union[Request, HttpError]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._paused = False
+        self._closing = False
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.connections.add(self)
+        self._reset_timer()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.connections.discard(self)
+        self._closing = True
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._task is not None:
+            self._task.cancel()
+        self._writable.set()
+
+    def data_received(self, data: bytes) -> None:
+        if self._closing:
+            return
+        self._buffer += data
+        try:
+            while True:
+                request = parse_request(self._buffer, self.max_body_size)
+                if request is None:
+                    break
+                self._pending.append(request)
+        except HttpError as e:
+            # Requests parsed before the malformed one are answered first
+            self._pending.append(e)
+        if self._pending:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._task is None:
+                self._task = asyncio.get_running_loop().create_task(self._respond())
+            if len(self._pending) >= MAX_PIPELINED and not self._paused:
+                self._paused = True
+                self.transport.pause_reading()
+
+    def pause_writing(self) -> None:
+        self._writable.clear()
+
+    def resume_writing(self) -> None:
+        self._writable.set()
+
+    async def _respond(self) -> None:
+        while self._pending and not self._closing:
+            request = self._pending.popleft()
+            if isinstance(request, HttpError):
+                self.transport.write(encode_response(request.status, {'error': request.message}, keep_alive=False))
+                self.close()
+                return
+            status, payload = await self.service.handle(request)
+            keep_alive = request.keep_alive
+            self.transport.write(encode_response(status, payload, keep_alive, request.version))
+            if not keep_alive:
+                self.close()
+                return
+            await self._writable.wait()
+            if self._paused and len(self._pending) < MAX_PIPELINED // 2:
+                self._paused = False
+                self.transport.resume_reading()
+        self._task = None
+        if not self._closing:
+            self._reset_timer()
+
+    def _reset_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.keep_alive_timeout:
+            self._timer = asyncio.get_running_loop().call_later(self.keep_alive_timeout, self.close)
+
+    def close(self) -> None:
+        """Closes the connection once the responses already written are sent."""
+        if not self._closing:
+            self._closing = True
+            self.transport.close()
+
+
+def create_socket(hostname: str, port: int, reuse_port: bool = False, backlog: int = 1024) -> socket.socket:
+    """Returns a listening, non-blocking socket; with ``reuse_port``, processes binding the same address share the connections."""
+    sock = socket.create_server((hostname, port), backlog=backlog, reuse_port=reuse_port)
+    sock.setblocking(False)
+    return sock
+
+
+async def serve(sock: socket.socket, configuration: Optional[dict] = None) -> None:
+    """Serves the HTTP API on a listening socket until SIGTERM or SIGINT."""
+    if configuration is None:
+        configuration = parser.arguments.configuration
+    loop = asyncio.get_running_loop()
+    manager = Meta.compose('core.db.async_manager')()
+    service = Meta.compose('service.http')(manager, configuration['auth_secret'])
+    connections: Set[HttpProtocol] = set()
+    stopped = asyncio.Event()
+    for number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(number, stopped.set)
+    server = await loop.create_server(
+        lambda: HttpProtocol(service, connections, configuration['http_keep_alive_timeout'], configuration['http_max_body_size']),
+        sock=sock)
+    _logger.info("HTTP API listening on %s:%s", *sock.getsockname()[:2])
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        for connection in list(connections):
+            connection.close()
+        await server.wait_closed()
+        await manager.close()
+
+
+def add_workers(supervisor: Any, configuration: dict) -> None:
+    """
+    Adds the ``http_workers`` processes serving the API to a ``Supervisor``, one per core if set to 0.
+    Each worker binds its own ``SO_REUSEPORT`` socket so the kernel spreads connections evenly between them;
+    without ``SO_REUSEPORT`` the workers accept from a single socket bound before forking.
+    """
+    workers = configuration['http_workers'] or os.cpu_count() or 1
+    address = (configuration['hostname'], configuration['port'])
+    reuse_port = workers > 1 and hasattr(socket, 'SO_REUSEPORT')
+    shared = None if reuse_port else create_socket(*address, backlog=configuration['http_backlog'])
+
+    def target():
+        sock = shared or create_socket(*address, reuse_port=True, backlog=configuration['http_backlog'])
+        asyncio.run(serve(sock, configuration))
+    supervisor.add('http', target, workers)
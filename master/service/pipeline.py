@@ -0,0 +1,296 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import signal
+import socket
+from master.config.logging import get_logger
+from master.config import parser
+from master.core.api import Meta
+from master.core import db  # Registers PostgresManager
+from master.exceptions.auth import AuthenticationError
+from master.service import auth
+from master.service.http import create_socket
+
+_logger = get_logger(__name__)
+
+
+class Job(metaclass=Meta):
+    """
+    Base class of pipeline jobs, one subclass per job name.
+    Subclasses are registered in the ``Meta`` classes registry under ``service.pipeline.<__job__>``, so addons
+    extend a job by registering a class with the same name; the base class itself is registered outside of that
+    namespace and cannot be submitted. A job receives its items in chunks, each chunk runs in a worker process
+    on the pooled ``PostgresManager`` of that process.
+    Example:
+        class Recompute(Job):
+            __job__ = 'recompute'
+
+            def run(self, items, **params):
+                return len(items)
+    Attributes:
+        __job__ (str): Name clients use to submit the job.
+        __authenticated__ (bool): Whether the job is only accepted on a connection authenticated with a token.
+        manager: The ``PostgresManager`` of the worker process.
+        user_id (Optional[int]): The user the connection submitting the job authenticated as, None if it did not.
+    """
+    __meta_path__ = 'service.pipeline'
+    __job__: str = ''
+    __authenticated__: bool = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__job__:
+            raise TypeError(f'Job "{cls.__name__}" must define "__job__"')
+        if '__meta_path__' not in cls.__dict__:
+            cls.__meta_path__ = f'service.pipeline.{cls.__job__}'
+        Meta.attach_subclass(cls)
+
+    def __init__(self, manager: Any, user_id: Optional[int] = None):
+        self.manager = manager
+        self.user_id = user_id
+
+    def run(self, items: List[Any], **params) -> Any:
+        """Processes a chunk of items and returns a JSON serializable result."""
+        raise NotImplementedError
+
+
+class AssignRoles(Job):
+    """Imports role assignments, items are ``[user_id, role]`` pairs assigned by the admin the connection authenticated as."""
+    __job__ = 'assign_roles'
+    __authenticated__ = True
+
+    def run(self, items: List[Any], **params) -> Any:
+        self.manager.create_roles(self.user_id, items)
+        return {'assigned': len(items)}
+
+
+class ExportRoles(Job):
+    """Exports the roles of the users whose ids are the items."""
+    __job__ = 'export_roles'
+
+    def run(self, items: List[Any], **params) -> Any:
+        return [[user_id, role] for user_id, role in self.manager.get_roles(items).items()]
+
+
+_manager = None  # PostgresManager of a worker process, opened on its first chunk
+
+
+def _initialize_worker() -> None:
+    # Forked from the event loop of the service: its signal handlers would wake that loop up through the
+    # inherited wakeup fd, so a worker terminated by the pool would stop the whole service
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Interrupting the service stops it, it must not kill the chunks it is still waiting for
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_chunk(name: str, items: List[Any], params: Dict[str, Any], user_id: Optional[int] = None) -> Any:
+    """Runs a chunk of a job in a worker process."""
+    global _manager
+    if _manager is None:
+        _manager = Meta.compose('core.db.manager')()
+    return Meta.compose(f'service.pipeline.{name}')(_manager, user_id).run(items, **params)
+
+
+def _job_class(name: Any) -> type:
+    """
+    Returns the class of a job name.
+    Raises:
+        LookupError: If no job of that name is registered.
+    """
+    if not isinstance(name, str) or not name:
+        raise LookupError('Expected a "job" name')
+    try:
+        job_class = Meta.compose(f'service.pipeline.{name}')
+    except LookupError:
+        raise LookupError(f'Unknown job "{name}"') from None
+    if not isinstance(job_class, type) or not issubclass(job_class, Job) or job_class.__job__ != name:
+        raise LookupError(f'Unknown job "{name}"')
+    return job_class
+
+
+class Client:
+    """A connection to the pipeline, and the user it authenticated as."""
+    __slots__ = ('writer', 'user_id')
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.user_id: Optional[int] = None
+
+
+class PipelineService:
+    """
+    Accepts jobs as newline-delimited JSON and streams their results back the same way.
+    A connection authenticates with a line ``{"auth": "<token>"}``, answered ``{"auth": true, "user_id": ...}``, see
+    ``master.service.auth``; jobs acting on behalf of a user, such as ``assign_roles``, are only accepted once it did.
+    A job is a line ``{"id": ..., "job": "<name>", "items": [...], "params": {...}, "chunk_size": 1000}``. Its items
+    are split into chunks of ``chunk_size``, ``pipeline_chunk_size`` by default, which run on a process pool. Each
+    chunk answers ``{"id": ..., "chunk": <index>, "result": ...}`` or ``{"id": ..., "chunk": <index>, "error": "..."}``
+    as soon as it completes, then ``{"id": ..., "done": true, "chunks": <count>, "failed": <count>}`` ends the job.
+    At most ``queue_size`` chunks are queued or running at once; past that, submitting waits, and so does
+    reading the next jobs of the connection, so producers are slowed down to the pace of the workers.
+    """
+    __slots__ = ('workers', 'queue_size', 'chunk_size', 'secret', 'executor', '_slots')
+
+    def __init__(self, workers: int, queue_size: int, chunk_size: int, secret: str = ''):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.secret = secret  # Verifies the tokens of the connections, none can authenticate without it
+        self.executor = self._create_executor()
+        self._slots = asyncio.Semaphore(queue_size)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, initializer=_initialize_worker)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves a connection until the client closes it."""
+        client = Client(writer)
+        jobs = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self._write(writer, {'error': 'Line too long'})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = await self.submit(line, client)
+                if task is not None:
+                    jobs.add(task)
+                    task.add_done_callback(jobs.discard)
+            if jobs:
+                await asyncio.gather(*jobs)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in jobs:
+                task.cancel()
+            writer.close()
+
+    async def submit(self, line: bytes, client: Client) -> Optional[asyncio.Task]:
+        """
+        Authenticates the connection, or submits the chunks of a job line waiting for free queue slots.
+        Returns:
+            asyncio.Task: The task streaming the results of the job, None if the line was rejected or authenticated.
+        """
+        job = None
+        writer = client.writer
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('A job must be a JSON object')
+            if 'auth' in job:
+                await self._authenticate(job['auth'], client)
+                return None
+            name, items = job.get('job'), job.get('items', [])
+            params = job.get('params') or {}
+            chunk_size = int(job.get('chunk_size') or self.chunk_size)
+            if not isinstance(items, list) or not isinstance(params, dict) or chunk_size < 1:
+                raise ValueError('Expected a list of "items", an object of "params" and a positive "chunk_size"')
+            if _job_class(name).__authenticated__ and client.user_id is None:
+                raise PermissionError(f'Job "{name}" requires an authenticated connection, send {{"auth": "<token>"}} first')
+        except (ValueError, TypeError, LookupError, PermissionError) as e:
+            await self._write(writer, {'id': job.get('id') if isinstance(job, dict) else None, 'error': str(e)})
+            return None
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(items), chunk_size):
+            await self._slots.acquire()
+            chunk = items[start:start + chunk_size]
+            try:
+                future = loop.run_in_executor(self.executor, _run_chunk, name, chunk, params, client.user_id)
+            except BrokenProcessPool:
+                self._restart_executor()
+                future = loop.run_in_executor(self.executor, _run_chunk, name, chunk, params, client.user_id)
+            future.add_done_callback(lambda _: self._slots.release())
+            futures.append(future)
+        return loop.create_task(self._stream(job.get('id'), futures, writer))
+
+    async def _authenticate(self, token: Any, client: Client) -> None:
+        """
+        Binds the connection to the user of a token.
+        Raises:
+            PermissionError: If the token cannot be verified, the connection then stays unauthenticated.
+        """
+        client.user_id = None
+        try:
+            if not isinstance(token, str):
+                raise AuthenticationError('Expected a token string')
+            client.user_id = auth.verify_token(token, self.secret)
+        except AuthenticationError as e:
+            raise PermissionError(f'Authentication failed: {e}') from None
+        await self._write(client.writer, {'auth': True, 'user_id': client.user_id})
+
+    async def _stream(self, job_id: Any, futures: List[asyncio.Future], writer: asyncio.StreamWriter) -> None:
+        """Writes the result of each chunk as it completes, then the end of the job."""
+        async def outcome(index, future):
+            try:
+                return index, await future, None
+            except Exception as e:
+                return index, None, e
+
+        failed = 0
+        for completed in asyncio.as_completed([outcome(index, future) for index, future in enumerate(futures)]):
+            index, result, error = await completed
+            if error is None:
+                await self._write(writer, {'id': job_id, 'chunk': index, 'result': result})
+                continue
+            failed += 1
+            if isinstance(error, BrokenProcessPool):
+                self._restart_executor()
+            await self._write(writer, {'id': job_id, 'chunk': index, 'error': f'{type(error).__name__}: {error}'})
+        await self._write(writer, {'id': job_id, 'done': True, 'chunks': len(futures), 'failed': failed})
+
+    def _restart_executor(self) -> None:
+        if getattr(self.executor, '_broken', False):
+            _logger.error("A pipeline worker process died, restarting the pool")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._create_executor()
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+        writer.write(json.dumps(message, separators=(',', ':'), default=str).encode() + b'\n')
+        # Results wait for slow readers instead of piling up in memory
+        await writer.drain()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def serve(sock: socket.socket, configuration: Optional[dict] = None) -> None:
+    """Serves the pipeline on a listening socket until SIGTERM or SIGINT."""
+    if configuration is None:
+        configuration = parser.arguments.configuration
+    loop = asyncio.get_running_loop()
+    workers = configuration['pipeline_workers'] or os.cpu_count() or 1
+    service = PipelineService(workers, configuration['pipeline_queue_size'] or 2 * workers, configuration['pipeline_chunk_size'],
+                              configuration['auth_secret'])
+    stopped = asyncio.Event()
+    for number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(number, stopped.set)
+    server = await asyncio.start_server(service.handle, sock=sock, limit=configuration['pipeline_max_line_size'])
+    _logger.info("Pipeline listening on %s:%s with %s worker processes", *sock.getsockname()[:2], workers)
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        await loop.run_in_executor(None, service.close)
+
+
+def add_workers(supervisor: Any, configuration: dict) -> None:
+    """Adds the process accepting pipeline jobs to a ``Supervisor``, when ``pipeline_port`` is set. It forks the pool workers itself."""
+    if not configuration['pipeline_port']:
+        return
+
+    def target():
+        sock = create_socket(configuration['hostname'], configuration['pipeline_port'], backlog=configuration['http_backlog'])
+        asyncio.run(serve(sock, configuration))
+    supervisor.add('pipeline', target)
@@ -0,0 +1,291 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+import heapq
+import random
+import signal
+import threading
+import time
+from master.config.logging import get_logger
+from master.core.api import Meta, classes
+from master.core import metrics
+
+_logger = get_logger(__name__)
+
+
+class Task(metaclass=Meta):
+    """
+    Base class of periodic tasks, one subclass per task name.
+    Subclasses are registered in the ``Meta`` classes registry under ``service.scheduler.<__task__>``, so addons
+    change the schedule or the work of a task by registering a class with the same name; the base class itself
+    is registered outside of that namespace and is never scheduled. A task runs every
+    ``interval`` seconds or at the times matching its ``cron`` expression, never twice at once.
+    Example:
+        class RefreshRoles(Task):
+            __task__ = 'refresh_roles'
+            cron = '*/15 * * * *'
+            jitter = 10
+
+            def run(self):
+                self.manager.role_cache.invalidate()
+    Attributes:
+        __task__ (str): Name of the task, also used for its log messages and metrics.
+        interval (float): Seconds between two runs, measured from the previous scheduled time.
+        cron (str): Cron expression ``minute hour day-of-month month day-of-week``, in local time.
+        jitter (float): Up to this many seconds are randomly added to every run time, so that the tasks
+            of several nodes do not hit the database at the same instant. The jitter only delays a run, the
+            next ones are still scheduled from the unjittered time.
+        run_at_start (bool): Whether the first run happens when the scheduler starts rather than one period later.
+        manager: The ``PostgresManager`` of the scheduler, None if it was not given one.
+    """
+    __meta_path__ = 'service.scheduler'
+    __task__: str = ''
+    interval: float = 0.0
+    cron: str = ''
+    jitter: float = 0.0
+    run_at_start: bool = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__task__:
+            raise TypeError(f'Task "{cls.__name__}" must define "__task__"')
+        if '__meta_path__' not in cls.__dict__:
+            cls.__meta_path__ = f'service.scheduler.{cls.__task__}'
+        Meta.attach_subclass(cls)
+
+    def __init__(self, manager: Any = None):
+        self.manager = manager
+
+    def run(self) -> None:
+        """Does the work of the task, exceptions are logged and the task stays scheduled."""
+        raise NotImplementedError
+
+
+class CronSchedule:
+    """
+    Parsed cron expression with the five classic fields. Fields accept ``*``, values, ``a-b`` ranges, ``/step``
+    and comma separated lists, weekdays count from 0 (Sunday) to 7 (Sunday again). As in cron, when both the
+    day of month and the day of week are restricted, a day matching either one matches.
+    """
+    __slots__ = ('expression', 'minutes', 'hours', 'days', 'months', 'weekdays', '_any_day', '_any_weekday')
+
+    FIELDS: Tuple[Tuple[int, int], ...] = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    MAX_DAYS = 366 * 5  # A date matching the expression exists within a leap year cycle, if any does
+
+    def __init__(self, expression: str):
+        """
+        Raises:
+            ValueError: If the expression does not have five valid fields.
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Invalid cron expression "{expression}", expected 5 fields')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELDS))
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> FrozenSet[int]:
+        values = set()
+        for part in field.split(','):
+            pattern, _, step = part.partition('/')
+            try:
+                if pattern == '*':
+                    start, end = low, high
+                elif '-' in pattern:
+                    start, end = map(int, pattern.split('-', 1))
+                else:
+                    start = end = int(pattern)
+                    if step:
+                        end = high
+                step = int(step) if step else 1
+            except ValueError:
+                raise ValueError(f'Invalid cron field "{field}"') from None
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f'Cron field "{field}" is out of range {low}-{high}')
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, moment: time.struct_time) -> bool:
+        if moment.tm_mon not in self.months:
+            return False
+        day = moment.tm_mday in self.days
+        # struct_time counts weekdays from Monday
+        weekday = (moment.tm_wday + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after: float) -> float:
+        """
+        Returns the first matching time strictly after a timestamp.
+        Raises:
+            ValueError: If no date ever matches, such as February 30th.
+        """
+        # Start of the next minute, non-matching days and hours are skipped at once
+        moment = time.localtime((int(after) // 60 + 1) * 60)
+        year, month, day, hour, minute = moment[:5]
+        for _ in range(self.MAX_DAYS):
+            moment = time.localtime(time.mktime((year, month, day, 0, 0, 0, 0, 0, -1)))
+            year, month, day = moment[:3]
+            if self._day_matches(moment):
+                for hour in range(hour, 24):
+                    if hour not in self.hours:
+                        minute = 0
+                        continue
+                    for minute in range(minute, 60):
+                        if minute in self.minutes:
+                            found = time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+                            if found > after:
+                                return found
+                    minute = 0
+            day, hour, minute = day + 1, 0, 0
+        raise ValueError(f'Cron expression "{self.expression}" never matches')
+
+
+class Scheduler:
+    """
+    Runs the registered ``Task`` classes on their schedules.
+    Next run times are kept in a min-heap, a single thread sleeps until the earliest one and hands due tasks
+    to a bounded thread pool. A task still running when its next run is due skips that run instead of piling
+    up behind itself. The duration of each run is recorded in the ``scheduler_task_<name>`` histogram.
+    Attributes:
+        manager: Passed to every task, usually the ``PostgresManager`` of the process.
+        workers (int): Threads running the tasks.
+        tasks (Dict[str, Task]): Task instances by name, they are created once and kept between runs.
+        runs (Dict[str, int]): Completed runs per task.
+        failures (Dict[str, int]): Runs per task that raised an exception.
+        skipped (Dict[str, int]): Runs per task skipped because the previous one had not finished.
+    """
+    __slots__ = ('manager', 'workers', 'tasks', 'runs', 'failures', 'skipped', '_schedules', '_heap', '_running',
+                 '_condition', '_stopping', '_executor', '_thread')
+
+    def __init__(self, manager: Any = None, workers: int = 4, names: Optional[List[str]] = None):
+        """
+        Args:
+            manager: Passed to every task.
+            workers (int): Threads running the tasks.
+            names (Optional[List[str]]): Tasks to schedule, all the registered ones by default.
+        Raises:
+            ValueError: If a task has no valid schedule.
+        """
+        self.manager = manager
+        self.workers = workers
+        self.tasks: Dict[str, Task] = {}
+        self._schedules: Dict[str, Optional[CronSchedule]] = {}
+        for name in registered_tasks() if names is None else names:
+            task = Meta.compose(f'service.scheduler.{name}')(manager)
+            if bool(task.interval) == bool(task.cron):
+                raise ValueError(f'Task "{name}" must define either an "interval" or a "cron" expression')
+            if task.interval and task.interval <= 0:
+                raise ValueError(f'Interval of task "{name}" must be positive')
+            self.tasks[name] = task
+            self._schedules[name] = CronSchedule(task.cron) if task.cron else None
+        self.runs = dict.fromkeys(self.tasks, 0)
+        self.failures = dict.fromkeys(self.tasks, 0)
+        self.skipped = dict.fromkeys(self.tasks, 0)
+        self._heap: List[Tuple[float, float, str]] = []  # (jittered run time, scheduled run time, task name)
+        self._running = set()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _next_time(self, name: str, previous: float, now: float) -> float:
+        schedule = self._schedules[name]
+        if schedule is not None:
+            return schedule.next(now)
+        # Runs keep to their period instead of drifting by their duration, missed periods are not caught up
+        following = previous + self.tasks[name].interval
+        return following if following > now else now + self.tasks[name].interval
+
+    def _push(self, name: str, scheduled: float) -> None:
+        jitter = self.tasks[name].jitter
+        heapq.heappush(self._heap, (scheduled + (random.uniform(0, jitter) if jitter > 0 else 0.0), scheduled, name))
+
+    def run(self) -> None:
+        """Runs the tasks until ``stop`` is called, then waits for the running ones."""
+        now = time.time()
+        with self._condition:
+            self._stopping = False
+            self._heap.clear()
+            for name, task in self.tasks.items():
+                self._push(name, now if task.run_at_start else self._next_time(name, now, now))
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='scheduler')
+        _logger.info("Scheduler started with %s tasks on %s threads", len(self.tasks), self.workers)
+        try:
+            with self._condition:
+                while not self._stopping:
+                    now = time.time()
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    when, scheduled, name = self._heap[0]
+                    if when > now:
+                        self._condition.wait(when - now)
+                        continue
+                    heapq.heappop(self._heap)
+                    # The jitter of this run must not shift the following ones
+                    self._push(name, self._next_time(name, scheduled, now))
+                    if name in self._running:
+                        self.skipped[name] += 1
+                        _logger.warning("Task %s is still running, skipping its run due at %s", name, time.ctime(when))
+                        continue
+                    self._running.add(name)
+                    self._executor.submit(self._execute, name)
+        finally:
+            self._executor.shutdown(wait=True)
+            _logger.info("Scheduler stopped")
+
+    def _execute(self, name: str) -> None:
+        started = time.monotonic()
+        try:
+            self.tasks[name].run()
+        except Exception:
+            self.failures[name] += 1
+            _logger.exception("Task %s failed", name)
+        finally:
+            duration = time.monotonic() - started
+            metrics.histogram(f'scheduler_task_{name}').observe(duration)
+            _logger.debug("Task %s ran in %.3f s", name, duration)
+            with self._condition:
+                self.runs[name] += 1
+                self._running.discard(name)
+
+    def start(self) -> threading.Thread:
+        """Runs the scheduler in a background thread of the current process."""
+        self._thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, wait: bool = True) -> None:
+        """Stops scheduling new runs. Safe to call from a signal handler of the thread running the scheduler."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+def registered_tasks() -> List[str]:
+    """Returns the names of the registered tasks."""
+    prefix = 'service.scheduler.'
+    return sorted(path[len(prefix):] for path, registered in list(classes.items())
+                  if registered and path.startswith(prefix)
+                  and any(issubclass(klass, Task) and klass.__task__ == path[len(prefix):] for klass in registered))
+
+
+def add_workers(supervisor: Any, configuration: dict) -> None:
+    """Adds the process running the periodic tasks to a ``Supervisor``, when tasks are registered and ``scheduler_workers`` is set."""
+    if not configuration['scheduler_workers'] or not registered_tasks():
+        return
+
+    def target():
+        from master.core import db  # Registers PostgresManager
+        scheduler = Scheduler(Meta.compose('core.db.manager')(), configuration['scheduler_workers'])
+        for number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(number, lambda *args: scheduler.stop(wait=False))
+        scheduler.run()
+    supervisor.add('scheduler', target)
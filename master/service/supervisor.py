@@ -0,0 +1,142 @@
+from typing import Callable, Dict, List, NamedTuple
+import os
+import signal
+import time
+from master.config.logging import get_logger
+from master.config import parser
+from master import config
+
+_logger = get_logger(__name__)
+
+
+class Worker(NamedTuple):
+    """A process kept running by the ``Supervisor``."""
+    name: str
+    target: Callable[[], None]  # Runs in the forked process until it is asked to stop with SIGTERM
+
+
+class Supervisor:
+    """
+    Pre-forks the worker processes of the services and restarts those exiting unexpectedly.
+    SIGTERM or SIGINT stops every worker, then the supervisor. When a single worker is configured, or
+    the platform cannot fork, it runs in the current process instead.
+    Attributes:
+        workers (List[Worker]): Processes to run, a service running N processes is added N times.
+        min_uptime (float): Workers exiting sooner after their start count as failing to start.
+        max_failures (int): Consecutive failed starts after which the supervisor gives up.
+        metrics_port (int): When set, each worker serves its own metrics on this port plus its index in ``workers``,
+            since the statements, pools and tasks it measures live in its process.
+    """
+    __slots__ = ('workers', 'min_uptime', 'max_failures', 'metrics_port', '_children', '_failures', '_stopping')
+
+    def __init__(self, min_uptime: float = 1.0, max_failures: int = 5, metrics_port: int = 0):
+        self.workers: List[Worker] = []
+        self.min_uptime = min_uptime
+        self.max_failures = max_failures
+        self.metrics_port = metrics_port
+        self._children: Dict[int, tuple] = {}  # pid -> (worker, started at)
+        self._failures = 0
+        self._stopping = False
+
+    def add(self, name: str, target: Callable[[], None], count: int = 1) -> None:
+        """Adds ``count`` processes running ``target``."""
+        for index in range(count):
+            self.workers.append(Worker(f'{name}-{index}' if count > 1 else name, target))
+
+    def run(self) -> int:
+        """
+        Runs the workers until they are stopped.
+        Returns:
+            int: The exit code, 0 after a requested stop, 1 if workers kept failing to start.
+        """
+        if not self.workers:
+            return 0
+        if len(self.workers) == 1 or not hasattr(os, 'fork'):
+            for worker in self.workers[1:]:
+                _logger.warning("Cannot fork, worker %s is not started", worker.name)
+            self._serve_metrics(0)
+            self.workers[0].target()
+            return 0
+
+        previous = {number: signal.signal(number, self._stop) for number in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for worker in self.workers:
+                self._spawn(worker)
+            return self._watch()
+        finally:
+            for number, handler in previous.items():
+                signal.signal(number, handler)
+
+    def _spawn(self, worker: Worker) -> None:
+        pid = os.fork()
+        if pid:
+            self._children[pid] = (worker, time.monotonic())
+            _logger.info("Started worker %s (pid %s)", worker.name, pid)
+            return
+        code = 0
+        try:
+            for number in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(number, signal.SIG_DFL)
+            # The logging thread of the supervisor does not exist in the child
+            config.init_logging()
+            self._serve_metrics(self.workers.index(worker))
+            worker.target()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            _logger.exception("Worker %s crashed", worker.name)
+            code = 1
+        finally:
+            config.logging.shutdown()
+            os._exit(code)
+
+    def _serve_metrics(self, index: int) -> None:
+        """Serves the metrics of the current worker process, if ``metrics_port`` is set."""
+        if not self.metrics_port:
+            return
+        from master.core import metrics
+        try:
+            metrics.start_metrics_server(self.metrics_port + index)
+        except OSError as e:
+            _logger.error("Cannot serve the metrics of worker %s on port %s: %s",
+                          self.workers[index].name, self.metrics_port + index, e)
+
+    def _watch(self) -> int:
+        code = 0
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker, started_at = self._children.pop(pid, (None, 0.0))
+            if worker is None or self._stopping:
+                continue
+            _logger.error("Worker %s (pid %s) exited with code %s", worker.name, pid, os.waitstatus_to_exitcode(status))
+            self._failures = self._failures + 1 if time.monotonic() - started_at < self.min_uptime else 0
+            if self._failures >= self.max_failures:
+                _logger.critical("Workers keep failing to start, stopping")
+                self._stop()
+                code = 1
+                continue
+            self._spawn(worker)
+        return code
+
+    def _stop(self, *args) -> None:
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def start() -> int:
+    """Runs the services of the ERP configuration, see ``Supervisor``."""
+    from master.service import http, pipeline, scheduler, websocket
+    configuration = parser.arguments.configuration
+    supervisor = Supervisor(metrics_port=configuration['metrics_port'])
+    http.add_workers(supervisor, configuration)
+    websocket.add_workers(supervisor, configuration)
+    pipeline.add_workers(supervisor, configuration)
+    scheduler.add_workers(supervisor, configuration)
+    return supervisor.run()
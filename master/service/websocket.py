@@ -0,0 +1,389 @@
+from base64 import b64encode
+from hashlib import sha1
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+import asyncio
+import json
+import signal
+import socket
+import struct
+import psycopg2
+from psycopg2 import sql
+from master.config.logging import get_logger
+from master.config import parser
+from master.exceptions.http import HttpError, WebSocketError
+from master.core.api import Meta
+from master.core.async_db import connect, wait
+from master.core.db import ROLE_CHANNEL_NAME
+from master.service.http import create_socket, encode_response, parse_request
+
+_logger = get_logger(__name__)
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'  # Appended to the client key of the handshake, RFC 6455
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+CLOSE_NORMAL, CLOSE_GOING_AWAY, CLOSE_PROTOCOL_ERROR, CLOSE_UNSUPPORTED, CLOSE_TOO_BIG = 1000, 1001, 1002, 1003, 1009
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT) -> bytes:
+    """Returns an unmasked, unfragmented frame, as sent by servers."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def parse_frame(buffer: bytearray, max_size: int) -> Optional[Tuple[bool, int, bytes]]:
+    """
+    Removes the first complete client frame from a buffer and returns it unmasked.
+    Returns:
+        Tuple[bool, int, bytes]: The FIN bit, the opcode and the payload, None if the frame is incomplete.
+    Raises:
+        WebSocketError: If the frame is not masked or larger than ``max_size``.
+    """
+    if len(buffer) < 2:
+        return None
+    first, second = buffer[0], buffer[1]
+    length = second & 0x7F
+    offset = 2
+    if length == 126:
+        if len(buffer) < 4:
+            return None
+        length, = struct.unpack_from('!H', buffer, 2)
+        offset = 4
+    elif length == 127:
+        if len(buffer) < 10:
+            return None
+        length, = struct.unpack_from('!Q', buffer, 2)
+        offset = 10
+    if not second & 0x80:
+        raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'Client frames must be masked')
+    if length > max_size:
+        raise WebSocketError(CLOSE_TOO_BIG, f'Frames are limited to {max_size} bytes')
+    end = offset + 4 + length
+    if len(buffer) < end:
+        return None
+    mask = bytes(buffer[offset:offset + 4]) * (length // 4 + 1)
+    payload = (int.from_bytes(buffer[offset + 4:end], 'big') ^ int.from_bytes(mask[:length], 'big')).to_bytes(length, 'big')
+    del buffer[:end]
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+def close_frame(code: int, reason: str = '') -> bytes:
+    return encode_frame(struct.pack('!H', code) + reason.encode()[:123], OP_CLOSE)
+
+
+class Hub:
+    """
+    Subscriptions of the connected clients by topic.
+    Each published message is serialized and framed once, the same bytes are then written to every subscriber.
+    Attributes:
+        topics (Dict[str, Set[WebSocketProtocol]]): Subscribers by topic.
+        published (int): Messages published to at least one subscriber.
+        sent (int): Writes to subscribers, messages received together are written at once.
+        evictions (int): Clients disconnected for not reading fast enough.
+    """
+    __slots__ = ('topics', 'published', 'sent', 'evictions')
+
+    def __init__(self):
+        self.topics: Dict[str, Set['WebSocketProtocol']] = {}
+        self.published = 0
+        self.sent = 0
+        self.evictions = 0
+
+    def subscribe(self, client: 'WebSocketProtocol', topic: str) -> None:
+        self.topics.setdefault(topic, set()).add(client)
+        client.topics.add(topic)
+
+    def unsubscribe(self, client: 'WebSocketProtocol', topic: str) -> None:
+        subscribers = self.topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.topics[topic]
+        client.topics.discard(topic)
+
+    def remove(self, client: 'WebSocketProtocol') -> None:
+        for topic in list(client.topics):
+            self.unsubscribe(client, topic)
+
+    def publish(self, topic: str, data: Any) -> int:
+        """
+        Sends a message to the subscribers of a topic.
+        Returns:
+            int: The number of clients the message was written to.
+        """
+        return self.publish_many([(topic, data)])
+
+    def publish_many(self, messages: Iterable[Tuple[str, Any]]) -> int:
+        """
+        Sends messages received together, the frames of a topic are joined so each subscriber gets a single write.
+        Args:
+            messages (Iterable[Tuple[str, Any]]): Topic and data of each message, in order.
+        Returns:
+            int: The number of writes to clients.
+        """
+        frames: Dict[str, List[bytes]] = {}
+        for topic, data in messages:
+            if topic in self.topics:
+                frames.setdefault(topic, []).append(
+                    encode_frame(json.dumps({'topic': topic, 'data': data}, separators=(',', ':'), default=str).encode()))
+        sent = 0
+        for topic, topic_frames in frames.items():
+            chunk = b''.join(topic_frames)
+            for client in list(self.topics.get(topic, ())):
+                if client.send(chunk):
+                    sent += 1
+            self.published += len(topic_frames)
+        self.sent += sent
+        return sent
+
+
+class WebSocketProtocol(asyncio.Protocol):
+    """
+    Server side of a WebSocket connection.
+    Clients subscribe with the ``topics`` query parameter of the handshake URL, a comma separated list, or by
+    sending ``{"subscribe": "<topic>"}`` and ``{"unsubscribe": "<topic>"}`` text messages. A client whose
+    unsent frames exceed ``max_buffer`` bytes is disconnected rather than buffered for without bound.
+    """
+
+    def __init__(self, hub: Hub, connections: Set['WebSocketProtocol'], max_buffer: int = 1048576, max_message_size: int = 65536):
+        self.hub = hub
+        self.connections = connections
+        self.max_buffer = max_buffer
+        self.max_message_size = max_message_size
+        self.transport: Optional[asyncio.Transport] = None
+        self.topics: Set[str] = set()
+        self.open = False
+        self._buffer = bytearray()
+        self._fragments: Optional[bytearray] = None
+        self._closing = False
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.connections.add(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.connections.discard(self)
+        self.hub.remove(self)
+        self.open = False
+        self._closing = True
+
+    def data_received(self, data: bytes) -> None:
+        if self._closing:
+            return
+        self._buffer += data
+        try:
+            if not self.open and not self._handshake():
+                return
+            while not self._closing:
+                frame = parse_frame(self._buffer, self.max_message_size)
+                if frame is None:
+                    break
+                self._handle(*frame)
+        except HttpError as e:
+            self.transport.write(encode_response(e.status, {'error': e.message}, keep_alive=False))
+            self._closing = True
+            self.transport.close()
+        except WebSocketError as e:
+            self.close(e.code, e.message)
+
+    def send(self, frame: bytes) -> bool:
+        """
+        Writes a frame, or evicts the client if it would exceed its send buffer.
+        Returns:
+            bool: Whether the frame was written.
+        """
+        if not self.open:
+            return False
+        if self.transport.get_write_buffer_size() + len(frame) > self.max_buffer:
+            _logger.warning("Disconnecting slow WebSocket client %s, %s bytes unsent",
+                            self.transport.get_extra_info('peername'), self.transport.get_write_buffer_size())
+            self.hub.evictions += 1
+            self._abort()
+            return False
+        self.transport.write(frame)
+        return True
+
+    def close(self, code: int = CLOSE_NORMAL, reason: str = '') -> None:
+        """Starts the closing handshake, the connection is closed once the frame is sent."""
+        if self._closing:
+            return
+        if self.open:
+            self.transport.write(close_frame(code, reason))
+        self.hub.remove(self)
+        self.open = False
+        self._closing = True
+        self.transport.close()
+
+    def _abort(self) -> None:
+        # Reset rather than close, so the frames already queued by the kernel are dropped too
+        sock = self.transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.hub.remove(self)
+        self.open = False
+        self._closing = True
+        self.transport.abort()
+
+    def _handshake(self) -> bool:
+        request = parse_request(self._buffer, 0)
+        if request is None:
+            return False
+        headers = request.headers
+        if request.method != 'GET' or headers.get('upgrade', '').lower() != 'websocket' \
+                or 'upgrade' not in headers.get('connection', '').lower() or not headers.get('sec-websocket-key'):
+            raise HttpError(400, 'Expected a WebSocket upgrade request')
+        if headers.get('sec-websocket-version') != '13':
+            raise HttpError(400, 'Only WebSocket version 13 is supported')
+        accept = b64encode(sha1((headers['sec-websocket-key'] + GUID).encode()).digest()).decode()
+        self.transport.write((f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                              f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode())
+        self.open = True
+        for value in parse_qs(request.query).get('topics', []):
+            for topic in filter(None, value.split(',')):
+                self.hub.subscribe(self, topic)
+        return True
+
+    def _handle(self, fin: bool, opcode: int, payload: bytes) -> None:
+        if opcode == OP_PING:
+            self.transport.write(encode_frame(payload, OP_PONG))
+        elif opcode == OP_CLOSE:
+            self.close(CLOSE_NORMAL)
+        elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+            if opcode != OP_CONTINUATION:
+                self._fragments = bytearray()
+            elif self._fragments is None:
+                raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'Unexpected continuation frame')
+            self._fragments += payload
+            if len(self._fragments) > self.max_message_size:
+                raise WebSocketError(CLOSE_TOO_BIG, f'Messages are limited to {self.max_message_size} bytes')
+            if fin:
+                message, self._fragments = bytes(self._fragments), None
+                self._command(message)
+        elif opcode != OP_PONG:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, f'Unknown opcode {opcode}')
+
+    def _command(self, message: bytes) -> None:
+        try:
+            command = json.loads(message)
+        except ValueError:
+            raise WebSocketError(CLOSE_UNSUPPORTED, 'Messages must be JSON')
+        if not isinstance(command, dict):
+            raise WebSocketError(CLOSE_UNSUPPORTED, 'Messages must be JSON objects')
+        if isinstance(command.get('subscribe'), str):
+            self.hub.subscribe(self, command['subscribe'])
+        if isinstance(command.get('unsubscribe'), str):
+            self.hub.unsubscribe(self, command['unsubscribe'])
+
+
+class WebSocketService(metaclass=Meta):
+    """
+    Publishes database notifications to WebSocket subscribers.
+    ``CHANNELS`` maps the LISTEN/NOTIFY channels to the topic their events are published on, and ``event``
+    turns a notification into the published data; addons extend both on the ``service.websocket`` meta path.
+    Role changes are published on the ``roles`` topic as ``{"user_id": "<id>"}``, ``null`` when every role changed.
+    """
+    __meta_path__ = 'service.websocket'
+    CHANNELS: Dict[str, str] = {ROLE_CHANNEL_NAME: 'roles'}
+
+    def __init__(self, hub: Hub):
+        self.hub = hub
+
+    def event(self, channel: str, payload: str) -> Any:
+        """Returns the data published for a notification."""
+        if channel == ROLE_CHANNEL_NAME:
+            return {'user_id': payload or None}
+        return {'payload': payload}
+
+    def notify(self, notifications: Iterable[Tuple[str, str]]) -> None:
+        """Publishes notifications, given as (channel, payload) pairs, on the topics of their channels."""
+        self.hub.publish_many((self.CHANNELS[channel], self.event(channel, payload))
+                              for channel, payload in notifications if channel in self.CHANNELS)
+
+    async def listen(self, retry_interval: float = 5.0) -> None:
+        """LISTENs on every channel of ``CHANNELS`` and publishes notifications until cancelled, reconnecting on failures."""
+        loop = asyncio.get_running_loop()
+        while True:
+            connection = None
+            try:
+                connection = await connect()
+                cursor = connection.cursor()
+                for channel in self.CHANNELS:
+                    cursor.execute(sql.SQL("LISTEN {channel}").format(channel=sql.Identifier(channel)))
+                    await wait(connection)
+                cursor.close()
+                await self._dispatch(loop, connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.warning("WebSocket notification listener disconnected, retrying in %s seconds: %s", retry_interval, e)
+                await asyncio.sleep(retry_interval)
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+    async def _dispatch(self, loop: asyncio.AbstractEventLoop, connection: Any) -> None:
+        """Publishes the notifications of a listening connection until it fails."""
+        failed = loop.create_future()
+
+        def readable():
+            try:
+                connection.poll()
+            except psycopg2.Error as e:
+                if not failed.done():
+                    failed.set_exception(e)
+                return
+            if connection.notifies:
+                notifications = [(notification.channel, notification.payload) for notification in connection.notifies]
+                connection.notifies.clear()
+                self.notify(notifications)
+
+        loop.add_reader(connection.fileno(), readable)
+        try:
+            await failed
+        finally:
+            loop.remove_reader(connection.fileno())
+
+
+async def serve(sock: socket.socket, configuration: Optional[dict] = None) -> None:
+    """Serves WebSocket subscriptions on a listening socket until SIGTERM or SIGINT."""
+    if configuration is None:
+        configuration = parser.arguments.configuration
+    loop = asyncio.get_running_loop()
+    hub = Hub()
+    service = Meta.compose('service.websocket')(hub)
+    connections: Set[WebSocketProtocol] = set()
+    stopped = asyncio.Event()
+    for number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(number, stopped.set)
+    server = await loop.create_server(
+        lambda: WebSocketProtocol(hub, connections, configuration['websocket_max_buffer'], configuration['websocket_max_message_size']),
+        sock=sock)
+    listener = loop.create_task(service.listen())
+    _logger.info("WebSocket service listening on %s:%s", *sock.getsockname()[:2])
+    try:
+        await stopped.wait()
+    finally:
+        listener.cancel()
+        server.close()
+        for connection in list(connections):
+            connection.close(CLOSE_GOING_AWAY)
+        await server.wait_closed()
+
+
+def add_workers(supervisor: Any, configuration: dict) -> None:
+    """
+    Adds the process serving WebSocket subscriptions to a ``Supervisor``, when ``websocket_port`` is set.
+    A single process holds every subscription, so each notification is serialized once for all clients.
+    """
+    if not configuration['websocket_port']:
+        return
+
+    def target():
+        sock = create_socket(configuration['hostname'], configuration['websocket_port'], backlog=configuration['http_backlog'])
+        asyncio.run(serve(sock, configuration))
+    supervisor.add('websocket', target)
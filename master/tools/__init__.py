@@ -1,3 +1,10 @@
-from . import collection
-from . import enums
-from . import misc
+import importlib
+
+_submodules = ('cache', 'collection', 'enums', 'misc')
+
+
+def __getattr__(name: str):
+    # Submodules are imported on first access, importing one tool does not pull the others in
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from functools import update_wrapper
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+MISSING = object()  # Marks a key absent from a cache, None is a valid cached value
+
+
+class _Flight:
+    """A computation in progress, shared by the concurrent misses of one key."""
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class LRUCache:
+    """
+    Thread-safe cache evicting the least recently used entries past ``max_size``.
+    Entries weigh ``sizeof(value)``, 1 each by default, so the cache can be bounded by bytes or rows rather than
+    by entries. ``get_or_compute`` computes a missing value once however many threads miss it at the same time.
+    Attributes:
+        max_size (int): Maximum total weight of the entries, 0 disables caching.
+        sizeof (Optional[Callable[[Any], int]]): Weight of a value, None weighs every entry 1.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that found nothing or an expired entry.
+        evictions (int): Number of entries evicted to respect ``max_size``.
+        generation (int): Bumped on every invalidation, values computed before it are not stored.
+    """
+    __slots__ = ('max_size', 'sizeof', 'hits', 'misses', 'evictions', 'generation', 'weight', '_entries',
+                 '_flights', '_lock')
+
+    def __init__(self, max_size: int = 128, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self.weight = 0  # Total weight of the entries
+        self._entries: OrderedDict = OrderedDict()  # key -> (value, weight, expires at)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _expires_at(self) -> float:
+        return float('inf')
+
+    def key(self, key: Hashable) -> Hashable:
+        """Returns the key an entry is stored under, subclasses normalize keys here."""
+        return key
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Returns the cached value of a key, ``default`` if it is not cached or expired."""
+        key = self.key(key)
+        with self._lock:
+            return self._get(key, default)
+
+    def _get(self, key: Hashable, default: Any) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._remove(key)
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """
+        Caches a value, evicting the least recently used entries if the cache gets too heavy.
+        Args:
+            key: The key of the value.
+            value: The value, None included.
+            generation (Optional[int]): Value of ``generation`` before the value was read, the value is ignored
+                if the cache was invalidated since.
+        """
+        if self.max_size <= 0:
+            return
+        key = self.key(key)
+        weight = 1 if self.sizeof is None else self.sizeof(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            if weight > self.max_size:
+                return
+            self._entries[key] = (value, weight, self._expires_at())
+            self.weight += weight
+            while self.weight > self.max_size:
+                _, entry = self._entries.popitem(last=False)
+                self.weight -= entry[1]
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[..., Any], *args: Any) -> Any:
+        """
+        Returns the cached value of a key, computing and caching ``compute(*args)`` on a miss.
+        Concurrent misses of the same key wait for the first one instead of computing the value again, and
+        receive its exception if it failed. A value computed across an invalidation is returned but not cached.
+        """
+        key = self.key(key)
+        with self._lock:
+            value = self._get(key, MISSING)
+            if value is not MISSING:
+                return value
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                generation = self.generation
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        self.set(key, flight.value, generation)
+        return flight.value
+
+    def invalidate(self, key: Hashable = MISSING) -> None:
+        """Drops the entry of a key, or every entry if no key is given. Computations in progress are not cached."""
+        with self._lock:
+            self.generation += 1
+            if key is MISSING:
+                self._entries.clear()
+                self._flights.clear()
+                self.weight = 0
+            else:
+                key = self.key(key)
+                # Later misses start a new computation rather than joining one that read stale data
+                self._flights.pop(key, None)
+                if key in self._entries:
+                    self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        self.weight -= self._entries.pop(key)[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counters along with the current size and weight."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries), 'weight': self.weight}
+
+
+class TTLCache(LRUCache):
+    """
+    ``LRUCache`` whose entries expire ``ttl`` seconds after they were stored.
+    Attributes:
+        ttl (float): Seconds after which a cached value is considered stale.
+    """
+    __slots__ = ('ttl',)
+
+    def __init__(self, max_size: int = 128, ttl: float = 60.0, sizeof: Optional[Callable[[Any], int]] = None):
+        super().__init__(max_size, sizeof)
+        self.ttl = ttl
+
+    def _expires_at(self) -> float:
+        return time.monotonic() + self.ttl
+
+
+def make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Hashable:
+    """Returns the default key of a memoized call, its positional arguments and its sorted keyword arguments."""
+    if not kwargs:
+        return args[0] if len(args) == 1 and type(args[0]) in (int, str) else args
+    return args + (MISSING,) + tuple(sorted(kwargs.items()))
+
+
+def memoize(max_size: int = 128, ttl: Optional[float] = None, key: Optional[Callable[..., Hashable]] = None,
+            sizeof: Optional[Callable[[Any], int]] = None, cache: Optional[LRUCache] = None):
+    """
+    Caches the results of a function, see ``LRUCache.get_or_compute``.
+    Example:
+        @memoize(max_size=1000, ttl=30, key=lambda partner_id, lang='en': partner_id)
+        def partner_name(partner_id, lang='en'):
+            ...
+    Args:
+        max_size (int): Maximum total weight of the cached results.
+        ttl (Optional[float]): Seconds results are cached for, forever by default.
+        key (Optional[Callable[..., Hashable]]): Called with the arguments of each call, returns the key of its
+            result. By default every argument is part of the key and must be hashable.
+        sizeof (Optional[Callable[[Any], int]]): Weight of a result, 1 by default.
+        cache (Optional[LRUCache]): Cache to use instead of creating one, the other options are then ignored.
+    Returns:
+        The decorator, the decorated function exposes its cache as ``cache`` and ``cache.invalidate()`` clears it.
+    """
+    if cache is None:
+        cache = LRUCache(max_size, sizeof) if ttl is None else TTLCache(max_size, ttl, sizeof)
+
+    def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key is not None else make_key(args, kwargs)
+            if kwargs:
+                return cache.get_or_compute(call_key, lambda: function(*args, **kwargs))
+            return cache.get_or_compute(call_key, function, *args)
+        wrapper.cache = cache
+        return update_wrapper(wrapper, function)
+    return decorator
@@ -1,6 +1,7 @@
-from collections import OrderedDict
 from collections.abc import Iterable
-from typing import Optional, Any, Iterator
+from typing import Optional, Any, Iterator, Union
+
+_HOLE = object()  # Placeholder left in OrderedSet._items by removed elements
 
 
 def is_complex_iterable(obj: Any) -> bool:
@@ -10,21 +11,47 @@ def is_complex_iterable(obj: Any) -> bool:
 
 class OrderedSet(Iterable):
     """
-    A set that preserves the insertion order of elements.
+    A set that preserves the insertion order of elements, with constant time positional access.
+    Elements are stored in a list and indexed by position in a dictionary. Removing an element leaves
+    a hole in the list instead of shifting the elements after it; holes are compacted once they outnumber
+    the elements. While there are holes, positional accesses count the elements before a position with a
+    Fenwick tree, built on the first such access and then kept up to date, so alternating removals or moves
+    with ``index`` or ``[i]`` costs O(log n) per operation instead of a compaction each time.
     Attributes:
-        _data (OrderedDict): An ordered dictionary to store the elements as keys.
+        _data (dict): Maps each element to its position in ``_items``.
+        _items (list): Elements in order, removed elements are replaced by holes.
+        _holes (int): Number of holes in ``_items``.
+        _tree (Optional[list]): Fenwick tree of the number of elements up to each position of ``_items``,
+            None until a positional access needs it.
     """
-    __slots__ = '_data'
+    __slots__ = ('_data', '_items', '_holes', '_tree')
 
     def __init__(self, iterable: Optional[Any] = None):
         """Initializes an OrderedSet, optionally with elements from an iterable."""
-        self._data = OrderedDict()
+        self._data = {}
+        self._items = []
+        self._holes = 0
+        self._tree = None
         if iterable:
             self.update(is_complex_iterable(iterable) and iterable or [iterable])
 
+    @classmethod
+    def _from_unique(cls, values: Iterable) -> 'OrderedSet':
+        """Builds a set from values known to be unique, skipping the membership checks of ``add``."""
+        new = cls.__new__(cls)
+        new._items = list(values)
+        new._data = {value: index for index, value in enumerate(new._items)}
+        new._holes = 0
+        new._tree = None
+        return new
+
     def add(self, value: Any) -> None:
         """Adds an element to the set, maintaining order and uniqueness."""
-        self._data[value] = None
+        if value not in self._data:
+            self._data[value] = len(self._items)
+            self._items.append(value)
+            if self._tree is not None:
+                self._count(len(self._items) - 1, 1)
 
     def update(self, iterable: Any) -> None:
         """Adds multiple elements from an iterable to the set."""
@@ -33,9 +60,35 @@ class OrderedSet(Iterable):
         for value in iterable:
             self.add(value)
 
+    def move_to_end(self, value: Any) -> None:
+        """
+        Moves an element to the end of the set, adding it if missing, in amortized constant time.
+        Args:
+            value (Any): The element to move.
+        """
+        position = self._data.get(value)
+        if position is not None:
+            if position == len(self._items) - 1:
+                return
+            self._items[position] = _HOLE
+            self._holes += 1
+            if self._tree is not None:
+                self._count(position, -1)
+        self._data[value] = len(self._items)
+        self._items.append(value)
+        if self._tree is not None:
+            self._count(len(self._items) - 1, 1)
+        self._maybe_compact()
+
     def copy(self) -> 'OrderedSet':
         """Returns a shallow copy of the OrderedSet."""
-        return self.__class__(self._data.keys())
+        self._compact()
+        new = self.__class__.__new__(self.__class__)
+        new._data = self._data.copy()
+        new._items = self._items.copy()
+        new._holes = 0
+        new._tree = None
+        return new
 
     def index(self, item: Any) -> int:
         """
@@ -45,10 +98,12 @@ class OrderedSet(Iterable):
         Returns:
             int: The index of the item, or -1 if not found.
         """
-        for index, current in enumerate(self._data.keys()):
-            if current == item:
-                return index
-        return -1
+        position = self._data.get(item)
+        if position is None:
+            return -1
+        if not self._holes:
+            return position
+        return self._elements_before(position)
 
     def remove(self, item: Any) -> None:
         """
@@ -58,17 +113,95 @@ class OrderedSet(Iterable):
         Raises:
             KeyError: If the item is not in the set.
         """
-        del self._data[item]
+        position = self._data.pop(item)
+        if position == len(self._items) - 1:
+            self._items.pop()
+        else:
+            self._items[position] = _HOLE
+            self._holes += 1
+        if self._tree is not None:
+            self._count(position, -1)
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        """Compacts once holes outnumber elements, keeping memory and iteration linear in the set size."""
+        if self._holes > 16 and self._holes > len(self._data):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Removes holes and renumbers positions, linear in the number of elements but only after removals."""
+        if not self._holes:
+            return
+        self._items = [value for value in self._items if value is not _HOLE]
+        self._data = {value: index for index, value in enumerate(self._items)}
+        self._holes = 0
+        self._tree = None
 
-    def __getitem__(self, index: int) -> Any:
+    def _build_tree(self) -> list:
+        """Builds the Fenwick tree of ``_items`` in linear time, sized to a power of two with room to grow."""
+        capacity = 1 << (2 * len(self._items)).bit_length()
+        tree = [0] * (capacity + 1)
+        for position, value in enumerate(self._items, 1):
+            if value is not _HOLE:
+                tree[position] += 1
+            parent = position + (position & -position)
+            if parent <= capacity:
+                tree[parent] += tree[position]
+        for position in range(len(self._items) + 1, capacity + 1):
+            parent = position + (position & -position)
+            if parent <= capacity:
+                tree[parent] += tree[position]
+        self._tree = tree
+        return tree
+
+    def _count(self, position: int, delta: int) -> None:
+        """Adds ``delta`` elements at a position of ``_items`` to the tree, dropping it once it is outgrown."""
+        tree = self._tree
+        index = position + 1
+        if index >= len(tree):
+            self._tree = None
+            return
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def _elements_before(self, position: int) -> int:
+        """Returns the number of elements before a position of ``_items``."""
+        tree = self._tree or self._build_tree()
+        count = 0
+        while position:
+            count += tree[position]
+            position &= position - 1
+        return count
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
         """
         Gets the element at the specified index.
         Args:
-            index (int): The index of the element.
+            index (int): The index of the element, slices return a list.
         Returns:
             Any: The element at the given index.
+        Raises:
+            IndexError: If the index is out of range.
         """
-        return list(self._data.keys())[index]
+        if not self._holes or isinstance(index, slice):
+            self._compact()
+            return self._items[index]
+        size = len(self._data)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError(f'{self.__class__.__name__} index out of range')
+        # Descends the tree to the last position preceded by at most ``index`` elements, which holds the element
+        tree = self._tree or self._build_tree()
+        position = 0
+        step = len(tree) - 1
+        while step:
+            if position + step < len(tree) and tree[position + step] <= index:
+                position += step
+                index -= tree[position]
+            step >>= 1
+        return self._items[position]
 
     def __add__(self, other: 'OrderedSet') -> 'OrderedSet':
         """
@@ -79,14 +212,29 @@ class OrderedSet(Iterable):
             OrderedSet: A new OrderedSet with combined elements.
         """
         if not isinstance(other, OrderedSet):
-            raise TypeError(f'Can only add another {self.__class__.__name__}')
-        return self.__class__(list(self._data.keys()) + list(other._data.keys()))
+            return NotImplemented
+        new = self.copy()
+        for value in other:
+            new.add(value)
+        return new
+
+    def __or__(self, other: 'OrderedSet') -> 'OrderedSet':
+        """Returns the union of both sets, elements of this set first, as ``+`` does."""
+        if not isinstance(other, OrderedSet):
+            return NotImplemented
+        return self + other
+
+    def __and__(self, other: 'OrderedSet') -> 'OrderedSet':
+        """Returns a new OrderedSet with the elements of this set that are also in the other, in this set's order."""
+        if not isinstance(other, OrderedSet):
+            return NotImplemented
+        return self._from_unique(value for value in self if value in other._data)
 
     def __sub__(self, other: 'OrderedSet') -> 'OrderedSet':
         """Returns a new OrderedSet with elements that are in this set but not in the other."""
         if not isinstance(other, OrderedSet):
-            raise TypeError(f'Can only subtract another {self.__class__.__name__}')
-        return self.__class__([value for value in self if value not in other])
+            return NotImplemented
+        return self._from_unique(value for value in self if value not in other._data)
 
     def __contains__(self, value: Any) -> bool:
         """Checks if the value is in the set."""
@@ -94,15 +242,17 @@ class OrderedSet(Iterable):
 
     def __iter__(self) -> Iterator[Any]:
         """Returns an iterator over the set elements."""
-        return iter(self._data.keys())
+        if not self._holes:
+            return iter(self._items)
+        return (value for value in self._items if value is not _HOLE)
 
     def __reversed__(self) -> Iterator[Any]:
         """Returns a reverse iterator over the set elements."""
-        return reversed(self._data.keys())
+        return (value for value in reversed(self._items) if value is not _HOLE)
 
     def __repr__(self) -> str:
         """Returns a string representation of the custom set."""
-        return f"{self.__class__.__name__}({list(self._data.keys())})"
+        return f"{self.__class__.__name__}({list(self)})"
 
     def __len__(self) -> int:
         """Returns the number of elements in the set."""
@@ -110,17 +260,15 @@ class OrderedSet(Iterable):
 
     def __eq__(self, other: Any) -> bool:
         """Checks if this OrderedSet is equal to another OrderedSet, list, or set."""
-        if isinstance(other, OrderedSet):
-            return list(self._data.keys()) == list(other._data.keys())
-        elif isinstance(other, list):
-            return list(self._data.keys()) == other
+        if isinstance(other, (OrderedSet, list)):
+            return len(self) == len(other) and all(mine == theirs for mine, theirs in zip(self, other))
         elif isinstance(other, set):
-            return set(self._data.keys()) == other
+            return self._data.keys() == other
         return False
 
     def __hash__(self) -> int:
         """Returns a hash based on the set's elements."""
-        return hash(tuple(self._data.keys()))
+        return hash(tuple(self))
 
 
 class LastIndexOrderedSet(OrderedSet):
@@ -131,6 +279,4 @@ class LastIndexOrderedSet(OrderedSet):
 
     def add(self, value: Any) -> None:
         """Adds an element to the set, moving it to the end if it already exists."""
-        if value in self._data:
-            self.remove(value)  # Remove the value if it already exists.
-        super().add(value)  # Add it again, moving it to the end.
+        self.move_to_end(value)
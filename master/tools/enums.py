@@ -12,9 +12,16 @@ class Enum(enum.Enum):
         Raises:
             ValueError: If no matching enum member is found.
         """
-        for member in cls:
-            if member.value == value:
-                return member
+        # Members are indexed by value when the class is created, a lookup is a dict access
+        try:
+            return cls._value2member_map_[value]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable values can only be compared one member at a time
+            for member in cls:
+                if member.value == value:
+                    return member
         raise ValueError(f'{value} is not a valid value for {cls.__name__}')
 
     @classmethod
@@ -1,5 +1,25 @@
-from typing import Any, Type
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple, Type
+from weakref import WeakKeyDictionary
 import inspect
+import threading
+
+
+class _ResolvedMethod(NamedTuple):
+    """
+    Result of resolving a method name on a class, cached by ``_resolve``.
+    It holds no reference to the class, nor to its methods which may reference it, so the class can be collected.
+    """
+    bases: Tuple[Type[Any], ...]  # Bases of the class when resolved, new ones mean its MRO changed
+    version: int  # Value of ``_method_cache_version`` when resolved
+    name: str  # Mangled name
+    is_callable: bool
+    is_classmethod: bool
+
+
+# Resolved methods by class then method name, weakly keyed so that throwaway classes can still be collected
+_method_cache: 'WeakKeyDictionary[Type[Any], Dict[str, _ResolvedMethod]]' = WeakKeyDictionary()
+_method_cache_version = 0  # Bumped by ``clear_method_cache``, older results are ignored
+_method_cache_lock = threading.Lock()
 
 
 def _get_mangled_method_name(klass: Type[Any], method_name: str) -> str:
@@ -12,11 +32,59 @@ def _get_mangled_method_name(klass: Type[Any], method_name: str) -> str:
     """
     if method_name.startswith('__') and not method_name.endswith('__'):
         # Adjust for name-mangling (prepend _ClassName to method name)
-        class_name = klass.__class__.__name__ if isinstance(klass, object) else klass.__name__
+        class_name = klass.__name__ if isinstance(klass, type) else klass.__class__.__name__
         return f"_{class_name}{method_name}"
     return method_name
 
 
+def _resolve(klass: Type[Any], method_name: str) -> _ResolvedMethod:
+    """
+    Resolves a method name on a class once and caches the result.
+    A cached result is dropped when the bases of the class are replaced or when ``clear_method_cache`` is called,
+    which ``Meta`` does whenever it registers a class. Other changes, such as attributes assigned to or deleted
+    from an existing class or the bases of one of its ancestors being replaced, are not detected: code patching
+    classes must call ``clear_method_cache`` afterwards.
+    :param klass: The class on which to resolve the method.
+    :param method_name: The name of the method, before mangling.
+    :return: The resolved method.
+    """
+    version = _method_cache_version
+    methods = _method_cache.get(klass)
+    if methods is not None:
+        resolved = methods.get(method_name)
+        if resolved is not None and resolved.version == version and resolved.bases is klass.__bases__:
+            return resolved
+    name = _get_mangled_method_name(klass, method_name)
+    resolved = _ResolvedMethod(
+        bases=klass.__bases__,
+        version=version,
+        name=name,
+        is_callable=callable(getattr(klass, name, None)),
+        is_classmethod=isinstance(inspect.getattr_static(klass, name, None), classmethod))
+    with _method_cache_lock:
+        methods = _method_cache.get(klass)
+        if methods is None:
+            methods = _method_cache[klass] = {}
+        methods[method_name] = resolved
+    return resolved
+
+
+def clear_method_cache(klass: Optional[Type[Any]] = None) -> None:
+    """
+    Drops the resolved methods of a class and its subclasses, or of every class.
+    Methods being resolved while the whole cache is cleared are not reused either.
+    :param klass: The class whose methods changed, None to clear the whole cache.
+    """
+    global _method_cache_version
+    with _method_cache_lock:
+        if klass is None:
+            _method_cache_version += 1
+            _method_cache.clear()
+            return
+        for cached in [cached for cached in list(_method_cache.keys()) if issubclass(cached, klass)]:
+            del _method_cache[cached]
+
+
 def has_method(klass: Type[Any], method_name: str) -> bool:
     """
     Checks if a class or instance has a method with the given name.
@@ -24,9 +92,11 @@ def has_method(klass: Type[Any], method_name: str) -> bool:
     :param method_name: The name of the method to look for.
     :return: True if the method exists and is callable, False otherwise.
     """
-    # Use the mangled method name if applicable
-    method_name = _get_mangled_method_name(klass, method_name)
-    return hasattr(klass, method_name) and callable(getattr(klass, method_name))
+    if isinstance(klass, type):
+        return _resolve(klass, method_name).is_callable
+    # Instances may hold callables of their own, only the name mangling is cached for them
+    method_name = _resolve(type(klass), method_name).name
+    return callable(getattr(klass, method_name, None))
 
 
 def call_method(klass: Type[Any], method_name: str, *args, **kwargs) -> Any:
@@ -38,11 +108,9 @@ def call_method(klass: Type[Any], method_name: str, *args, **kwargs) -> Any:
     :param kwargs: Keyword arguments for the method.
     :return: The result of the method call if it exists, otherwise None.
     """
-    # Get the potentially mangled method name
-    method_name = _get_mangled_method_name(klass, method_name)
-    # Check and call the method if it exists
-    if has_method(klass, method_name):
-        return getattr(klass, method_name)(*args, **kwargs)
+    method = getattr(klass, _resolve(klass if isinstance(klass, type) else type(klass), method_name).name, None)
+    if callable(method):
+        return method(*args, **kwargs)
     return None
 
 
@@ -53,9 +121,7 @@ def is_classmethod(klass: Type[Any], method_name: str) -> bool:
     :param method_name: The name of the method to check.
     :return: True if the method is a class method, False otherwise.
     """
-    # Use inspect.getattr_static to get the raw method without triggering descriptors
-    method = inspect.getattr_static(klass, _get_mangled_method_name(klass, method_name), None)
-    return isinstance(method, classmethod)
+    return _resolve(klass if isinstance(klass, type) else type(klass), method_name).is_classmethod
 
 
 def call_classmethod(klass: Type[Any], method_name: str, *args, **kwargs) -> Any:
@@ -67,9 +133,24 @@ def call_classmethod(klass: Type[Any], method_name: str, *args, **kwargs) -> Any
     :param kwargs: Keyword arguments for the method.
     :return: The result of the method call if it exists, otherwise None.
     """
-    # Get the potentially mangled method name
-    method_name = _get_mangled_method_name(klass, method_name)
-    # Check and call the method if it exists
-    if is_classmethod(klass, method_name):
-        return getattr(klass, method_name)(*args, **kwargs)
+    resolved = _resolve(klass if isinstance(klass, type) else type(klass), method_name)
+    if resolved.is_classmethod:
+        return getattr(klass, resolved.name)(*args, **kwargs)
     return None
+
+
+def call_hooks(klasses: Iterable[Type[Any]], method_name: str, *args, **kwargs) -> Dict[Type[Any], Any]:
+    """
+    Calls a classmethod hook on many classes in one pass, skipping classes that do not define it.
+    :param klasses: The classes to call the hook on, in call order.
+    :param method_name: The name of the hook.
+    :param args: Positional arguments for the hook.
+    :param kwargs: Keyword arguments for the hook.
+    :return: The result of each class defining the hook, in call order.
+    """
+    results = {}
+    for klass in klasses:
+        resolved = _resolve(klass, method_name)
+        if resolved.is_classmethod:
+            results[klass] = getattr(klass, resolved.name)(*args, **kwargs)
+    return results
@@ -0,0 +1,8 @@
+import pytest
+from master.config import parser
+
+
+@pytest.fixture(autouse=True, scope='session')
+def configuration():
+    # The arguments of pytest are not the ERP ones, the default configuration is loaded instead
+    return parser.load([]).configuration
@@ -0,0 +1,189 @@
+import os
+import subprocess
+import sys
+import pytest
+from master.core import addons
+from master.core.addons import Addon, import_addon, resolve, sync_source
+from master.core.api import Meta
+from master.exceptions.addons import AddonDependencyError, AddonError, AddonNotFoundError
+
+GIT_IDENTITY = ('-c', 'user.name=Tests', '-c', 'user.email=tests@example.com')
+
+
+def git(*args, cwd=None):
+    return subprocess.run(('git',) + GIT_IDENTITY + args, cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(work, filename, content, message='Update'):
+    with open(os.path.join(work, filename), 'w') as file:
+        file.write(content)
+    git('add', filename, cwd=work)
+    git('commit', '--quiet', '-m', message, cwd=work)
+    git('push', '--quiet', 'origin', 'HEAD', cwd=work)
+    return git('rev-parse', 'HEAD', cwd=work)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """A bare repository with one commit on ``main``, and a working clone pushing to it."""
+    bare = str(tmp_path / 'remote.git')
+    work = str(tmp_path / 'work')
+    git('init', '--quiet', '--bare', '--initial-branch', 'main', bare)
+    git('clone', '--quiet', bare, work)
+    git('checkout', '--quiet', '-b', 'main', cwd=work)
+    commit(work, 'first.txt', 'first', 'First')
+    return bare, work
+
+
+@pytest.fixture
+def git_calls(monkeypatch):
+    calls = []
+    run = addons._git
+
+    def record(*args, cwd=None):
+        calls.append(args[0])
+        return run(*args, cwd=cwd)
+    monkeypatch.setattr(addons, '_git', record)
+    return calls
+
+
+def head(directory):
+    return git('rev-parse', 'HEAD', cwd=directory)
+
+
+def test_sync_source_clones(remote, tmp_path):
+    bare, work = remote
+    directory = sync_source(bare, str(tmp_path / 'sources'))
+    assert directory == addons.source_directory(bare, str(tmp_path / 'sources'))
+    assert head(directory) == head(work)
+    assert os.path.isfile(os.path.join(directory, 'first.txt'))
+    assert not [entry for entry in os.listdir(tmp_path / 'sources') if entry.startswith('.clone-')]
+
+
+def test_sync_source_updates(remote, tmp_path):
+    bare, work = remote
+    root = str(tmp_path / 'sources')
+    directory = sync_source(bare, root)
+    revision = commit(work, 'second.txt', 'second')
+    assert sync_source(bare, root) == directory
+    assert head(directory) == revision
+    assert os.path.isfile(os.path.join(directory, 'second.txt'))
+
+
+def test_sync_source_unchanged_remote(remote, tmp_path, git_calls):
+    bare, work = remote
+    root = str(tmp_path / 'sources')
+    directory = sync_source(bare, root)
+    git_calls.clear()
+    assert sync_source(bare, root) == directory
+    assert head(directory) == head(work)
+    assert 'fetch' not in git_calls and 'reset' not in git_calls
+
+
+def test_sync_source_branch(remote, tmp_path):
+    bare, work = remote
+    root = str(tmp_path / 'sources')
+    git('checkout', '--quiet', '-b', 'feature', cwd=work)
+    commit(work, 'feature.txt', 'feature')
+    git('checkout', '--quiet', 'main', cwd=work)
+    directory = sync_source(f'{bare}#feature', root)
+    assert os.path.isfile(os.path.join(directory, 'feature.txt'))
+
+    # Moving another branch leaves the checkout as it is, moving its own updates it
+    commit(work, 'main.txt', 'main')
+    assert sync_source(f'{bare}#feature', root) == directory
+    assert not os.path.exists(os.path.join(directory, 'main.txt'))
+    git('checkout', '--quiet', 'feature', cwd=work)
+    revision = commit(work, 'feature2.txt', 'feature')
+    sync_source(f'{bare}#feature', root)
+    assert head(directory) == revision
+    assert not os.path.exists(os.path.join(directory, 'main.txt'))
+
+
+def test_sync_source_relative_path(remote, tmp_path, monkeypatch):
+    bare, work = remote
+    monkeypatch.chdir(tmp_path)
+    root = str(tmp_path / 'sources')
+    directory = sync_source('remote.git', root)
+    revision = commit(work, 'second.txt', 'second')
+    assert sync_source('remote.git', root) == directory
+    assert head(directory) == revision
+
+
+def addon(name, *depends, installable=True):
+    return Addon(name, f'/addons/{name}', '1.0', depends, installable)
+
+
+def test_resolve_order():
+    available = {entry.name: entry for entry in (
+        addon('base'), addon('sale', 'base'), addon('stock', 'base'), addon('delivery', 'stock', 'sale'))}
+    assert resolve(['delivery'], available) == ['base', 'stock', 'sale', 'delivery']
+    assert resolve(['sale', 'stock', 'delivery'], available) == ['base', 'sale', 'stock', 'delivery']
+    assert resolve(['stock', 'sale', 'stock'], available) == ['base', 'stock', 'sale']
+
+
+def test_resolve_long_chain():
+    length = sys.getrecursionlimit() * 2
+    available = {str(index): addon(str(index), *([str(index - 1)] if index else [])) for index in range(length)}
+    assert resolve([str(length - 1)], available) == [str(index) for index in range(length)]
+
+
+def test_resolve_cycle():
+    available = {entry.name: entry for entry in (addon('a', 'b'), addon('b', 'c'), addon('c', 'a'))}
+    with pytest.raises(AddonDependencyError, match='a -> b -> c -> a'):
+        resolve(['a'], available)
+
+
+def test_resolve_missing():
+    available = {entry.name: entry for entry in (addon('sale', 'base'),)}
+    with pytest.raises(AddonNotFoundError, match='"base" not found, required by "sale"'):
+        resolve(['sale'], available)
+    with pytest.raises(AddonNotFoundError, match='"stock" not found$'):
+        resolve(['stock'], available)
+
+
+def test_resolve_not_installable():
+    available = {entry.name: entry for entry in (addon('sale', 'base'), addon('base', installable=False))}
+    with pytest.raises(AddonError, match='"base" is not installable'):
+        resolve(['sale'], available)
+
+
+def package(directory, name, content=''):
+    path = directory / name
+    path.mkdir()
+    (path / '__init__.py').write_text(content)
+    return Addon(name, str(path), '1.0', (), True)
+
+
+def test_import_addon_namespace(tmp_path):
+    import calendar
+    entry = package(tmp_path, 'calendar', (
+        'from master.core.api import Meta\n'
+        'class Event(metaclass=Meta):\n'
+        '    __meta_path__ = "tests.addons.event"\n'))
+    try:
+        import_addon(entry)
+        import_addon(entry)
+        assert sys.modules['calendar'] is calendar
+        module = sys.modules['master.addons.calendar']
+        assert module.__file__ == os.path.join(entry.path, '__init__.py')
+        assert Meta.addon_name(module.Event) == 'calendar'
+    finally:
+        sys.modules.pop('master.addons.calendar', None)
+
+
+def test_import_addon_clash(tmp_path):
+    first = package(tmp_path, 'shipping')
+    (tmp_path / 'other').mkdir()
+    second = package(tmp_path / 'other', 'shipping')
+    try:
+        import_addon(first)
+        with pytest.raises(AddonError, match='clashes'):
+            import_addon(second)
+    finally:
+        sys.modules.pop('master.addons.shipping', None)
+
+
+def test_import_addon_invalid_name(tmp_path):
+    with pytest.raises(AddonError, match='not a valid Python identifier'):
+        import_addon(package(tmp_path, 'my-addon'))
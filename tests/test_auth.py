@@ -0,0 +1,37 @@
+import pytest
+from master.exceptions.auth import AuthenticationError
+from master.service.auth import issue_token, verify_token
+
+SECRET = 'secret'
+
+
+def test_round_trip():
+    assert verify_token(issue_token(42, SECRET, now=1000), SECRET, now=1500) == 42
+
+
+def test_expired():
+    token = issue_token(42, SECRET, ttl=60, now=1000)
+    with pytest.raises(AuthenticationError, match='expired'):
+        verify_token(token, SECRET, now=1060)
+
+
+def test_forged():
+    user_id, expires, signature = issue_token(42, SECRET).split('.')
+    with pytest.raises(AuthenticationError, match='signature'):
+        verify_token(f'1.{expires}.{signature}', SECRET)
+    with pytest.raises(AuthenticationError, match='signature'):
+        verify_token(issue_token(42, 'other'), SECRET)
+
+
+@pytest.mark.parametrize('token', ['', '42', '42.99999999999', '42.99999999999.', 'a.99999999999.abc',
+                                   '1.99999999999.é', '1.99999999999.' + 'é' * 64, '².99999999999.abc'])
+def test_malformed(token):
+    with pytest.raises(AuthenticationError):
+        verify_token(token, SECRET)
+
+
+def test_no_secret():
+    with pytest.raises(AuthenticationError, match='auth_secret'):
+        issue_token(42, '')
+    with pytest.raises(AuthenticationError, match='auth_secret'):
+        verify_token('42.99999999999.abc', '')
@@ -0,0 +1,128 @@
+import threading
+import time
+import pytest
+from master.tools.cache import LRUCache, TTLCache, memoize
+
+
+def test_concurrent_misses_compute_once():
+    cache = LRUCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute))) for _ in range(8)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # The followers are waiting on the flight of the first miss
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert cache.get('key') == 'value'
+
+
+def test_concurrent_misses_share_the_error():
+    cache = LRUCache()
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise ValueError('failed')
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute('key', compute)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 4 and len({id(error) for error in errors}) == 1
+    assert cache.get('key', None) is None
+
+
+@pytest.mark.parametrize('key', ['key', None])
+def test_invalidation_during_compute_is_not_stored(key):
+    cache = LRUCache()
+
+    def compute():
+        # The data the value is computed from changes meanwhile
+        if key is None:
+            cache.invalidate()
+        else:
+            cache.invalidate(key)
+        return 'stale'
+    assert cache.get_or_compute('key', compute) == 'stale'
+    assert cache.get('key', None) is None
+    assert cache.get_or_compute('key', lambda: 'fresh') == 'fresh'
+    assert cache.get('key') == 'fresh'
+
+
+def test_set_after_invalidation_is_ignored():
+    cache = LRUCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.set('key', 'stale', generation)
+    assert len(cache) == 0
+    cache.set('key', 'fresh', cache.generation)
+    assert cache.get('key') == 'fresh'
+
+
+def test_eviction_by_size():
+    cache = LRUCache(max_size=10, sizeof=len)
+    cache.set('a', 'xxxx')
+    cache.set('b', 'xxxx')
+    assert cache.get('a') == 'xxxx'  # b becomes the least recently used
+    cache.set('c', 'xxx')
+    assert cache.get('b', None) is None
+    assert (cache.get('a'), cache.get('c')) == ('xxxx', 'xxx')
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2, 'weight': 7}
+    # Values heavier than the whole cache are not stored, and replace the previous value of their key
+    cache.set('a', 'x' * 11)
+    assert cache.get('a', None) is None and cache.weight == 3
+
+
+def test_disabled_cache_computes_every_time():
+    cache = LRUCache(max_size=0)
+    calls = []
+    for _ in range(2):
+        cache.get_or_compute('key', lambda: calls.append(1))
+    assert len(calls) == 2 and len(cache) == 0
+
+
+def test_ttl_expiry():
+    cache = TTLCache(ttl=0.01)
+    cache.set('key', None)
+    assert cache.get('key') is None and cache.hits == 1
+    time.sleep(0.02)
+    assert cache.get('key', 'expired') == 'expired'
+
+
+def test_memoize():
+    calls = []
+
+    @memoize(max_size=2)
+    def square(value, power=2):
+        calls.append(value)
+        return value ** power
+    assert [square(2), square(2), square(2, power=3), square(2, power=3)] == [4, 4, 8, 8]
+    assert calls == [2, 2]
+    square.cache.invalidate()
+    assert square(2) == 4 and calls == [2, 2, 2]
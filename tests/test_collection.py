@@ -0,0 +1,95 @@
+import random
+import pytest
+from master.tools.collection import LastIndexOrderedSet, OrderedSet
+
+
+def check(ordered_set, expected):
+    assert list(ordered_set) == expected
+    assert list(reversed(ordered_set)) == expected[::-1]
+    assert len(ordered_set) == len(expected)
+    assert [ordered_set.index(value) for value in expected] == list(range(len(expected)))
+    assert [ordered_set[index] for index in range(len(expected))] == expected
+    assert [ordered_set[index] for index in range(-len(expected), 0)] == expected
+    assert ordered_set[1:-1] == expected[1:-1]
+
+
+def test_order():
+    ordered_set = OrderedSet([3, 1, 2, 1, 3])
+    check(ordered_set, [3, 1, 2])
+    ordered_set.add(0)
+    ordered_set.add(1)
+    check(ordered_set, [3, 1, 2, 0])
+    assert ordered_set.index(4) == -1
+    assert OrderedSet('ab') == ['ab'] and OrderedSet(5) == [5]
+
+
+def test_removal():
+    ordered_set = OrderedSet(range(10))
+    for value in (0, 9, 4, 5):
+        ordered_set.remove(value)
+    check(ordered_set, [1, 2, 3, 6, 7, 8])
+    with pytest.raises(KeyError):
+        ordered_set.remove(4)
+    ordered_set.add(4)
+    check(ordered_set, [1, 2, 3, 6, 7, 8, 4])
+
+
+def test_positional_access_out_of_range():
+    ordered_set = OrderedSet(range(5))
+    ordered_set.remove(2)
+    for index in (4, -5):
+        with pytest.raises(IndexError):
+            ordered_set[index]
+
+
+def test_last_index_moves_to_end():
+    ordered_set = LastIndexOrderedSet(range(5))
+    ordered_set.add(1)
+    ordered_set.add(4)
+    ordered_set.add(5)
+    check(ordered_set, [0, 2, 3, 1, 4, 5])
+
+
+def test_random_operations():
+    generator = random.Random(1234)
+    for ordered_set_class in (OrderedSet, LastIndexOrderedSet):
+        ordered_set, expected = ordered_set_class(), []
+        for step in range(3000):
+            value = generator.randrange(100)
+            operation = generator.random()
+            if operation < 0.4:
+                ordered_set.add(value)
+                if ordered_set_class is LastIndexOrderedSet and value in expected:
+                    expected.remove(value)
+                if value not in expected:
+                    expected.append(value)
+            elif operation < 0.6 and value in expected:
+                ordered_set.remove(value)
+                expected.remove(value)
+            elif operation < 0.7:
+                ordered_set.move_to_end(value)
+                if value in expected:
+                    expected.remove(value)
+                expected.append(value)
+            elif expected:
+                index = generator.randrange(len(expected))
+                assert ordered_set[index] == expected[index]
+                assert ordered_set.index(expected[index]) == index
+            if step % 500 == 0:
+                check(ordered_set, expected)
+        check(ordered_set, expected)
+
+
+def test_operators():
+    first, second = OrderedSet([1, 2, 3]), OrderedSet([3, 4, 1])
+    assert first + second == [1, 2, 3, 4]
+    assert first | second == [1, 2, 3, 4]
+    assert first & second == [1, 3]
+    assert first - second == [2]
+    assert first == {1, 2, 3} and first != (1, 2, 3)
+    for operator in ('__add__', '__or__', '__and__', '__sub__'):
+        assert getattr(first, operator)([1]) is NotImplemented
+    with pytest.raises(TypeError):
+        first - [1]
+    with pytest.raises(TypeError):
+        first | {1}
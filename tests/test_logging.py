@@ -0,0 +1,40 @@
+import logging
+import os
+from unittest import mock
+from master.config.logging import RotatingBatchFileHandler
+
+
+def emit(handler, count, message='hello world'):
+    for _ in range(count):
+        handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.WARNING}))
+
+
+def test_no_rotation_checks_nothing_per_record(tmp_path):
+    handler = RotatingBatchFileHandler(str(tmp_path / 'erp.log'))
+    try:
+        with mock.patch('os.path.exists') as exists, mock.patch('os.path.isfile') as isfile:
+            emit(handler, 10)
+        assert exists.call_count == isfile.call_count == 0
+    finally:
+        handler.close()
+    assert (tmp_path / 'erp.log').read_text() == 'hello world\n' * 10
+
+
+def test_rotation_by_size_formats_once(tmp_path):
+    handler = RotatingBatchFileHandler(str(tmp_path / 'erp.log'), max_bytes=50, backup_count=2)
+    try:
+        with mock.patch.object(logging.Formatter, 'format', autospec=True, side_effect=lambda self, record: record.msg) as format:
+            emit(handler, 10)
+        assert format.call_count == 10
+    finally:
+        handler.close()
+    assert sorted(os.listdir(tmp_path)) == ['erp.log', 'erp.log.1', 'erp.log.2']
+    assert all(os.path.getsize(tmp_path / name) <= 50 for name in os.listdir(tmp_path))
+
+
+def test_special_files_are_not_rotated():
+    handler = RotatingBatchFileHandler(os.devnull, max_bytes=1)
+    try:
+        assert not handler.shouldRollover(logging.makeLogRecord({'msg': 'hello world'}))
+    finally:
+        handler.close()
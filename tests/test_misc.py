@@ -0,0 +1,73 @@
+import gc
+import weakref
+from master.tools import misc
+from master.tools.misc import call_classmethod, call_hooks, call_method, clear_method_cache, has_method, is_classmethod
+
+
+class Base:
+    @classmethod
+    def hook(cls, value):
+        return ('base', value)
+
+    def __private(self):
+        return 'private'
+
+    def plain(self):
+        return 'plain'
+
+
+class Child(Base):
+    @classmethod
+    def hook(cls, value):
+        return ('child', value)
+
+
+def test_cache_hit():
+    clear_method_cache()
+    assert call_classmethod(Child, 'hook', 1) == ('child', 1)
+    resolved = misc._method_cache[Child]['hook']
+    assert call_classmethod(Child, 'hook', 2) == ('child', 2)
+    assert misc._method_cache[Child]['hook'] is resolved
+    assert call_method(Base(), '__private') == 'private'
+    assert misc._method_cache[Base]['__private'].name == '_Base__private'
+    assert has_method(Base, 'plain') and not is_classmethod(Base, 'plain')
+
+
+def test_cache_miss():
+    clear_method_cache()
+    assert call_classmethod(Base, 'missing') is None
+    assert not misc._method_cache[Base]['missing'].is_callable
+    # Replacing the bases of a class invalidates its entries
+    class Other:
+        @classmethod
+        def hook(cls, value):
+            return ('other', value)
+
+    class Patched(Base):
+        pass
+    assert call_classmethod(Patched, 'hook', 1) == ('base', 1)
+    Patched.__bases__ = (Other,)
+    assert call_classmethod(Patched, 'hook', 1) == ('other', 1)
+    # Patching a class is picked up once the cache is cleared
+    Base.missing = classmethod(lambda cls: 'added')
+    try:
+        assert call_classmethod(Base, 'missing') is None
+        clear_method_cache(Base)
+        assert call_classmethod(Base, 'missing') == 'added'
+    finally:
+        del Base.missing
+        clear_method_cache()
+
+
+def test_call_hooks_skips_classes_without_the_hook():
+    assert call_hooks([Base, Child, object], 'hook', 3) == {Base: ('base', 3), Child: ('child', 3)}
+
+
+def test_cached_classes_are_collected():
+    class Throwaway(Base):
+        pass
+    call_classmethod(Throwaway, 'hook', 1)
+    reference = weakref.ref(Throwaway)
+    del Throwaway
+    gc.collect()
+    assert reference() is None
@@ -0,0 +1,89 @@
+import json
+import pytest
+from master.core.api import Meta, classes
+from master.core.orm.model import Model
+from master.core.orm.session import Session, _json
+
+
+class Cursor:
+    """Records the executed statements and returns the given results in turn."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append(params)
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+class Partner(Model):
+    __table__ = 'test_partner'
+    __slots__ = ('id', 'name')
+
+
+class Document(Model):
+    __table__ = 'test_document'
+    __slots__ = ('id', 'content')
+
+
+def test_extended_model_composes_across_reset():
+    class Contact(Model):
+        __table__ = 'test_contact'
+        __slots__ = ('id', 'name')
+
+    class ContactEmail(Contact):
+        __slots__ = ('email',)
+
+    composed = Meta.compose('core.orm.test_contact')
+    assert composed.__fields__ == ('id', 'name', 'email')
+    Meta.reset_compositions()
+    assert Meta.compose('core.orm.test_contact') is composed
+    assert classes['core.orm.test_contact'] == [Contact, ContactEmail]
+
+
+def test_insert_matches_rows_on_reserved_keys():
+    # Rows come back in another order than the records were sent
+    cursor = Cursor([(10,), (11,), (12,)], [(12, 'c'), (10, 'a'), (11, 'b')])
+    session = Session(cursor, debug=False)
+    records = [session.add(Partner(name=name)) for name in 'abc']
+    session.flush()
+    assert [(record.id, record.name) for record in records] == [(10, 'a'), (11, 'b'), (12, 'c')]
+    assert json.loads(cursor.executed[1][0]) == [{'id': 10, 'name': 'a'}, {'id': 11, 'name': 'b'}, {'id': 12, 'name': 'c'}]
+    assert all(record._stored and not record._dirty for record in records)
+    assert session.get(Partner, 11) is records[1]
+
+
+def test_insert_matches_rows_on_assigned_keys():
+    cursor = Cursor([(2, 'b'), (1, 'a')])
+    session = Session(cursor, debug=False)
+    first, second = session.add(Partner(id=1, name='x')), session.add(Partner(id=2, name='y'))
+    session.flush()
+    assert (first.name, second.name) == ('a', 'b')
+    assert len(cursor.executed) == 1
+
+
+def test_insert_without_sequence_inserts_one_by_one():
+    cursor = Cursor([], [(1, 'a')], [(2, 'b')])
+    session = Session(cursor, debug=False)
+    records = [session.add(Partner(name=name)) for name in 'ab']
+    session.flush()
+    assert [(record.id, record.name) for record in records] == [(1, 'a'), (2, 'b')]
+    assert [json.loads(params[0]) for params in cursor.executed[1:]] == [[{'name': 'a'}], [{'name': 'b'}]]
+
+
+def test_insert_unmatched_row():
+    cursor = Cursor([('1', 'a')])
+    session = Session(cursor, debug=False)
+    session.add(Partner(id=1, name='a'))
+    with pytest.raises(ValueError, match='matches no record'):
+        session.flush()
+
+
+def test_json_encodes_binary_values():
+    document = Document(id=1, content=b'\x00\xffab')
+    assert json.loads(_json([document], ('content',))) == [{'content': '\\x00ff6162'}]
+    document.content = memoryview(b'\x01')
+    assert json.loads(_json([document], ('content',))) == [{'content': '\\x01'}]
@@ -0,0 +1,26 @@
+from master.core.api import Meta, classes
+from master.service.pipeline import Job, _job_class
+
+
+def test_extended_job_composes_across_reset():
+    class Count(Job):
+        __job__ = 'test_count'
+
+        def run(self, items, **params):
+            return len(items)
+
+    class CountTwice(Count):
+        def run(self, items, **params):
+            return super().run(items, **params) * 2
+
+    job_class = _job_class('test_count')
+    assert job_class(None).run([1, 2]) == 4
+    Meta.reset_compositions()
+    assert _job_class('test_count') is job_class
+    assert classes['service.pipeline.test_count'] == [Count, CountTwice]
+
+    class CountThrice(Count):
+        def run(self, items, **params):
+            return super().run(items, **params) * 3
+
+    assert _job_class('test_count')(None).run([1, 2]) == 12
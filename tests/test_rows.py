@@ -0,0 +1,84 @@
+import pickle
+from collections import namedtuple
+import pytest
+from master.core.rows import Record, fetch_columns, record_class
+
+Column = namedtuple('Column', ('name', 'type_code'))
+INT4, INT8, FLOAT8, BOOL, TEXT = 23, 20, 701, 16, 25
+
+
+class Cursor:
+    """Cursor returning the given rows, ``description`` is only set after the first fetch for named cursors."""
+
+    def __init__(self, description, rows, name=None, itersize=2):
+        self.name = name
+        self.itersize = itersize
+        self.description = None if name else description
+        self._description = description
+        self._rows = list(rows)
+        self.fetches = []
+
+    def fetchmany(self, size):
+        self.description = self._description
+        self.fetches.append(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+
+def test_record_class():
+    klass = record_class(('user_id', 'role'))
+    assert record_class(('user_id', 'role')) is klass
+    row = klass(1, 'admin')
+    assert (row.user_id, row.role, row[0], row['role'], tuple(row), len(row)) == (1, 'admin', 1, 'admin', (1, 'admin'), 2)
+    assert row[:1] == (1,)
+    assert row._asdict() == {'user_id': 1, 'role': 'admin'}
+    assert row == klass(1, 'admin') and row != klass(2, 'admin') and hash(row) == hash((1, 'admin'))
+    assert repr(row) == "Record(user_id=1, role='admin')"
+    assert pickle.loads(pickle.dumps(row)) == row
+    assert not hasattr(row, '__dict__')
+    with pytest.raises(KeyError):
+        row['missing']
+
+
+def test_record_class_sanitizes_names():
+    row = record_class(('count(*)', 'id', 'id', 'class', '1st', '_fields'))(5, 1, 2, 'a', 'b', 'c')
+    assert (row.count, row.id, row.id_2, row.f_class, row.f_1st, row.fields) == (5, 1, 2, 'a', 'b', 'c')
+    assert row['count(*)'] == 5 and row._fields == ('count(*)', 'id', 'id', 'class', '1st', '_fields')
+    assert tuple(record_class(('only',))(1)) == (1,)
+    assert tuple(record_class(())()) == ()
+    assert issubclass(record_class(('a',)), Record)
+
+
+def test_fetch_columns():
+    description = [Column('id', INT4), Column('score', FLOAT8), Column('active', BOOL), Column('name', TEXT),
+                   Column('id', INT8)]
+    rows = [(1, 0.5, True, 'a', 10), (2, 1.5, False, 'b', 20), (3, 2.5, True, 'c', 30)]
+    cursor = Cursor(description, rows)
+    columns = fetch_columns(cursor)
+    assert list(columns) == ['id', 'score', 'active', 'name', 'id_2']
+    assert isinstance(columns['id'], memoryview) and columns['id'].format == 'i'
+    assert columns['id'].tolist() == [1, 2, 3]
+    assert columns['score'].tolist() == [0.5, 1.5, 2.5]
+    assert columns['active'].tolist() == [1, 0, 1]
+    assert columns['name'] == ['a', 'b', 'c']
+    assert columns['id_2'].format == 'q' and columns['id_2'].tolist() == [10, 20, 30]
+    assert cursor.fetches == [2, 2, 2]
+
+
+def test_fetch_columns_nulls_and_overflow():
+    description = [Column('value', INT4), Column('big', INT4)]
+    cursor = Cursor(description, [(1, 1), (None, 2), (3, 2 ** 40)], itersize=1)
+    columns = fetch_columns(cursor)
+    assert columns == {'value': [1, None, 3], 'big': [1, 2, 2 ** 40]}
+
+
+def test_fetch_columns_named_cursor():
+    cursor = Cursor([Column('id', INT4)], [(1,), (2,), (3,)], name='stream')
+    assert fetch_columns(cursor, batch_size=2)['id'].tolist() == [1, 2, 3]
+    assert cursor.fetches == [2, 2, 2]
+
+
+def test_fetch_columns_without_result():
+    cursor = Cursor(None, [])
+    assert fetch_columns(cursor) == {}
+    assert cursor.fetches == []
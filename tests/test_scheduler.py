@@ -0,0 +1,30 @@
+from master.core.api import Meta, classes
+from master.service.scheduler import Task, registered_tasks
+
+
+def test_overridden_task_composes_across_reset():
+    attached = []
+
+    class Refresh(Task):
+        __task__ = 'test_refresh'
+        interval = 60
+
+        @classmethod
+        def _attach_klass(cls):
+            attached.append(cls.__name__)
+
+    class RefreshOverride(Refresh):
+        interval = 30
+
+    composed = Meta.compose('service.scheduler.test_refresh')
+    assert composed.interval == 30
+    Meta.reset_compositions()
+    assert Meta.compose('service.scheduler.test_refresh') is composed
+    assert classes['service.scheduler.test_refresh'] == [Refresh, RefreshOverride]
+    assert attached == ['Refresh', 'RefreshOverride']
+
+    class RefreshLate(Refresh):
+        interval = 10
+
+    assert Meta.compose('service.scheduler.test_refresh').interval == 10
+    assert 'test_refresh' in registered_tasks()
@@ -0,0 +1,68 @@
+import os
+import struct
+import pytest
+from master.exceptions.http import WebSocketError
+from master.service.websocket import (CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG, OP_BINARY, OP_CONTINUATION, OP_TEXT,
+                                      encode_frame, parse_frame)
+
+MAX_SIZE = 1 << 20
+
+
+def client_frame(payload, opcode=OP_TEXT, fin=True, mask=b'\x12\x34\x56\x78'):
+    """Returns a frame as sent by clients, masked with the given key."""
+    frame = bytearray(encode_frame(payload, opcode))
+    if not fin:
+        frame[0] &= 0x7F
+    if mask is None:
+        return frame
+    frame[1] |= 0x80
+    header = len(frame) - len(payload)
+    return frame[:header] + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+@pytest.mark.parametrize('length', [0, 1, 5, 125, 126, 1000, 65535, 65536, 70000])
+def test_masked_frame_lengths(length):
+    payload = os.urandom(length)
+    buffer = bytearray(client_frame(payload, OP_BINARY))
+    header = 2 if length < 126 else 4 if length < 65536 else 10
+    assert buffer[1] & 0x7F == (length if length < 126 else 126 if length < 65536 else 127)
+    assert len(buffer) == header + 4 + length
+    assert parse_frame(buffer, MAX_SIZE) == (True, OP_BINARY, payload)
+    assert buffer == bytearray()
+
+
+def test_fragments_and_consecutive_frames():
+    buffer = bytearray(client_frame(b'hel', fin=False) + client_frame(b'lo', OP_CONTINUATION, mask=b'\xff\x00\xff\x00'))
+    assert parse_frame(buffer, MAX_SIZE) == (False, OP_TEXT, b'hel')
+    assert parse_frame(buffer, MAX_SIZE) == (True, OP_CONTINUATION, b'lo')
+    assert parse_frame(buffer, MAX_SIZE) is None
+
+
+@pytest.mark.parametrize('length', [10, 300, 70000])
+def test_truncated_input(length):
+    frame = bytes(client_frame(b'x' * length))
+    for size in range(len(frame)):
+        buffer = bytearray(frame[:size])
+        assert parse_frame(buffer, MAX_SIZE) is None
+        assert buffer == frame[:size]
+        # Skipping most prefixes of long frames, only the headers matter
+        if size > 20:
+            break
+    buffer = bytearray(frame[:-1])
+    assert parse_frame(buffer, MAX_SIZE) is None and len(buffer) == len(frame) - 1
+    buffer.append(frame[-1])
+    assert parse_frame(buffer, MAX_SIZE) == (True, OP_TEXT, b'x' * length)
+
+
+def test_unmasked_frame():
+    with pytest.raises(WebSocketError) as error:
+        parse_frame(bytearray(client_frame(b'hello', mask=None)), MAX_SIZE)
+    assert error.value.code == CLOSE_PROTOCOL_ERROR
+
+
+def test_frame_too_big():
+    # Rejected as soon as the header is read, before the payload arrives
+    header = bytearray(struct.pack('!BBQ', 0x81, 0x80 | 127, MAX_SIZE + 1))
+    with pytest.raises(WebSocketError) as error:
+        parse_frame(header, MAX_SIZE)
+    assert error.value.code == CLOSE_TOO_BIG